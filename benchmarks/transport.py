@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Compares replication transports over loopback.
+
+A test stream is piped from the local host to HOST (localhost by default) through the same
+send and receive filters that push/pull use, with every variant given on the command line.
+zfs itself is not involved, so this measures transport throughput only.
+
+  python3 benchmarks/transport.py --size 2G ssh zstd:1 zstd:3 lz4 cipher:aes128-gcm@openssh.com tcp
+"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from subprocess import PIPE, DEVNULL
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from zfsnappr.zfs import LocalZfsCli, RemoteZfsCli
+from zfsnappr.transport import Transport, parse_compression
+from zfsnappr.utils import parse_size, format_size
+
+
+def make_input(path: str, size: int) -> None:
+  """Alternates incompressible and compressible blocks, roughly like a dataset with mixed content"""
+  block = 1 << 20
+  with open(path, 'wb') as f:
+    written = 0
+    while written < size:
+      n = min(block, size - written)
+      f.write(os.urandom(n) if (written // block) % 2 == 0 else bytes(n))
+      written += n
+
+
+def run(variant: str, path: str, host: str, port: int) -> float:
+  """Returns the duration of transferring the file"""
+  cipher = None
+  transport = Transport()
+  if variant.startswith('cipher:'):
+    cipher = variant.removeprefix('cipher:')
+  elif variant == 'tcp':
+    transport = Transport(tcp_port=port)
+  elif variant != 'ssh':
+    transport = Transport(compression=parse_compression(variant))
+
+  source = LocalZfsCli()
+  dest = RemoteZfsCli(host, user=None, port=None, cipher=cipher)
+  send_filters, recv_filters = transport.filters(source.host, dest.host)
+  sink = ['dd', 'of=/dev/null', 'bs=1M', 'status=none']
+
+  start = time.monotonic()
+  if transport.tcp_port is None:
+    send = source.start_pipeline([['cat', path], *send_filters], stdout=PIPE)
+    recv = dest.start_pipeline([*recv_filters, sink], stdin=send.stdout)
+    assert send.stdout is not None
+    send.stdout.close()
+  else:
+    recv = dest.start_pipeline([*recv_filters, sink], stdin=DEVNULL)
+    send = source.start_pipeline([['cat', path], *send_filters], stdout=DEVNULL)
+  for p in send, recv:
+    if p.wait() != 0:
+      raise RuntimeError(f'Variant {variant} failed: {p.args}')
+  return time.monotonic() - start
+
+
+def main() -> None:
+  parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('variants', nargs='+', metavar='VARIANT', help='ssh, tcp, zstd[:LEVEL], lz4[:LEVEL] or cipher:CIPHER')
+  parser.add_argument('--host', default='localhost')
+  parser.add_argument('--size', type=parse_size, default=parse_size('512M'))
+  parser.add_argument('--tcp-port', type=int, default=9090)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, 'stream')
+    make_input(path, args.size)
+    print(f'{"variant":<40} {"best":>8} {"throughput":>12}')
+    for variant in args.variants:
+      best = min(run(variant, path, args.host, args.tcp_port) for _ in range(args.repeat))
+      print(f'{variant:<40} {best:>7.2f}s {format_size(int(args.size / best)) + "/s":>12}')
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,8 @@
 from __future__ import annotations
 import argparse
 
+from .locking import DEFAULT_LOCK_DIR
+
 from . import (
   prune as _prune,
   create as _create,
@@ -8,6 +10,9 @@ from . import (
   pull as _pull,
   list as _list,
   tag as _tag,
+  query as _query,
+  refresh as _refresh,
+  status as _status,
   version as _version
 )
 
@@ -19,6 +24,20 @@ def get_args() -> argparse.Namespace:
   parser.add_argument('-d', '--dataset', type=str, metavar="DATASET")
   parser.add_argument('-r', '--recursive', action='store_true')
   parser.add_argument('-n', '--dry-run', action='store_true')
+  parser.add_argument('--trace', action='store_true', help='print a summary of all CLI calls at exit')
+  parser.add_argument('--profile', type=str, metavar='PATH', help='profile the run with cProfile and write the stats to PATH')
+  session = parser.add_mutually_exclusive_group()
+  session.add_argument('--record', type=str, metavar='PATH', help='record every CLI call and its output to PATH')
+  session.add_argument('--replay', type=str, metavar='PATH', help='serve CLI calls from a recording instead of running them')
+  parser.add_argument('--lock-dir', type=str, metavar='PATH', default=DEFAULT_LOCK_DIR)
+  parser.add_argument('--lock-timeout', type=float, metavar='SECONDS', help='fail if dataset locks cannot be acquired in time, instead of waiting')
+  parser.add_argument('--anonymize', action='store_true', help='hash dataset, snapshot and host names in the recording')
+  parser.add_argument('--catalog', type=str, metavar='PATH', help='SQLite database that records every snapshot seen, for query')
+  parser.add_argument('--listing-cache', type=str, metavar='DIR', help='reuse snapshot listings of datasets whose snapshots did not change, cached in DIR')
+  parser.add_argument('--log-format', choices=['text', 'json'], default='text')
+  parser.add_argument('--log-queue', action='store_true', help='write log output from a background thread, so that a slow terminal does not slow down the run')
+  parser.add_argument('--log-detail-rate', type=float, metavar='N', help='log at most N per-item progress messages per second')
+  parser.add_argument('--metrics-file', type=str, metavar='PATH', help='write metrics of the run to PATH in Prometheus text format')
 
   # create subcommand parsers
   _list.argparser.setup(subparsers.add_parser('list'))
@@ -27,6 +46,9 @@ def get_args() -> argparse.Namespace:
   _push.argparser.setup(subparsers.add_parser('push'))
   _pull.argparser.setup(subparsers.add_parser('pull'))
   _tag.argparser.setup(subparsers.add_parser('tag'))
+  _query.argparser.setup(subparsers.add_parser('query'))
+  _refresh.argparser.setup(subparsers.add_parser('refresh'))
+  _status.argparser.setup(subparsers.add_parser('status'))
   _version.argparser.setup(subparsers.add_parser('version'))
 
   return parser.parse_args()
@@ -8,3 +8,16 @@ class Args(Protocol):
   dataset: Optional[str]
   recursive: bool
   dry_run: bool
+  trace: bool
+  profile: Optional[str]
+  record: Optional[str]
+  replay: Optional[str]
+  anonymize: bool
+  lock_dir: str
+  lock_timeout: Optional[float]
+  catalog: Optional[str]
+  listing_cache: Optional[str]
+  log_format: str
+  log_queue: bool
+  log_detail_rate: Optional[float]
+  metrics_file: Optional[str]
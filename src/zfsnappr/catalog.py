@@ -0,0 +1,247 @@
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+from collections.abc import Collection, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+if TYPE_CHECKING:
+  # zfs depends on this module
+  from .zfs import Snapshot
+
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+  host TEXT NOT NULL,
+  dataset TEXT NOT NULL,
+  shortname TEXT NOT NULL,
+  guid TEXT NOT NULL,  -- GUIDs exceed the signed 64 bit integers of SQLite
+  creation INTEGER NOT NULL,
+  tags TEXT,  -- comma-separated, NULL if unset
+  holds INTEGER NOT NULL,
+  seen INTEGER NOT NULL,
+  PRIMARY KEY (host, dataset, shortname)
+);
+CREATE INDEX IF NOT EXISTS snapshots_guid ON snapshots (guid);
+CREATE INDEX IF NOT EXISTS snapshots_creation ON snapshots (host, dataset, creation);
+
+CREATE TABLE IF NOT EXISTS datasets (
+  host TEXT NOT NULL,
+  dataset TEXT NOT NULL,
+  listed INTEGER NOT NULL,
+  PRIMARY KEY (host, dataset)
+);
+
+CREATE TABLE IF NOT EXISTS replications (
+  source_host TEXT NOT NULL,
+  source_dataset TEXT NOT NULL,
+  dest_host TEXT NOT NULL,
+  dest_dataset TEXT NOT NULL,
+  guid TEXT NOT NULL,  -- newest replicated snapshot
+  replicated INTEGER NOT NULL,
+  PRIMARY KEY (source_host, source_dataset, dest_host, dest_dataset)
+);
+'''
+
+
+def host_key(host: Optional[str]) -> str:
+  return host if host is not None else 'localhost'
+
+
+def _scope(dataset: Optional[str], recursive: bool, column: str = 'dataset') -> tuple[str, list]:
+  """SQL condition and parameters that select dataset and, if recursive, its descendants. None selects all datasets."""
+  if dataset is None:
+    return '1', []
+  if not recursive:
+    return f'{column} = ?', [dataset]
+  # LIKE would treat _ and % in dataset names as wildcards
+  return f'({column} = ? OR substr({column}, 1, ?) = ?)', [dataset, len(dataset) + 1, dataset + '/']
+
+
+@dataclass
+class DatasetRow:
+  host: str
+  dataset: str
+  snapshots: int
+  newest: Optional[int]  # creation of the newest snapshot
+  listed: int
+
+
+@dataclass
+class SnapshotRow:
+  host: str
+  dataset: str
+  shortname: str
+  guid: int
+  creation: int
+  tags: Optional[list[str]]
+  holds: int
+  seen: int
+
+
+@dataclass
+class ReplicationRow:
+  source_host: str
+  source_dataset: str
+  dest_host: str
+  dest_dataset: str
+  replicated: int
+  replicated_creation: Optional[int]  # creation of the newest replicated snapshot
+  source_newest: Optional[int]  # creation of the newest source snapshot
+
+
+class Catalog:
+  """
+  Local SQLite database of the snapshots, datasets and replications that zfsnappr has seen, on all hosts.
+  Disabled unless opened, in which case recording costs nothing.
+  Listings replace what is known about the listed datasets, creates, destroys and transfers update it.
+  """
+  _db: Optional[sqlite3.Connection]
+  _lock: threading.Lock
+
+  def __init__(self) -> None:
+    self._db = None
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return self._db is not None
+
+  def open(self, path: str) -> None:
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    # several zfsnappr processes may record at once
+    db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(SCHEMA)
+    self._db = db
+
+  def close(self) -> None:
+    if self._db is not None:
+      self._db.close()
+      self._db = None
+
+  @contextmanager
+  def _transaction(self) -> Iterator[sqlite3.Connection]:
+    assert self._db is not None
+    with self._lock, self._db:
+      yield self._db
+
+  def record_listing(
+    self, host: Optional[str], dataset: Optional[str], recursive: bool, snapshots: Collection[Snapshot],
+    datasets: Optional[Collection[str]] = None
+  ) -> None:
+    """
+    Replaces the snapshots of the listed datasets. If datasets is given, it is the complete list of listed datasets,
+    otherwise the listed datasets are inferred from the snapshots.
+    """
+    if not self.enabled:
+      return
+    now = int(time.time())
+    key = host_key(host)
+    cond, params = _scope(dataset, recursive)
+    with self._transaction() as db:
+      db.execute(f'DELETE FROM snapshots WHERE host = ? AND {cond}', [key, *params])
+      db.executemany('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [_snapshot_row(key, s, now) for s in snapshots])
+      if datasets is not None:
+        # datasets that no longer exist are forgotten
+        db.execute(f'DELETE FROM datasets WHERE host = ? AND {cond}', [key, *params])
+      else:
+        datasets = {s.dataset for s in snapshots} | ({dataset} if dataset is not None else set())
+      db.executemany('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?)', [(key, d, now) for d in datasets])
+
+  def record_snapshots(self, host: Optional[str], snapshots: Collection[Snapshot]) -> None:
+    """Adds or updates snapshots without touching the other snapshots of their datasets"""
+    if not self.enabled:
+      return
+    now = int(time.time())
+    key = host_key(host)
+    with self._transaction() as db:
+      db.executemany('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [_snapshot_row(key, s, now) for s in snapshots])
+      db.executemany('INSERT OR IGNORE INTO datasets VALUES (?, ?, ?)', [(key, d, now) for d in {s.dataset for s in snapshots}])
+
+  def record_destroyed(self, host: Optional[str], dataset: str, shortnames: Collection[str]) -> None:
+    if not self.enabled:
+      return
+    with self._transaction() as db:
+      db.executemany('DELETE FROM snapshots WHERE host = ? AND dataset = ? AND shortname = ?',
+                     [(host_key(host), dataset, n) for n in shortnames])
+
+  def record_replication(
+    self, source: tuple[Optional[str], str], dest: tuple[Optional[str], str], snapshot: Snapshot
+  ) -> None:
+    """snapshot is the newest source snapshot that exists on dest, given as (host, dataset) each"""
+    if not self.enabled:
+      return
+    now = int(time.time())
+    (source_host, source_dataset), (dest_host, dest_dataset) = source, dest
+    with self._transaction() as db:
+      db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                 _snapshot_row(host_key(dest_host), snapshot.with_dataset(dest_dataset), now))
+      db.execute('INSERT OR IGNORE INTO datasets VALUES (?, ?, ?)', (host_key(dest_host), dest_dataset, now))
+      db.execute('INSERT OR REPLACE INTO replications VALUES (?, ?, ?, ?, ?, ?)',
+                 (host_key(source_host), source_dataset, host_key(dest_host), dest_dataset, str(snapshot.guid), now))
+
+  def datasets(self, host: Optional[str] = None, dataset: Optional[str] = None, recursive: bool = False) -> list[DatasetRow]:
+    """host None selects all hosts"""
+    cond, params = _scope(dataset, recursive, 'd.dataset')
+    hosts = 'd.host = ?' if host is not None else '1'
+    with self._transaction() as db:
+      rows = db.execute(f'''
+        SELECT d.host, d.dataset, count(s.guid), max(s.creation), d.listed
+        FROM datasets d LEFT JOIN snapshots s ON s.host = d.host AND s.dataset = d.dataset
+        WHERE {hosts} AND {cond}
+        GROUP BY d.host, d.dataset
+        ORDER BY d.host, d.dataset
+      ''', [*([host] if host is not None else []), *params]).fetchall()
+    return [DatasetRow(*r) for r in rows]
+
+  def snapshots(
+    self, host: Optional[str] = None, dataset: Optional[str] = None, recursive: bool = False, guid: Optional[int] = None
+  ) -> list[SnapshotRow]:
+    """host None selects all hosts"""
+    cond, params = _scope(dataset, recursive)
+    hosts = 'host = ?' if host is not None else '1'
+    guids = 'guid = ?' if guid is not None else '1'
+    with self._transaction() as db:
+      rows = db.execute(f'''
+        SELECT host, dataset, shortname, guid, creation, tags, holds, seen FROM snapshots
+        WHERE {hosts} AND {guids} AND {cond}
+        ORDER BY host, dataset, creation
+      ''', [*([host] if host is not None else []), *([str(guid)] if guid is not None else []), *params]).fetchall()
+    return [
+      SnapshotRow(h, d, n, int(g), c, [t for t in tags.split(',') if t] if tags is not None else None, holds, seen)
+      for h, d, n, g, c, tags, holds, seen in rows
+    ]
+
+  def replications(self, host: Optional[str] = None, dataset: Optional[str] = None, recursive: bool = False) -> list[ReplicationRow]:
+    """Replications from or to the selected datasets. host None selects all hosts."""
+    source_cond, source_params = _scope(dataset, recursive, 'r.source_dataset')
+    dest_cond, dest_params = _scope(dataset, recursive, 'r.dest_dataset')
+    hosts = ('(r.source_host = ? AND {0} OR r.dest_host = ? AND {1})' if host is not None else '({0} OR {1})').format(source_cond, dest_cond)
+    params = [host, *source_params, host, *dest_params] if host is not None else [*source_params, *dest_params]
+    with self._transaction() as db:
+      rows = db.execute(f'''
+        SELECT r.source_host, r.source_dataset, r.dest_host, r.dest_dataset, r.replicated,
+          (SELECT max(creation) FROM snapshots WHERE host = r.dest_host AND dataset = r.dest_dataset AND guid = r.guid),
+          (SELECT max(creation) FROM snapshots WHERE host = r.source_host AND dataset = r.source_dataset)
+        FROM replications r
+        WHERE {hosts}
+        ORDER BY r.source_host, r.source_dataset, r.dest_host, r.dest_dataset
+      ''', params).fetchall()
+    return [ReplicationRow(*r) for r in rows]
+
+
+def _snapshot_row(host: str, snap: Snapshot, seen: int) -> tuple:
+  tags = ','.join(sorted(snap.tags)) if snap.tags is not None else None
+  return (host, snap.dataset, snap.shortname, str(snap.guid), int(snap.timestamp.timestamp()), tags, snap.holds, seen)
+
+
+# global catalog of the run
+catalog = Catalog()
@@ -6,6 +6,8 @@ import string
 import logging
 
 from ..zfs import LocalZfsCli, ZfsProperty
+from ..locking import lock_datasets, subtree_keys
+from ..catalog import catalog
 from .arguments import Args
 
 
@@ -27,12 +29,19 @@ def entrypoint(raw_args: Namespace) -> None:
   shortname: str = ''.join(random.choices(chars, k=10))
   fullname = f'{args.dataset}@{shortname}'
 
-  cli.create_snapshot(
-    fullname=fullname,
-    recursive=args.recursive,
-    properties={
-      ZfsProperty.CUSTOM_TAGS: ','.join(args.tag)
-    }
-  )
+  # also names the new snapshots for the catalog
+  keys = subtree_keys(cli, args.dataset, args.recursive)
+  with lock_datasets(args, lambda: keys):
+    cli.create_snapshot(
+      fullname=fullname,
+      recursive=args.recursive,
+      properties={
+        ZfsProperty.CUSTOM_TAGS: ','.join(args.tag)
+      }
+    )
+
+  if catalog.enabled:
+    # fetching the new snapshots records them with their GUIDs
+    cli.get_snapshots([f'{k.dataset}@{shortname}' for k in keys])
 
   log.info(f'Created snapshot {fullname}')
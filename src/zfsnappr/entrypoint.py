@@ -1,6 +1,19 @@
 from __future__ import annotations
+from argparse import Namespace
+from typing import Optional
+from contextlib import ExitStack
+import cProfile
+import logging
+import sys
+import time
 
 from .argparser import get_args
+from .trace import tracer
+from .session import session, Recorder, Replay
+from .catalog import catalog
+from .listing_cache import listing_cache
+from .metrics import metrics
+from .setup_logging import configure_output, log_lines
 from . import (
   prune as _prune,
   create as _create,
@@ -8,16 +21,71 @@ from . import (
   pull as _pull,
   list as _list,
   tag as _tag,
+  query as _query,
+  refresh as _refresh,
+  status as _status,
   version as _version
 )
 
 
+log = logging.getLogger(__name__)
+
+
 def entrypoint() -> None:
   args = get_args()
   subcommand = args.subcommand
   args.__delattr__('subcommand')
 
-  s = subcommand
+  # the metrics of CLI calls and phases come from the tracer
+  tracer.enabled = args.trace or args.metrics_file is not None
+  profiler: Optional[cProfile.Profile] = cProfile.Profile() if args.profile else None
+  # uncaught errors are logged after restoring, so they are not lost in the queue
+  restore_output = configure_output(args.log_format, args.log_queue, args.log_detail_rate)
+  try:
+    run(subcommand, args, profiler)
+  finally:
+    restore_output()
+
+
+def run(subcommand: str, args: Namespace, profiler: Optional[cProfile.Profile]) -> None:
+  start = time.monotonic()
+  success = False
+  if args.metrics_file:
+    metrics.open(args.metrics_file)
+  try:
+    with ExitStack() as stack:
+      if args.record:
+        file = stack.enter_context(open(args.record, 'w'))
+        session.recorder = stack.enter_context(Recorder(file, anonymize=args.anonymize, argv=sys.argv[1:]))
+      if args.replay:
+        session.replay = Replay.load(args.replay)
+        log.info(f'Replaying calls recorded by "zfsnappr {" ".join(session.replay.argv)}"')
+      if args.catalog:
+        catalog.open(args.catalog)
+        stack.callback(catalog.close)
+      if args.listing_cache:
+        listing_cache.open(args.listing_cache)
+        stack.callback(listing_cache.close)
+      if profiler is not None:
+        profiler.enable()
+      with tracer.phase(subcommand):
+        run_subcommand(subcommand, args)
+      success = True
+  finally:
+    if profiler is not None:
+      profiler.disable()
+      profiler.dump_stats(args.profile)
+      log.info(f'Profile written to "{args.profile}"')
+    if args.trace:
+      log_lines(log, tracer.summarize())
+    if metrics.enabled:
+      try:
+        metrics.write(subcommand, success, time.monotonic() - start)
+      except OSError as e:
+        log.warning(f'Failed to write metrics to "{args.metrics_file}": {e}')
+
+
+def run_subcommand(s: str, args: Namespace) -> None:
   if s == 'prune':
     _prune.entrypoint(args)
   elif s == 'create':
@@ -30,6 +98,12 @@ def entrypoint() -> None:
     _list.entrypoint(args)
   elif s == 'tag':
     _tag.entrypoint(args)
+  elif s == 'query':
+    _query.entrypoint(args)
+  elif s == 'refresh':
+    _refresh.entrypoint(args)
+  elif s == 'status':
+    _status.entrypoint(args)
   elif s == 'version':
     _version.entrypoint(args)
   else:
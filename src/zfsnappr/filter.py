@@ -1,5 +1,6 @@
 from typing import Callable, Optional, Literal
 from collections.abc import Collection
+import re
 
 from .zfs import Snapshot
 
@@ -14,31 +15,40 @@ def parse_shortnames(shortnames: Collection[str]) -> Optional[set[str]]:
     return None
   return set(shortnames)
 
+def matches_tags(tags: Optional[Collection[str]], tag: Collection[Collection[str]]) -> bool:
+  """
+  Whether a snapshot with given tags has all the tags of one of the groups in tag.
+  tags is None if the tags of the snapshot are unset, which the group UNSET matches.
+  Empty tags are matched by the group of the empty tag.
+  """
+  for tag_group in tag:
+    tag_group = set(tag_group)
+    # normal case: snap has all group tags
+    if tags is not None and set(tags) >= tag_group:
+      return True
+    # snap tags are unset and group contains UNSET
+    if tags is None and tag_group == {'UNSET'}:
+      return True
+    # snap tags are empty and group contains empty tag
+    if tags is not None and not tags and tag_group == {''}:
+      return True
+  return False
+
 def filter_snaps(
   snapshots: Collection[Snapshot],
   tag: Optional[Collection[Collection[str]]] = None,
   dataset: Optional[Collection[str]] = None,
-  shortname: Optional[Collection[str]] = None
+  shortname: Optional[Collection[str]] = None,
+  name: Optional[re.Pattern] = None
 ) -> list[Snapshot]:
+  """name must match the whole shortname"""
   filtered_snaps = []
   for snap in snapshots:
     keep = True
 
     # snap is included iff it has all the tags of one of the groups in "tag"
-    if tag is not None:
-      for tag_group in tag:
-        tag_group = set(tag_group)
-        # normal case: snap has all group tags
-        if snap.tags is not None and snap.tags >= tag_group:
-          break
-        # snap tags are unset and group contains UNSET
-        if snap.tags is None and len(tag_group) == 1 and next(iter(tag_group)) == 'UNSET':
-          break
-        # snap tags are empty and group contains empty tag
-        if snap.tags == set() and len(tag_group) == 1 and next(iter(tag_group)) == '':
-          break
-      else:
-        keep = False
+    if tag is not None and not matches_tags(snap.tags, tag):
+      keep = False
 
     if dataset is not None:
       if not any(snap.dataset == d for d in dataset):
@@ -47,6 +57,10 @@ def filter_snaps(
     if shortname is not None:
       if not any(snap.shortname == s for s in shortname):
         keep = False
+
+    if name is not None:
+      if not name.fullmatch(snap.shortname):
+        keep = False
     
     if keep:
       filtered_snaps.append(snap)
@@ -1,5 +1,11 @@
 from argparse import ArgumentParser
 
+from .entrypoint import DEFAULT_COLUMNS
+
 
 def setup(parser: ArgumentParser) -> None:
-    parser.add_argument('--tag', type=str, action='append', default=[])
\ No newline at end of file
+    parser.add_argument('--tag', type=str, action='append', default=[])
+    parser.add_argument('-o', '--columns', type=str, metavar='COLUMNS', default=DEFAULT_COLUMNS,
+                        help='comma-separated; one of dataset, shortname, longname, guid, tags, timestamp, holds, or any ZFS property')
+    parser.add_argument('--format', type=str, choices={'table', 'tsv', 'json'}, default='table',
+                        help='tsv and json are printed to stdout while snapshots are listed')
@@ -7,3 +7,5 @@ from ..arguments import Args as GeneralArgs
 @dataclass
 class Args(GeneralArgs):
   tag: list[str]
+  columns: str
+  format: str
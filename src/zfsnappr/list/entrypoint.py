@@ -1,23 +1,36 @@
 from __future__ import annotations
 from argparse import Namespace
-from typing import Optional, Callable, cast
+from typing import Optional, Callable, Any, cast
+from collections.abc import Iterable
 from dataclasses import dataclass
+import json
+import sys
+import os
 import logging
 
 from ..zfs import LocalZfsCli, Snapshot, Hold, ZfsProperty
 from .arguments import Args
 from ..filter import filter_snaps, parse_tags
+from ..utils import batched
+from ..table import print_table
 
 
 log = logging.getLogger(__name__)
 
-COLUMN_SEPARATOR = ' | '
-HEADER_SEPARATOR = '-'
+# number of snapshots that are filtered and printed at once by the streaming formats
+BATCH_SIZE = 1000
+
+BUILTIN_COLUMNS = {'dataset', 'shortname', 'longname', 'guid', 'tags', 'timestamp', 'holds'}
+DEFAULT_COLUMNS = 'dataset,shortname,tags,timestamp,holds'
 
 @dataclass
 class Field:
   name: str
   get: Callable[[Snapshot], str]
+  value: Optional[Callable[[Snapshot], Any]] = None  # JSON value, defaults to get
+
+  def get_value(self, snap: Snapshot) -> Any:
+    return (self.value or self.get)(snap)
 
 # TODO: Use this list output for other subcommands as well
 
@@ -28,25 +41,69 @@ def entrypoint(raw_args: Namespace) -> None:
     raise ValueError(f"No dataset provided")
 
   cli = LocalZfsCli()
-  snaps = cli.get_all_snapshots(dataset=args.dataset, recursive=args.recursive, sort_by=ZfsProperty.CREATION)
-  snaps = filter_snaps(snaps, tag=parse_tags(args.tag))
-
-  # get hold tags for all snapshots with holds
-  holdtags: dict[str, set[str]] = {s.longname: set() for s in snaps}
-  for hold in cli.get_holds([s.longname for s in snaps]):
-    holdtags[hold.snap_longname].add(hold.tag)
-  
-  fields: list[Field] = [
-    Field('DATASET',    lambda s: s.dataset),
-    Field('SHORT NAME', lambda s: s.shortname),
-    Field('TAGS',       lambda s: ','.join(s.tags) if s.tags is not None else 'UNSET'),
-    Field('TIMESTAMP',  lambda s: str(s.timestamp)),
-    Field('HOLDS',      lambda s: ','.join(holdtags[s.longname]))
-  ]
-  widths: list[int] = [max(len(f.name), *(len(f.get(s)) for s in snaps), 0) for f in fields]
-  total_width = (len(COLUMN_SEPARATOR) * ((len(fields) or 1) - 1)) + sum(widths)
-
-  log.info(COLUMN_SEPARATOR.join(f.name.ljust(w) for f, w in zip(fields, widths)))
-  log.info((HEADER_SEPARATOR * (total_width//len(HEADER_SEPARATOR) + 1))[:total_width])
-  for snap in snaps:
-    log.info(COLUMN_SEPARATOR.join(f.get(snap).ljust(w) for f, w in zip(fields, widths)))
+  columns = [c for c in args.columns.split(',') if c]
+
+  # hold tags of the snapshots that are currently printed
+  holdtags: dict[str, set[str]] = {}
+  fields = [get_field(c, holdtags) for c in columns]
+  properties = [c for c in columns if c not in BUILTIN_COLUMNS]
+  fetch_holds = 'holds' in columns
+  tag = parse_tags(args.tag)
+  # the holds column lists the holds themselves, so only the tags column and the tag filter need a field
+  snap_fields = [ZfsProperty.CUSTOM_TAGS] if 'tags' in columns or tag is not None else []
+
+  snaps = cli.iter_all_snapshots(dataset=args.dataset, recursive=args.recursive, properties=properties,
+                                 sort_by=ZfsProperty.CREATION, fields=snap_fields)
+  if args.format == 'table':
+    # column widths require all rows
+    batches: Iterable[list[Snapshot]] = [list(snaps)]
+  else:
+    batches = batched(snaps, BATCH_SIZE)
+
+  try:
+    if args.format == 'tsv':
+      sys.stdout.write('\t'.join(f.name for f in fields) + '\n')
+
+    for batch in batches:
+      batch = filter_snaps(batch, tag=tag)
+
+      # get hold tags for all snapshots with holds
+      holdtags.clear()
+      if fetch_holds:
+        holdtags.update({s.longname: set() for s in batch})
+        for hold in cli.get_holds([s.longname for s in batch]):
+          holdtags[hold.snap_longname].add(hold.tag)
+
+      if args.format == 'table':
+        print_table([f.name for f in fields], [[f.get(s) for f in fields] for s in batch])
+      elif args.format == 'tsv':
+        sys.stdout.writelines('\t'.join(f.get(s) for f in fields) + '\n' for s in batch)
+      elif args.format == 'json':
+        sys.stdout.writelines(json.dumps({c: f.get_value(s) for c, f in zip(columns, fields)}) + '\n' for s in batch)
+      else:
+        assert False
+      sys.stdout.flush()
+  except BrokenPipeError:
+    # reader went away, e.g. head. Silence the flush at interpreter exit
+    # see https://docs.python.org/3/library/signal.html#note-on-sigpipe
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def get_field(column: str, holdtags: dict[str, set[str]]) -> Field:
+  """Columns that are not builtin are read from the ZFS property of the same name"""
+  if column == 'dataset':
+    return Field('DATASET',    lambda s: s.dataset)
+  if column == 'shortname':
+    return Field('SHORT NAME', lambda s: s.shortname)
+  if column == 'longname':
+    return Field('NAME',       lambda s: s.longname)
+  if column == 'guid':
+    return Field('GUID',       lambda s: str(s.guid), lambda s: s.guid)
+  if column == 'tags':
+    return Field('TAGS',       lambda s: ','.join(s.tags) if s.tags is not None else 'UNSET',
+                               lambda s: sorted(s.tags) if s.tags is not None else None)
+  if column == 'timestamp':
+    return Field('TIMESTAMP',  lambda s: str(s.timestamp), lambda s: s.timestamp.isoformat())
+  if column == 'holds':
+    return Field('HOLDS',      lambda s: ','.join(holdtags[s.longname]), lambda s: sorted(holdtags[s.longname]))
+  return Field(column.upper(), lambda s: s.properties[column])
@@ -0,0 +1,135 @@
+from __future__ import annotations
+from typing import Optional
+from collections.abc import Collection
+from dataclasses import dataclass
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from .catalog import host_key
+
+
+log = logging.getLogger(__name__)
+
+# bumped whenever the layout of the cache files changes, older files are ignored
+FORMAT = 2
+# seconds that a listing must have started after the last change of a dataset to be trusted:
+# snapshots_changed has a resolution of one second, and the clocks of remote hosts may differ a bit
+CLOCK_MARGIN = 2
+
+
+@dataclass
+class CacheEntry:
+  guid: int  # of the dataset
+  changed: int  # snapshots_changed of the dataset before it was listed
+  listed: float  # local time at which the listing started
+  properties: tuple[str, ...]
+  rows: list[list[str]]  # property values of each snapshot, in listing order
+
+  def valid_for(self, guid: int, changed: int, properties: Collection[str]) -> bool:
+    """Whether the entry still lists the snapshots of a dataset with given guid and snapshots_changed"""
+    return (
+      self.guid == guid and self.changed == changed and self.properties == tuple(properties)
+      # a change in the same second as the last one would not move snapshots_changed
+      and self.changed + 1 + CLOCK_MARGIN <= self.listed
+    )
+
+
+class ListingCache:
+  """
+  Snapshot listings of single datasets on disk, one JSON file per host and dataset, written atomically.
+  The files are plain data, so that whoever can write the directory cannot make zfsnappr run code.
+  An entry is used as long as the guid and snapshots_changed of its dataset are unchanged. snapshots_changed only
+  moves when snapshots are created, destroyed or received, so zfsnappr invalidates the datasets whose holds, tags
+  or snapshot names it changes itself. Such changes made outside of zfsnappr are not seen until the next snapshot is
+  created or destroyed in the dataset.
+  Disabled unless opened.
+  """
+  _dir: Optional[str]
+  _unsupported: set[str]  # hosts whose ZFS has no snapshots_changed
+  _lock: threading.Lock
+
+  def __init__(self) -> None:
+    self._dir = None
+    self._unsupported = set()
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return self._dir is not None
+
+  def open(self, path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+    self._dir = path
+
+  def close(self) -> None:
+    self._dir = None
+
+  def supports(self, host: Optional[str]) -> bool:
+    return self.enabled and host_key(host) not in self._unsupported
+
+  def mark_unsupported(self, host: Optional[str]) -> None:
+    with self._lock:
+      if host_key(host) in self._unsupported:
+        return
+      self._unsupported.add(host_key(host))
+    log.info(f'ZFS on "{host_key(host)}" does not report snapshots_changed, listing its snapshots without cache')
+
+  def _path(self, host: Optional[str], dataset: str) -> str:
+    assert self._dir is not None
+    # dataset names may contain characters that file names may not
+    return os.path.join(self._dir, host_key(host), hashlib.sha1(dataset.encode()).hexdigest())
+
+  def load(self, host: Optional[str], dataset: str) -> Optional[CacheEntry]:
+    if not self.enabled:
+      return None
+    try:
+      with open(self._path(host, dataset)) as f:
+        data = json.load(f)
+      if data.get('format') != FORMAT:
+        return None
+      entry = CacheEntry(
+        int(data['guid']), int(data['changed']), float(data['listed']), tuple(map(str, data['properties'])), data['rows']
+      )
+      if not all(isinstance(r, list) and len(r) == len(entry.properties) for r in entry.rows):
+        raise ValueError('malformed rows')
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+      log.warning(f'Ignoring unreadable listing cache of "{host_key(host)}:{dataset}": {e}')
+      return None
+    return entry
+
+  def store(self, host: Optional[str], dataset: str, entry: CacheEntry) -> None:
+    if not self.enabled:
+      return
+    path = self._path(host, dataset)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = {
+      'format': FORMAT, 'guid': entry.guid, 'changed': entry.changed, 'listed': entry.listed,
+      'properties': list(entry.properties), 'rows': entry.rows
+    }
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+      os.replace(tmp, path)
+    except BaseException:
+      os.unlink(tmp)
+      raise
+
+  def invalidate(self, host: Optional[str], datasets: Collection[str]) -> None:
+    if not self.enabled:
+      return
+    for dataset in datasets:
+      try:
+        os.unlink(self._path(host, dataset))
+      except FileNotFoundError:
+        pass
+
+
+# global listing cache of the run
+listing_cache = ListingCache()
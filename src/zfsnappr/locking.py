@@ -0,0 +1,172 @@
+from __future__ import annotations
+from typing import Optional, IO, ContextManager
+from collections.abc import Collection, Callable
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from subprocess import CalledProcessError
+from urllib.parse import quote
+import fcntl
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from .zfs import ZfsCli
+from .arguments import Args
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LOCK_DIR = '/var/lock/zfsnappr'
+POLL_INTERVAL = 0.2
+
+
+class LockTimeout(RuntimeError):
+  pass
+
+
+@dataclass(frozen=True, order=True)
+class LockKey:
+  host: str  # 'localhost' for local datasets
+  dataset: str
+
+  @property
+  def filename(self) -> str:
+    return quote(f'{self.host}:{self.dataset}', safe='') + '.lock'
+
+  def __str__(self) -> str:
+    return self.dataset if self.host == 'localhost' else f'{self.host}:{self.dataset}'
+
+
+class DatasetLocks:
+  """
+  Advisory locks on datasets for the duration of a with block, shared by all zfsnappr processes on this host.
+  Locks are acquired in sorted order, so that processes locking overlapping datasets cannot deadlock.
+  Each lock file holds a description of its current holder, which is reported while waiting for it.
+  """
+  keys: list[LockKey]
+  lock_dir: str
+  timeout: Optional[float]  # None waits indefinitely
+  _files: list[IO[str]]
+
+  def __init__(self, keys: Collection[LockKey], lock_dir: str = DEFAULT_LOCK_DIR, timeout: Optional[float] = None) -> None:
+    self.keys = sorted(set(keys))
+    self.lock_dir = lock_dir
+    self.timeout = timeout
+    self._files = []
+
+  def __enter__(self) -> DatasetLocks:
+    os.makedirs(self.lock_dir, exist_ok=True)
+    deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+    try:
+      for key in self.keys:
+        self._files.append(self._acquire(key, deadline))
+    except BaseException:
+      self._release()
+      raise
+    log.debug(f'Locked {len(self.keys)} datasets')
+    return self
+
+  def __exit__(self, exc_type, exc, tb) -> None:
+    self._release()
+
+  def _acquire(self, key: LockKey, deadline: Optional[float]) -> IO[str]:
+    f = open(os.path.join(self.lock_dir, key.filename), 'a+')
+    waiting = False
+    while True:
+      try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        break
+      except BlockingIOError:
+        pass
+      if deadline is not None and time.monotonic() >= deadline:
+        holder = _read_holder(f)
+        f.close()
+        raise LockTimeout(f'Timed out waiting for lock on "{key}", held by {holder}')
+      if not waiting:
+        log.info(f'Waiting for lock on "{key}", held by {_read_holder(f)}')
+        waiting = True
+      time.sleep(POLL_INTERVAL)
+
+    f.seek(0)
+    f.truncate()
+    json.dump({
+      'pid': os.getpid(),
+      'host': socket.gethostname(),
+      'command': ' '.join(['zfsnappr', *sys.argv[1:]]),
+      'since': datetime.now().isoformat(timespec='seconds')
+    }, f)
+    f.flush()
+    return f
+
+  def _release(self) -> None:
+    for f in reversed(self._files):
+      # the holder is cleared before unlocking, the file itself stays since removing it would race with other processes
+      f.truncate(0)
+      f.close()
+    self._files = []
+
+
+def _read_holder(f: IO[str]) -> str:
+  f.seek(0)
+  try:
+    holder = json.loads(f.read())
+  except ValueError:
+    return 'an unknown process'
+  return f'"{holder["command"]}" (pid {holder["pid"]} on {holder["host"]}, since {holder["since"]})'
+
+
+def subtree_keys(cli: ZfsCli, dataset: Optional[str], recursive: bool) -> list[LockKey]:
+  """
+  Keys of dataset and, if recursive, all of its descendants, listing only the subtree. dataset does not need to exist.
+  If dataset is None, the keys of all datasets.
+  """
+  if dataset is None:
+    names = {d.name for d in cli.get_all_datasets()}
+  else:
+    names = {dataset}
+    if recursive:
+      try:
+        names |= {d.name for d in cli.get_all_datasets(dataset=dataset, recursive=True)}
+      except CalledProcessError as e:
+        # zfs fails with 1 if the dataset does not exist yet, e.g. the dest of an initial pull
+        if e.returncode != 1:
+          raise
+  host = cli.host if cli.host is not None else 'localhost'
+  return [LockKey(host, n) for n in names]
+
+
+def resolve_lock_dir(path: str) -> str:
+  """
+  The default lock directory is only writable by root. Other users fall back to a private directory of their own,
+  which still serializes their own runs. A directory given explicitly is used as is.
+  """
+  if path != DEFAULT_LOCK_DIR:
+    return path
+  try:
+    os.makedirs(path, exist_ok=True)
+  except PermissionError:
+    pass
+  if os.access(path, os.W_OK):
+    return path
+  fallback = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), f'zfsnappr-{os.getuid()}', 'locks')
+  os.makedirs(fallback, mode=0o700, exist_ok=True)
+  if os.stat(fallback).st_uid != os.getuid():
+    raise PermissionError(f'Lock directory "{fallback}" is owned by another user, use --lock-dir')
+  log.debug(f'"{path}" is not writable, locking in "{fallback}"')
+  return fallback
+
+
+def lock_datasets(args: Args, keys: Callable[[], Collection[LockKey]], dry_run: bool = False) -> ContextManager[object]:
+  """
+  Locks the keys as configured by the top-level arguments. keys is only called if locking is needed:
+  replays change nothing, so they neither lock nor list datasets for it. The same holds for dry runs,
+  but only subcommands that honor --dry-run pass it as dry_run.
+  """
+  if dry_run or args.replay is not None:
+    return nullcontext()
+  return DatasetLocks(keys(), resolve_lock_dir(args.lock_dir), args.lock_timeout)
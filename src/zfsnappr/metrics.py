@@ -0,0 +1,172 @@
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+from collections.abc import Collection
+from dataclasses import dataclass
+import os
+import tempfile
+import threading
+import time
+
+from .trace import tracer
+from .catalog import host_key
+
+if TYPE_CHECKING:
+  # zfs depends on this module
+  from .zfs import Snapshot
+
+
+@dataclass
+class TransferStats:
+  transfers: int = 0
+  bytes: int = 0  # estimated stream sizes
+  seconds: float = 0
+
+
+class Metrics:
+  """
+  Collects metrics of the run and writes them as a Prometheus textfile for the textfile collector of node_exporter.
+  CLI calls and phases are taken from the tracer, which must be enabled.
+  Disabled unless opened, in which case recording costs nothing.
+  """
+  path: Optional[str]
+  _snapshots: dict[tuple[str, str], tuple[int, Optional[int]]]  # per host and dataset: count and newest creation
+  _destroyed: dict[tuple[str, str], int]
+  _transfers: dict[tuple[str, str], TransferStats]  # per source and dest, as HOST:DATASET
+  _lock: threading.Lock
+
+  def __init__(self) -> None:
+    self.path = None
+    self._snapshots = {}
+    self._destroyed = {}
+    self._transfers = {}
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return self.path is not None
+
+  def open(self, path: str) -> None:
+    self.path = path
+
+  def record_listing(self, host: Optional[str], snapshots: Collection[Snapshot]) -> None:
+    """Replaces the counts of the datasets that have snapshots in the listing"""
+    if not self.enabled:
+      return
+    counts: dict[tuple[str, str], tuple[int, Optional[int]]] = {}
+    for s in snapshots:
+      count, newest = counts.get((host_key(host), s.dataset), (0, None))
+      creation = int(s.timestamp.timestamp())
+      counts[host_key(host), s.dataset] = (count + 1, creation if newest is None else max(newest, creation))
+    with self._lock:
+      self._snapshots.update(counts)
+
+  def record_destroyed(self, host: Optional[str], dataset: str, count: int) -> None:
+    if not self.enabled:
+      return
+    key = (host_key(host), dataset)
+    with self._lock:
+      self._destroyed[key] = self._destroyed.get(key, 0) + count
+      if key in self._snapshots:
+        n, newest = self._snapshots[key]
+        self._snapshots[key] = (max(n - count, 0), newest)
+
+  def record_transfer(self, source: tuple[Optional[str], str], dest: tuple[Optional[str], str], size: int, seconds: float) -> None:
+    """source and dest are given as (host, dataset) each"""
+    if not self.enabled:
+      return
+    key = (f'{host_key(source[0])}:{source[1]}', f'{host_key(dest[0])}:{dest[1]}')
+    with self._lock:
+      stats = self._transfers.setdefault(key, TransferStats())
+      stats.transfers += 1
+      stats.bytes += size
+      stats.seconds += seconds
+
+  def render(self, subcommand: str, success: bool, seconds: float) -> str:
+    now = time.time()
+    out = _Exposition()
+    run = {'subcommand': subcommand}
+
+    out.metric('zfsnappr_run_success', 'gauge', 'Whether the last run succeeded', [(run, int(success))])
+    out.metric('zfsnappr_run_seconds', 'gauge', 'Duration of the last run', [(run, seconds)])
+    out.metric('zfsnappr_run_timestamp_seconds', 'gauge', 'End of the last run since the epoch', [(run, now)])
+
+    with self._lock:
+      snapshots = sorted(self._snapshots.items())
+      destroyed = sorted(self._destroyed.items())
+      transfers = sorted(self._transfers.items())
+    out.metric('zfsnappr_snapshots', 'gauge', 'Snapshots per dataset as of the run',
+               [({'host': h, 'dataset': d}, n) for (h, d), (n, _) in snapshots])
+    out.metric('zfsnappr_newest_snapshot_age_seconds', 'gauge', 'Age of the newest snapshot per dataset',
+               [({'host': h, 'dataset': d}, now - newest) for (h, d), (_, newest) in snapshots if newest is not None])
+    out.metric('zfsnappr_destroyed_snapshots', 'gauge', 'Snapshots destroyed by the run per dataset',
+               [({'host': h, 'dataset': d}, n) for (h, d), n in destroyed])
+    out.metric('zfsnappr_transferred_snapshots', 'gauge', 'Snapshots transferred by the run',
+               [({'source': s, 'dest': d}, t.transfers) for (s, d), t in transfers])
+    out.metric('zfsnappr_transferred_bytes', 'gauge', 'Estimated bytes transferred by the run',
+               [({'source': s, 'dest': d}, t.bytes) for (s, d), t in transfers])
+    out.metric('zfsnappr_transfer_seconds', 'gauge', 'Seconds spent transferring in the run',
+               [({'source': s, 'dest': d}, t.seconds) for (s, d), t in transfers])
+
+    calls: dict[tuple[str, str], list[float]] = {}
+    failed: dict[tuple[str, str], int] = {}
+    for r in tracer.records:
+      if r.duration is None:
+        continue
+      key = (host_key(r.host), r.command)
+      calls.setdefault(key, []).append(r.duration)
+      failed[key] = failed.get(key, 0) + (1 if r.returncode else 0)
+    out.metric('zfsnappr_cli_calls', 'gauge', 'CLI calls of the run per host and command',
+               [({'host': h, 'command': c}, len(d)) for (h, c), d in sorted(calls.items())])
+    out.metric('zfsnappr_cli_failed_calls', 'gauge', 'Failed CLI calls of the run per host and command',
+               [({'host': h, 'command': c}, n) for (h, c), n in sorted(failed.items())])
+    out.metric('zfsnappr_cli_call_seconds', 'gauge', 'Total latency of the CLI calls of the run per host and command',
+               [({'host': h, 'command': c}, sum(d)) for (h, c), d in sorted(calls.items())])
+    out.metric('zfsnappr_cli_call_max_seconds', 'gauge', 'Latency of the slowest CLI call of the run per host and command',
+               [({'host': h, 'command': c}, max(d)) for (h, c), d in sorted(calls.items())])
+    out.metric('zfsnappr_phase_seconds', 'gauge', 'Seconds spent in each phase of the run',
+               [({'phase': name or '(none)'}, p.seconds) for name, p in sorted(tracer.phases.items())])
+    return out.text()
+
+  def write(self, subcommand: str, success: bool, seconds: float) -> None:
+    """Replaces the file atomically, so that the collector never reads a partial file"""
+    assert self.path is not None
+    directory = os.path.dirname(self.path) or '.'
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.prom')
+    try:
+      with os.fdopen(fd, 'w') as f:
+        f.write(self.render(subcommand, success, seconds))
+      os.chmod(tmp, 0o644)  # readable by node_exporter
+      os.replace(tmp, self.path)
+    except BaseException:
+      os.unlink(tmp)
+      raise
+
+
+class _Exposition:
+  """Prometheus text exposition format"""
+  _lines: list[str]
+
+  def __init__(self) -> None:
+    self._lines = []
+
+  def metric(self, name: str, kind: str, help: str, samples: list[tuple[dict[str, str], float]]) -> None:
+    if not samples:
+      return
+    self._lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+      label_str = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+      self._lines.append(f'{name}{{{label_str}}} {_format_value(value)}')
+
+  def text(self) -> str:
+    return '\n'.join(self._lines) + '\n'
+
+
+def _escape(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+  return str(value) if isinstance(value, int) else f'{value:.3f}'
+
+
+# global metrics of the run
+metrics = Metrics()
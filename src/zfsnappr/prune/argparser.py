@@ -3,7 +3,10 @@ from dateutil.relativedelta import relativedelta
 import re
 from argparse import ArgumentParser
 
-from .policy import parse_duration
+from ..utils import parse_duration
+from .report import ReportLevel
+from .grouping import GroupType
+from ..utils import parse_size
 
 
 COUNT_OPTS = [
@@ -34,5 +37,25 @@ def setup(parser: ArgumentParser) -> None:
   for opt in WITHIN_OPTS:
     parser.add_argument(opt, type=parse_duration, metavar="DURATION", default=relativedelta())
   parser.add_argument('--keep-name', type=re.compile, metavar="REGEX")
-  parser.add_argument('--group-by', type=str, metavar='GROUP', choices={'', 'dataset'}, default='dataset')
+  parser.add_argument('--group-by', type=str, metavar='GROUP', choices={'', *(t.value for t in GroupType)}, default='dataset')
   parser.add_argument('--keep-tag', type=str, action='append', default=[])
+  parser.add_argument('--bookmarks', action='store_true')
+  parser.add_argument('--config', type=str, metavar='PATH', help='JSON file with keep policies per dataset pattern and tag, instead of the keep options')
+
+  # space target arguments. Only the oldest snapshots that are needed to reach the target are destroyed
+  parser.add_argument('--target-available', type=parse_size, metavar='SIZE')
+  parser.add_argument('--target-used-by-snapshots', type=parse_size, metavar='SIZE')
+
+  # execution arguments
+  parser.add_argument('-j', '--jobs', type=int, metavar='N', default=1, help='number of groups that are destroyed concurrently')
+  parser.add_argument('--jobs-per-pool', type=int, metavar='N', help='maximum number of concurrent destroys per pool')
+  parser.add_argument('--throttle', action='store_true', help='pace destroys by the freeing backlog of the pool and the destroy latency')
+  parser.add_argument('--throttle-freeing', type=parse_size, metavar='SIZE', default=parse_size('1G'),
+                      help='freeing backlog above which no destroy is issued, default 1G')
+  parser.add_argument('--throttle-latency', type=float, metavar='SECONDS', default=2.0,
+                      help='destroy latency above which destroys are slowed down, default 2')
+
+  # reporting arguments
+  parser.add_argument('--report', type=ReportLevel, choices=list(ReportLevel), metavar='{summary,groups,full}',
+                      help='defaults to full for dry runs and to groups otherwise')
+  parser.add_argument('--plan-file', type=str, metavar='PATH', help='write every keep and destroy decision as JSON lines')
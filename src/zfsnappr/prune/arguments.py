@@ -5,6 +5,7 @@ from dataclasses import dataclass
 from typing import Optional
 
 from ..arguments import Args as GeneralArgs
+from .report import ReportLevel
 
 
 @dataclass
@@ -28,3 +29,17 @@ class Args(GeneralArgs):
   keep_name: re.Pattern
   group_by: str
   keep_tag: list[str]
+  bookmarks: bool
+  config: Optional[str]
+
+  target_available: Optional[int]
+  target_used_by_snapshots: Optional[int]
+
+  jobs: int
+  jobs_per_pool: Optional[int]
+  throttle: bool
+  throttle_freeing: int
+  throttle_latency: float
+
+  report: Optional[ReportLevel]
+  plan_file: Optional[str]
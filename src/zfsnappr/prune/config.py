@@ -0,0 +1,108 @@
+from __future__ import annotations
+from typing import Optional, Any
+from collections.abc import Collection
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+import json
+import re
+
+from ..zfs import Snapshot
+from .. import filter
+from ..utils import parse_duration, ParseError
+from ..policy import KeepPolicy
+from .grouping import GroupType
+
+
+COUNT_KEYS = ['last', 'hourly', 'daily', 'weekly', 'monthly', 'yearly']
+WITHIN_KEYS = ['within', 'within_hourly', 'within_daily', 'within_weekly', 'within_monthly', 'within_yearly']
+
+
+@dataclass
+class PruneRule:
+  """Keep policy for the snapshots of the datasets matching any of the patterns, optionally only those with given tags"""
+  name: str
+  datasets: tuple[str, ...]  # fnmatch patterns of dataset names
+  tag: Optional[set[frozenset[str]]]  # same semantics as --tag
+  policy: KeepPolicy
+  group_by: Optional[GroupType]
+
+  def matches(self, snap: Snapshot) -> bool:
+    if not any(fnmatchcase(snap.dataset, p) for p in self.datasets):
+      return False
+    return self.tag is None or bool(filter.filter_snaps([snap], tag=self.tag))
+
+  @property
+  def uses_tags(self) -> bool:
+    """Whether the rule needs the tags of the snapshots"""
+    return self.tag is not None or bool(self.policy.tags) or self.group_by == GroupType.TAG
+
+
+def parse_policy(keep: dict[str, Any]) -> KeepPolicy:
+  """keep has the keys of KeepPolicy, with durations like in --keep-within and a list of tags"""
+  unknown = set(keep) - set(COUNT_KEYS) - set(WITHIN_KEYS) - {'name', 'tags'}
+  if unknown:
+    raise ValueError(f'Unknown keep options: {", ".join(sorted(unknown))}')
+  values: dict[str, Any] = {}
+  for key in COUNT_KEYS:
+    if key in keep:
+      if not isinstance(keep[key], int):
+        raise ValueError(f'Keep option "{key}" must be an integer')
+      values[key] = keep[key]
+  for key in WITHIN_KEYS:
+    if key in keep:
+      values[key] = parse_duration(str(keep[key]))
+  if 'name' in keep:
+    values['name'] = re.compile(keep['name'])
+  if 'tags' in keep:
+    values['tags'] = frozenset(keep['tags'])
+  return KeepPolicy(**values)
+
+
+def parse_rule(index: int, rule: dict[str, Any]) -> PruneRule:
+  name = rule.get('name', f'rule {index + 1}')
+  datasets = rule.get('dataset', '*')
+  if isinstance(datasets, str):
+    datasets = [datasets]
+  tags = rule.get('tag', [])
+  if isinstance(tags, str):
+    tags = [tags]
+  group_by = rule.get('group_by', GroupType.DATASET.value)
+  try:
+    return PruneRule(
+      name = name,
+      datasets = tuple(datasets),
+      tag = filter.parse_tags(tags),
+      policy = parse_policy(rule.get('keep', {})),
+      group_by = GroupType(group_by) if group_by else None
+    )
+  except (ParseError, ValueError, re.error) as e:
+    raise ValueError(f'Invalid prune rule "{name}": {e}') from e
+
+
+def load_rules(path: str) -> list[PruneRule]:
+  """
+  Reads prune rules from a JSON file like
+  {"rules": [{"dataset": "tank/vm/*", "tag": "daily", "keep": {"daily": 7, "within": "2d"}, "group_by": "dataset"}, ...]}
+  """
+  with open(path) as f:
+    config = json.load(f)
+  rules = [parse_rule(i, r) for i, r in enumerate(config.get('rules', []))]
+  if not rules:
+    raise ValueError(f'No prune rules in "{path}"')
+  return rules
+
+
+def assign_rules(snapshots: Collection[Snapshot], rules: list[PruneRule]) -> tuple[list[list[Snapshot]], list[Snapshot]]:
+  """
+  Assigns each snapshot to the first rule that matches it.
+  Returns the snapshots of each rule, in rule order, and the snapshots that no rule matches.
+  """
+  assigned: list[list[Snapshot]] = [[] for _ in rules]
+  unmatched: list[Snapshot] = []
+  for snap in snapshots:
+    index = next((i for i, r in enumerate(rules) if r.matches(snap)), None)
+    if index is None:
+      unmatched.append(snap)
+    else:
+      assigned[index].append(snap)
+  return assigned, unmatched
@@ -1,13 +1,21 @@
 from __future__ import annotations
 from argparse import Namespace
 from typing import cast, Optional
+from contextlib import ExitStack
 
 from ..zfs import LocalZfsCli, Snapshot, ZfsProperty
 from .. import filter
-from .policy import KeepPolicy
+from ..trace import tracer
+from ..locking import lock_datasets, subtree_keys
+from ..policy import KeepPolicy
 from .prune_snaps import prune_snapshots
+from .prune_bookmarks import prune_bookmarks
 from .arguments import Args
 from .grouping import GroupType
+from .config import PruneRule, load_rules
+from .report import PruneReport, ReportLevel
+from .space import SpacePlanner, SpaceTarget
+from .throttle import DestroyThrottle, ThrottleSettings
 
 
 def entrypoint(raw_args: Namespace):
@@ -32,13 +40,40 @@ def entrypoint(raw_args: Namespace):
     tags = frozenset(args.keep_tag)
   )
 
+  if args.config is not None:
+    rules = load_rules(args.config)
+  else:
+    group_by = GroupType(args.group_by) if args.group_by else None
+    rules = [PruneRule(name='', datasets=('*',), tag=None, policy=policy, group_by=group_by)]
+
+  target = SpaceTarget(available=args.target_available, used_by_snapshots=args.target_used_by_snapshots)
+  has_target = target.available is not None or target.used_by_snapshots is not None
+  # the space planner skips held snapshots and orders the destroy ranges by createtxg
+  fields = [ZfsProperty.CUSTOM_TAGS] if args.tag or any(r.uses_tags for r in rules) else []
+  fields += [ZfsProperty.USERREFS, ZfsProperty.CREATETXG] if has_target else []
+
   cli = LocalZfsCli()
-  snapshots = cli.get_all_snapshots(dataset=args.dataset, recursive=args.recursive, sort_by=ZfsProperty.CREATION)
-  snapshots = filter.filter_snaps(snapshots, tag=filter.parse_tags(args.tag))
+  with lock_datasets(args, lambda: subtree_keys(cli, args.dataset, args.recursive), dry_run=args.dry_run):
+    with tracer.phase('list'):
+      all_snapshots = cli.get_all_snapshots(dataset=args.dataset, recursive=args.recursive, sort_by=ZfsProperty.CREATION,
+                                            properties=[ZfsProperty.USED] if has_target else [], fields=fields)
+    snapshots = filter.filter_snaps(all_snapshots, tag=filter.parse_tags(args.tag))
+    space = SpacePlanner(cli, target, all_snapshots) if has_target else None
 
-  get_grouptype: dict[str, Optional[GroupType]] = {
-    'dataset': GroupType.DATASET,
-    '': None
-  }
+    level = args.report or (ReportLevel.FULL if args.dry_run else ReportLevel.GROUPS)
+    with ExitStack() as stack:
+      plan_file = stack.enter_context(open(args.plan_file, 'w')) if args.plan_file else None
+      report = PruneReport(level, plan_file)
+      prune_snapshots(
+        cli, snapshots, rules,
+        dry_run=args.dry_run,
+        report=report,
+        space=space,
+        jobs=args.jobs,
+        jobs_per_pool=args.jobs_per_pool,
+        throttle=DestroyThrottle(cli, ThrottleSettings(args.throttle_freeing, args.throttle_latency)) if args.throttle else None
+      )
 
-  prune_snapshots(cli, snapshots, policy, dry_run=args.dry_run, group_by=get_grouptype[args.group_by])
+    if args.bookmarks:
+      bookmarks = cli.get_all_bookmarks(dataset=args.dataset, recursive=args.recursive)
+      prune_bookmarks(cli, bookmarks, dry_run=args.dry_run)
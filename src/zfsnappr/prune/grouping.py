@@ -1,14 +1,35 @@
 from typing import Optional, Any
 from collections.abc import Callable
 from enum import Enum
+import re
 
 from ..zfs import Snapshot
 
 
 class GroupType(Enum):
   DATASET = 'dataset'
+  POOL = 'pool'
+  TAG = 'tag'
+  PREFIX = 'prefix'
+
+
+def get_tag_group(snap: Snapshot) -> str:
+  """Snapshots with the same set of tags form a group"""
+  if snap.tags is None:
+    return 'UNSET'
+  return ','.join(sorted(snap.tags))
+
+
+def get_prefix_group(snap: Snapshot) -> str:
+  """The shortname up to its first digit, like "autosnap_" or "zfs-auto-snap_daily-" """
+  match = re.match(r'\D*', snap.shortname)
+  assert match is not None
+  return match.group(0)
 
 
 GET_GROUP: dict[GroupType, Callable[[Snapshot], str]] = {
-  GroupType.DATASET: (lambda s: s.dataset)
+  GroupType.DATASET: (lambda s: s.dataset),
+  GroupType.POOL: (lambda s: s.dataset.split('/')[0]),
+  GroupType.TAG: get_tag_group,
+  GroupType.PREFIX: get_prefix_group
 }
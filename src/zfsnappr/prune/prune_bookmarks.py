@@ -0,0 +1,41 @@
+from collections.abc import Collection
+from subprocess import CalledProcessError
+import logging
+
+from ..zfs import Bookmark, ZfsCli
+from ..utils import group_snaps_by
+from ..replication_common.send_receive_snap import bookmark_holdtag
+from ..setup_logging import log_lines, DETAIL
+
+
+log = logging.getLogger(__name__)
+
+
+def prune_bookmarks(cli: ZfsCli, bookmarks: Collection[Bookmark], *, dry_run: bool = True) -> None:
+  """
+  Destroys obsolete bookmarks created by replicating with bookmarks.
+  Per dataset and destination, only the newest such bookmark can be an incremental basis and is kept.
+  Other bookmarks are left untouched.
+  """
+  own = [b for b in bookmarks if bookmark_holdtag(b) is not None]
+  groups = group_snaps_by(own, lambda b: (b.dataset, bookmark_holdtag(b)))
+
+  destroy: list[Bookmark] = []
+  for _bookmarks in groups.values():
+    # creation times share a second when snapshots are taken in quick succession
+    newest = max(_bookmarks, key=lambda b: b.createtxg)
+    destroy += [b for b in _bookmarks if b is not newest]
+
+  if not destroy:
+    log.info("No bookmarks to prune")
+    return
+  log.info(f'Destroying {len(destroy)} obsolete replication bookmarks')
+  log_lines(log, (f'    {b.timestamp}  {b.longname}' for b in destroy))
+  if dry_run:
+    return
+
+  for b in destroy:
+    try:
+      cli.destroy_bookmark(b.longname)
+    except CalledProcessError:
+      log.warning(f'Failed to destroy bookmark "{b.longname}"', extra=DETAIL)
@@ -1,12 +1,23 @@
-from typing import Optional, Any
+from typing import Optional, Any, Union
 from collections.abc import Collection
 from subprocess import CalledProcessError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from threading import BoundedSemaphore
 import logging
+import time
 
 from ..zfs import Snapshot, ZfsCli
-from .policy import apply_policy, KeepPolicy
+from ..trace import tracer
+from ..policy import apply_policy
 from ..utils import group_snaps_by
 from .grouping import GroupType, GET_GROUP
+from .report import PruneReport, ReportLevel
+from .space import SpacePlanner
+from .config import PruneRule, assign_rules
+from .throttle import DestroyThrottle
+from ..setup_logging import log_lines, DETAIL
 
 
 log = logging.getLogger(__name__)
@@ -15,34 +26,59 @@ log = logging.getLogger(__name__)
 def prune_snapshots(
   cli: ZfsCli,
   snapshots: Collection[Snapshot],
-  policy: KeepPolicy,
+  rules: list[PruneRule],
   *,
-  group_by: Optional[GroupType] = GroupType.DATASET,
   dry_run: bool = True,
+  report: Optional[PruneReport] = None,
+  space: Optional[SpacePlanner] = None,
+  jobs: int = 1,
+  jobs_per_pool: Optional[int] = None,
+  throttle: Optional[DestroyThrottle] = None
 ) -> None:
   """
-  Prune given snapshots according to keep policy
+  Prune given snapshots according to the keep policy of the first rule that matches them
+  Snapshots that no rule matches are kept
+  By default, every kept and destroyed snapshot is reported
+  If space is given, only the oldest snapshots that are needed to reach its target are destroyed
+  Groups are destroyed by up to jobs workers, with at most jobs_per_pool destroys running in the same pool
+  If throttle is given, the destroys in each pool are paced by it
   """
   if not snapshots:
     log.info(f'No snapshots, nothing to do')
     return
+  if space is not None and any(r.group_by != GroupType.DATASET for r in rules):
+    raise ValueError(f'Space targets require grouping by dataset')
+  if report is None:
+    report = PruneReport(ReportLevel.FULL)
 
-  if group_by is None:
-    log.info(f'Pruning {len(snapshots)} snapshots without grouping')
-    keep, destroy = apply_policy(snapshots, policy)
-    print_policy_result(keep, destroy)
-  else:
-    log.info(f'Pruning {len(snapshots)} snapshots, grouped by {group_by.value}')
-    # group the snapshots. Result is a dict with group name as key and set of snaps as value
-    groups = group_snaps_by(snapshots, GET_GROUP[group_by])
-    keep: list[Snapshot] = []
+  with tracer.phase('policy'):
+    assigned, unmatched = assign_rules(snapshots, rules)
+    if unmatched:
+      log.info(f'Keeping {len(unmatched)} snapshots that no rule matches')
+    keep: list[Snapshot] = list(unmatched)
     destroy: list[Snapshot] = []
-    for _group, _snaps in groups.items():
-      _keep, _destroy = apply_policy(_snaps, policy)
-      keep += _keep
-      destroy += _destroy
-      log.info(f'Group "{_group}"')
-      print_policy_result(_keep, _destroy)
+    destroy_groups: dict[Optional[str], list[Snapshot]] = {}
+    for rule, rule_snaps in zip(rules, assigned):
+      if not rule_snaps:
+        continue
+      if rule.group_by is None:
+        log.info(f'Pruning {len(rule_snaps)} snapshots without grouping')
+        groups: dict[Optional[str], list[Snapshot]] = {None: rule_snaps}
+      else:
+        log.info(f'Pruning {len(rule_snaps)} snapshots, grouped by {rule.group_by.value}')
+        # group the snapshots. Result is a dict with group name as key and set of snaps as value
+        groups = dict(group_snaps_by(rule_snaps, GET_GROUP[rule.group_by]))
+      for _group, _snaps in groups.items():
+        _keep, _destroy = apply_policy(_snaps, rule.policy)
+        if space is not None:
+          _keep, _destroy = space.limit(_snaps[0].dataset, _keep, _destroy)
+        # with a single rule, groups are named as before, otherwise they are qualified by the rule
+        name = _group if len(rules) == 1 else qualify_group(rule, _group)
+        keep += _keep
+        destroy += _destroy
+        destroy_groups[name] = _destroy
+        report.add_group(name, _keep, _destroy)
+    report.summarize()
 
   if not keep:
     raise RuntimeError(f"Refusing to destroy all snapshots")
@@ -53,22 +89,74 @@ def prune_snapshots(
     return
 
   log.info(f'Destroying snapshots')
-  for snap in destroy:
-    try:
-      cli.destroy_snapshots(snap.dataset, [snap.shortname])
-    except CalledProcessError:
-      log.warning(f'Failed to destroy snapshot "{snap.longname}"')
+  with tracer.phase('destroy'):
+    results = destroy_concurrently(cli, destroy_groups, jobs=jobs, jobs_per_pool=jobs_per_pool, throttle=throttle)
+  if throttle is not None:
+    log_lines(log, throttle.summarize())
 
+  # report in group order, regardless of completion order
+  failed = 0
+  for result in results:
+    if not result.failed:
+      continue
+    failed += len(result.failed)
+    if result.group is not None:
+      log.warning(f'Group "{result.group}": failed to destroy {len(result.failed)} of {len(result.failed) + len(result.destroyed)} snapshots')
+    for snap in result.failed:
+      log.warning(f'Failed to destroy snapshot "{snap.longname}"', extra=DETAIL)
+  if failed:
+    log.warning(f'Failed to destroy {failed} of {len(destroy)} snapshots')
 
 
+def qualify_group(rule: PruneRule, group: Optional[str]) -> str:
+  return rule.name if group is None else f'{rule.name}: {group}'
 
-def print_policy_result(keep: Collection[Snapshot], destroy: Collection[Snapshot]):
-  log.info(f'Keeping {len(keep)} snapshots')
-  for snap in keep:
-    print_snap(snap)
-  log.info(f'Destroying {len(destroy)} snapshots')
-  for snap in destroy:
-    print_snap(snap)
 
-def print_snap(snap: Snapshot):
-  log.info(f'    {snap.timestamp}  {snap.longname}')
+@dataclass
+class GroupResult:
+  group: Optional[str]
+  destroyed: list[Snapshot] = field(default_factory=list)
+  failed: list[Snapshot] = field(default_factory=list)
+
+
+def destroy_concurrently(
+  cli: ZfsCli,
+  groups: dict[Optional[str], list[Snapshot]],
+  *,
+  jobs: int = 1,
+  jobs_per_pool: Optional[int] = None,
+  throttle: Optional[DestroyThrottle] = None
+) -> list[GroupResult]:
+  """
+  Destroys the snapshots of each group, with up to jobs groups at once.
+  If jobs_per_pool is given, at most that many destroys run in the same pool at once.
+  If throttle is given, each destroy waits for it and reports its latency to it.
+  Results are returned in group order.
+  """
+  pools = {s.dataset.split('/')[0] for snaps in groups.values() for s in snaps}
+  limits: dict[str, Union[BoundedSemaphore, nullcontext]] = {
+    p: BoundedSemaphore(jobs_per_pool) if jobs_per_pool is not None else nullcontext() for p in pools
+  }
+
+  def destroy_group(group: Optional[str], snaps: list[Snapshot]) -> GroupResult:
+    result = GroupResult(group)
+    for snap in snaps:
+      try:
+        pool = snap.dataset.split('/')[0]
+        with limits[pool]:
+          if throttle is not None:
+            throttle.wait(pool)
+          start = time.monotonic()
+          cli.destroy_snapshots(snap.dataset, [snap.shortname])
+          if throttle is not None:
+            throttle.observe(pool, time.monotonic() - start)
+        result.destroyed.append(snap)
+      except CalledProcessError:
+        result.failed.append(snap)
+    return result
+
+  if jobs <= 1:
+    return [destroy_group(g, snaps) for g, snaps in groups.items()]
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = [executor.submit(destroy_group, g, snaps) for g, snaps in groups.items()]
+    return [f.result() for f in futures]
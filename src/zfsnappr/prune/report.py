@@ -0,0 +1,77 @@
+from __future__ import annotations
+from typing import Optional, IO
+from collections.abc import Collection
+from enum import Enum
+import json
+import logging
+
+from ..zfs import Snapshot
+from ..setup_logging import log_lines
+
+
+log = logging.getLogger(__name__)
+
+
+class ReportLevel(Enum):
+  SUMMARY = 'summary'  # only total counts
+  GROUPS = 'groups'    # counts per group
+  FULL = 'full'        # every kept and destroyed snapshot
+
+
+class PruneReport:
+  """
+  Reports the result of applying the keep policy, group by group.
+  Optionally writes every decision to a plan file in JSON lines format as soon as its group is evaluated.
+  """
+  level: ReportLevel
+  plan_file: Optional[IO[str]]
+  keep_count: int
+  destroy_count: int
+  group_count: int
+
+  def __init__(self, level: ReportLevel = ReportLevel.FULL, plan_file: Optional[IO[str]] = None) -> None:
+    self.level = level
+    self.plan_file = plan_file
+    self.keep_count = 0
+    self.destroy_count = 0
+    self.group_count = 0
+
+  def add_group(self, group: Optional[str], keep: Collection[Snapshot], destroy: Collection[Snapshot]) -> None:
+    """group is None if snapshots are not grouped"""
+    self.keep_count += len(keep)
+    self.destroy_count += len(destroy)
+    self.group_count += 1
+
+    if self.level != ReportLevel.SUMMARY:
+      lines = []
+      if group is not None:
+        lines.append(f'Group "{group}"')
+      lines.append(f'Keeping {len(keep)} snapshots')
+      if self.level == ReportLevel.FULL:
+        lines += [format_snap(s) for s in keep]
+      lines.append(f'Destroying {len(destroy)} snapshots')
+      if self.level == ReportLevel.FULL:
+        lines += [format_snap(s) for s in destroy]
+      # one record per group instead of one per snapshot
+      log_lines(log, lines)
+
+    if self.plan_file is not None:
+      for action, snaps in ('keep', keep), ('destroy', destroy):
+        self.plan_file.writelines(
+          json.dumps({
+            'group': group,
+            'snapshot': s.longname,
+            'guid': s.guid,
+            'timestamp': s.timestamp.isoformat(),
+            'action': action
+          }) + '\n'
+          for s in snaps
+        )
+      self.plan_file.flush()
+
+  def summarize(self) -> None:
+    log.info(f'Keeping {self.keep_count} and destroying {self.destroy_count} snapshots in {self.group_count} groups')
+
+
+def format_snap(snap: Snapshot) -> str:
+  return f'    {snap.timestamp}  {snap.longname}'
@@ -0,0 +1,125 @@
+from __future__ import annotations
+from typing import Optional
+from collections.abc import Collection
+from dataclasses import dataclass
+import logging
+
+from ..zfs import Snapshot, ZfsCli, ZfsProperty
+from ..utils import group_snaps_by, format_size
+
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class SpaceTarget:
+  available: Optional[int] = None        # free space that should at least be available in the pool
+  used_by_snapshots: Optional[int] = None  # space that the snapshots of each dataset should at most use
+
+
+class SpacePlanner:
+  """
+  Limits the snapshots that the keep policy would destroy to the oldest ones that are needed to reach the space target.
+  The reclaimable space of a destroy set is estimated with zfs destroy -nvp.
+  Since it grows with every additional snapshot, the smallest sufficient set is found by binary search.
+  """
+  cli: ZfsCli
+  target: SpaceTarget
+  # all snapshots of each dataset, including those that are not pruned, in createtxg order like the ranges of zfs destroy
+  _order: dict[str, list[Snapshot]]
+  # per pool
+  _available_needed: dict[str, int]
+
+  def __init__(self, cli: ZfsCli, target: SpaceTarget, all_snapshots: Collection[Snapshot]) -> None:
+    """all_snapshots must contain all snapshots of the pruned datasets, with used property and createtxg field"""
+    self.cli = cli
+    self.target = target
+    self._order = {d: sorted(snaps, key=lambda s: s.createtxg) for d, snaps in group_snaps_by(all_snapshots, lambda s: s.dataset).items()}
+    self._available_needed = {}
+
+  def limit(self, dataset: str, keep: list[Snapshot], destroy: list[Snapshot]) -> tuple[list[Snapshot], list[Snapshot]]:
+    """keep and destroy must be the policy result for snapshots of given dataset. Returns the limited result."""
+    needed = self._needed(dataset)
+    # held snapshots cannot be destroyed
+    candidates = sorted((s for s in destroy if s.holds == 0), key=lambda s: s.createtxg)
+    if needed <= 0:
+      log.info(f'Space target of "{dataset}" is met, destroying no snapshots')
+      chosen = 0
+    elif not candidates:
+      log.warning(f'Space target of "{dataset}" cannot be met, no snapshots may be destroyed')
+      chosen = 0
+    else:
+      chosen, reclaim = self._search(dataset, candidates, needed)
+      if reclaim < needed:
+        log.warning(f'Space target of "{dataset}" cannot be met, destroying all {chosen} candidates reclaims only {format_size(reclaim)} of {format_size(needed)}')
+      else:
+        log.info(f'Destroying {chosen} of {len(candidates)} candidates in "{dataset}" reclaims {format_size(reclaim)} of {format_size(needed)} needed')
+      pool = dataset.split('/')[0]
+      if pool in self._available_needed:
+        self._available_needed[pool] -= reclaim
+
+    destroy_set = set(candidates[:chosen])
+    return (
+      sorted((s for s in keep + destroy if s not in destroy_set), key=lambda s: s.createtxg),
+      [s for s in destroy if s in destroy_set]
+    )
+
+  def _needed(self, dataset: str) -> int:
+    """Bytes that still need to be reclaimed in given dataset"""
+    needed = 0
+    if self.target.available is not None:
+      pool = dataset.split('/')[0]
+      if pool not in self._available_needed:
+        # available space is shared by all datasets of a pool, so it is only fetched once
+        ds = self.cli.get_dataset(dataset, [ZfsProperty.AVAILABLE])
+        self._available_needed[pool] = self.target.available - int(ds.properties[ZfsProperty.AVAILABLE])
+      needed = max(needed, self._available_needed[pool])
+    if self.target.used_by_snapshots is not None:
+      ds = self.cli.get_dataset(dataset, [ZfsProperty.USEDBYSNAPSHOTS])
+      needed = max(needed, int(ds.properties[ZfsProperty.USEDBYSNAPSHOTS]) - self.target.used_by_snapshots)
+    return needed
+
+  def _search(self, dataset: str, candidates: list[Snapshot], needed: int) -> tuple[int, int]:
+    """Returns the smallest number n of oldest candidates that reclaim needed bytes, and the bytes they reclaim"""
+    # the space used uniquely by each snapshot is a lower bound of what destroying them reclaims
+    lo, hi, unique = 1, len(candidates), 0
+    for i, s in enumerate(candidates):
+      unique += int(s.properties.get(ZfsProperty.USED, '0'))
+      if unique >= needed:
+        hi = i+1
+        break
+
+    reclaim = self._estimate(dataset, candidates[:hi])
+    if reclaim < needed:
+      return hi, reclaim
+    while lo < hi:
+      mid = (lo + hi) // 2
+      r = self._estimate(dataset, candidates[:mid])
+      if r >= needed:
+        hi, reclaim = mid, r
+      else:
+        lo = mid + 1
+    return hi, reclaim
+
+  def _estimate(self, dataset: str, snaps: list[Snapshot]) -> int:
+    return self.cli.estimate_destroy(dataset, snapshots_spec(self._order[dataset], snaps))
+
+
+def snapshots_spec(order: list[Snapshot], selected: Collection[Snapshot]) -> str:
+  """
+  Shortnames of selected as accepted by zfs destroy, with runs of adjacent snapshots collapsed to ranges.
+  order must contain all snapshots of the dataset in createtxg order.
+  """
+  selected_names = {s.shortname for s in selected}
+  parts: list[str] = []
+  run: list[Snapshot] = []
+  for snap in [*order, None]:
+    if snap is not None and snap.shortname in selected_names:
+      run.append(snap)
+      continue
+    if len(run) == 1:
+      parts.append(run[0].shortname)
+    elif run:
+      parts.append(f'{run[0].shortname}%{run[-1].shortname}')
+    run = []
+  return ','.join(parts)
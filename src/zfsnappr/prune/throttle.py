@@ -0,0 +1,107 @@
+from __future__ import annotations
+from typing import Optional
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+
+from ..zfs import ZfsCli
+from ..utils import format_size
+
+
+log = logging.getLogger(__name__)
+
+# bounds of the pause between two destroys in the same pool, in seconds
+MIN_DELAY = 0.05
+MAX_DELAY = 60.0
+# seconds between progress reports per pool
+REPORT_INTERVAL = 10.0
+
+
+@dataclass
+class ThrottleSettings:
+  max_freeing: int  # bytes that the pool may still have to free before the next destroy is issued
+  target_latency: float  # seconds that a destroy call may take before destroys are slowed down
+  poll_interval: float = 1.0  # seconds between polls of the freeing property while waiting
+
+
+@dataclass
+class PoolPace:
+  delay: float = MIN_DELAY
+  freeing: int = 0
+  polled: Optional[float] = None  # monotonic time of the last poll
+  reported: float = 0
+  destroyed: int = 0
+  waited: float = 0  # seconds spent waiting for the backlog
+  lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class DestroyThrottle:
+  """
+  Paces the destroys in each pool, so that the asynchronous free work of the pool does not saturate its disks.
+  Before a destroy is issued, the pool's freeing property must be below max_freeing; it is polled at most
+  once per poll_interval, so destroys in quick succession share one poll. The pause between destroys
+  adapts to the latency of the destroy calls: it doubles whenever a call is slower than target_latency,
+  and shrinks by a quarter whenever a call is fast and the backlog is small.
+  """
+  cli: ZfsCli
+  settings: ThrottleSettings
+  _pools: dict[str, PoolPace]
+  _lock: threading.Lock
+
+  def __init__(self, cli: ZfsCli, settings: ThrottleSettings) -> None:
+    self.cli = cli
+    self.settings = settings
+    self._pools = {}
+    self._lock = threading.Lock()
+
+  def _pace(self, pool: str) -> PoolPace:
+    with self._lock:
+      return self._pools.setdefault(pool, PoolPace())
+
+  def _poll(self, pool: str, pace: PoolPace) -> int:
+    pace.freeing = self.cli.get_pool_freeing(pool)
+    pace.polled = time.monotonic()
+    return pace.freeing
+
+  def _freeing(self, pool: str, pace: PoolPace) -> int:
+    """Freeing backlog of pool, polled at most once per poll_interval"""
+    if pace.polled is None or time.monotonic() - pace.polled >= self.settings.poll_interval:
+      self._poll(pool, pace)
+    return pace.freeing
+
+  def wait(self, pool: str) -> None:
+    """Blocks until the next destroy may be issued in pool"""
+    pace = self._pace(pool)
+    with pace.lock:
+      time.sleep(pace.delay)
+      start = time.monotonic()
+      logged = False
+      while self._freeing(pool, pace) > self.settings.max_freeing:
+        if not logged:
+          log.info(f'Pool "{pool}" is still freeing {format_size(pace.freeing)}, waiting until it is below {format_size(self.settings.max_freeing)}')
+          logged = True
+        time.sleep(self.settings.poll_interval)
+      pace.waited += time.monotonic() - start
+
+  def observe(self, pool: str, latency: float) -> None:
+    """Adapts the pace of pool to the latency of a destroy call"""
+    pace = self._pace(pool)
+    with pace.lock:
+      pace.destroyed += 1
+      if latency > self.settings.target_latency:
+        pace.delay = min(pace.delay * 2, MAX_DELAY)
+      elif pace.freeing <= self.settings.max_freeing // 2:
+        pace.delay = max(pace.delay * 0.75, MIN_DELAY)
+      now = time.monotonic()
+      if now - pace.reported >= REPORT_INTERVAL:
+        pace.reported = now
+        rate = 1 / (pace.delay + latency)
+        log.info(f'Pool "{pool}": {pace.destroyed} destroyed, target rate {rate:.2f} destroys/s, '
+                 f'last destroy took {latency:.2f}s, freeing backlog {format_size(pace.freeing)}')
+
+  def summarize(self) -> list[str]:
+    return [
+      f'Pool "{pool}": {p.destroyed} destroyed, {p.waited:.1f}s waited for the freeing backlog, final pause {p.delay:.2f}s'
+      for pool, p in sorted(self._pools.items())
+    ]
@@ -1,8 +1,30 @@
 from __future__ import annotations
 from argparse import ArgumentParser
+import re
+
+from ..utils import parse_size
+from ..replication_common import parse_deadline, setup_dest_policy
+from ..transport import parse_compression
 
 
 def setup(parser: ArgumentParser) -> None:
-  parser.add_argument('remote', metavar='USER@HOST:DATASET')
+  parser.add_argument('remote', nargs='?', metavar='USER@HOST:DATASET')
+  parser.add_argument('--manifest', type=str, metavar='PATH', help='JSON file with many remote sources and their dest datasets, instead of remote')
+  parser.add_argument('-j', '--jobs', type=int, metavar='N', default=1, help='number of manifest sources that are pulled concurrently')
+  parser.add_argument('--jobs-per-host', type=int, metavar='N', default=1, help='maximum number of concurrent pulls from the same host')
   parser.add_argument('-p', '--port', type=int)
   parser.add_argument('--init', action='store_true')
+  parser.add_argument('--bookmark', action='store_true')
+  parser.add_argument('--rollback', action='store_true')
+  parser.add_argument('--max-bytes', type=parse_size, metavar='SIZE', help='transfer at most this many bytes')
+  parser.add_argument('--compress', type=parse_compression, metavar='ALGORITHM[:LEVEL]', help='compress the stream with zstd or lz4')
+  parser.add_argument('--ssh-cipher', type=str, metavar='CIPHER')
+  parser.add_argument('--ssh-option', type=str, action='append', default=[], metavar='OPTION', help='ssh_config option like Compression=no')
+  parser.add_argument('--transport', choices={'ssh', 'tcp'}, default='ssh', help='tcp sends the stream unencrypted over a socat connection')
+  parser.add_argument('--tcp-port', type=int, metavar='PORT', default=9090)
+  parser.add_argument('--tag', type=str, action='append', default=[], help='only transfer snapshots with these tags')
+  parser.add_argument('--name', type=re.compile, metavar='REGEX', help='only transfer snapshots whose name matches')
+  parser.add_argument('--deadline', type=parse_deadline, metavar='TIME', help='time of day like 06:30 or duration like 4h by which transfers must be done')
+
+  # keep policy that is applied to the destination right after transferring
+  setup_dest_policy(parser)
@@ -1,12 +1,47 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from typing import Optional
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import re
 
 from ..arguments import Args as GeneralArgs
+from ..transport import Compression
 
 
 @dataclass
 class Args(GeneralArgs):
-  remote: str
+  remote: Optional[str]
+  manifest: Optional[str]
+  jobs: int
+  jobs_per_host: int
   port: Optional[int]
   init: bool
+  bookmark: bool
+  rollback: bool
+  max_bytes: Optional[int]
+  deadline: Optional[datetime]
+  compress: Optional[Compression]
+  ssh_cipher: Optional[str]
+  ssh_option: list[str]
+  transport: str
+  tcp_port: int
+  tag: list[str]
+  name: Optional[re.Pattern]
+
+  dest_keep_last: int
+  dest_keep_hourly: int
+  dest_keep_daily: int
+  dest_keep_weekly: int
+  dest_keep_monthly: int
+  dest_keep_yearly: int
+
+  dest_keep_within: relativedelta
+  dest_keep_within_hourly: relativedelta
+  dest_keep_within_daily: relativedelta
+  dest_keep_within_weekly: relativedelta
+  dest_keep_within_monthly: relativedelta
+  dest_keep_within_yearly: relativedelta
+
+  dest_keep_name: Optional[re.Pattern]
+  dest_keep_tag: list[str]
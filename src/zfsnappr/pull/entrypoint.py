@@ -4,8 +4,13 @@ from typing import cast, Optional
 import logging
 
 from ..zfs import LocalZfsCli, RemoteZfsCli
-from ..replication_common import parse_remote, replicate
+from ..replication_common import parse_remote, replicate, TransferBudget, get_dest_policy
+from ..transport import Transport
+from ..filter import parse_tags
+from ..locking import LockKey, lock_datasets, subtree_keys
 from .arguments import Args
+from .manifest import PullSource, load_manifest, pull_concurrently, summarize
+from ..setup_logging import log_lines
 
 
 log = logging.getLogger(__name__)
@@ -14,21 +19,62 @@ log = logging.getLogger(__name__)
 def entrypoint(raw_args: Namespace) -> None:
   args = cast(Args, raw_args)
 
-  if not args.dataset:
-    raise ValueError(f"No dataset provided")
-  local_dataset: str = args.dataset
-  user, host, remote_dataset = parse_remote(args.remote)
+  budget = TransferBudget(args.max_bytes, args.deadline) if args.max_bytes is not None or args.deadline is not None else None
+  transport = Transport(compression=args.compress, tcp_port=args.tcp_port if args.transport == 'tcp' else None)
+
+  if args.manifest is None:
+    if not args.dataset:
+      raise ValueError(f"No dataset provided")
+    if args.remote is None:
+      raise ValueError(f"No remote or manifest provided")
+    pull(args, PullSource(args.remote, args.dataset, args.port), budget, transport)
+    return
+
+  if args.remote is not None:
+    raise ValueError(f"Cannot pull from both a remote and a manifest")
+  if args.transport == 'tcp' and args.jobs > 1:
+    raise ValueError(f"TCP transport uses the same port for every source and cannot pull concurrently")
+  # with a dataset, the dest datasets of the manifest are relative to it
+  sources = load_manifest(args.manifest, args.dataset)
+  log.info(f'Pulling {len(sources)} sources from {len({s.host for s in sources})} hosts')
+  results = pull_concurrently(
+    sources,
+    lambda s: pull(args, s, budget, transport),
+    jobs=args.jobs,
+    jobs_per_host=args.jobs_per_host
+  )
+  log_lines(log, summarize(results))
+  failed = sum(1 for r in results if r.error is not None)
+  if failed:
+    raise RuntimeError(f'Failed to pull {failed} of {len(results)} sources')
+
+
+def pull(args: Args, source: PullSource, budget: Optional[TransferBudget], transport: Transport) -> None:
+  local_dataset = source.dataset
+  user, host, remote_dataset = parse_remote(source.remote)
+  recursive = source.recursive if source.recursive is not None else args.recursive
 
   log.info(f'Pulling from remote source dataset "{remote_dataset}" to local dest dataset "{local_dataset}"')
 
   local_cli = LocalZfsCli()
-  remote_cli = RemoteZfsCli(host=host, user=user, port=args.port)
-
-  replicate(
-    source_cli=remote_cli,
-    source_dataset=remote_dataset,
-    dest_cli=local_cli,
-    dest_dataset=local_dataset,
-    recursive=args.recursive,
-    initialize=args.init
-  )
+  remote_cli = RemoteZfsCli(host=host, user=user, port=source.port or args.port, cipher=args.ssh_cipher, ssh_options=args.ssh_option)
+
+  # the remote target is locked on this host, against other replications to or from it
+  locks = lambda: subtree_keys(local_cli, local_dataset, recursive) + [LockKey(host, remote_dataset)]
+  with lock_datasets(args, locks, dry_run=args.dry_run):
+    replicate(
+      source_cli=remote_cli,
+      source_dataset=remote_dataset,
+      dest_cli=local_cli,
+      dest_dataset=local_dataset,
+      recursive=recursive,
+      initialize=args.init,
+      bookmark=args.bookmark,
+      rollback=args.rollback,
+      dry_run=args.dry_run,
+      budget=budget,
+      transport=transport,
+      dest_policy=get_dest_policy(args),
+      tag=parse_tags(args.tag),
+      name=args.name
+    )
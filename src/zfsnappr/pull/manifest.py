@@ -0,0 +1,146 @@
+from __future__ import annotations
+from typing import Optional, Any
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+import json
+import logging
+import threading
+import time
+
+from ..replication_common import parse_remote
+
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class PullSource:
+  remote: str  # USER@HOST:DATASET
+  dataset: str  # local dest dataset
+  port: Optional[int] = None
+  recursive: Optional[bool] = None  # None means as given on the command line
+
+  @property
+  def host(self) -> str:
+    return parse_remote(self.remote)[1]
+
+  def __str__(self) -> str:
+    return f'{self.remote} -> {self.dataset}'
+
+
+def load_manifest(path: str, parent: Optional[str] = None) -> list[PullSource]:
+  """
+  Reads pull sources from a JSON file like
+  {"sources": [{"remote": "root@web1:tank/data", "dataset": "backup/web1", "port": 2222, "recursive": true}, ...]}
+  If parent is given, the dest datasets are relative to it.
+  """
+  with open(path) as f:
+    manifest = json.load(f)
+  sources: list[PullSource] = []
+  for entry in manifest.get('sources', []):
+    if 'remote' not in entry or 'dataset' not in entry:
+      raise ValueError(f'Manifest entry without remote or dataset: {entry}')
+    parse_remote(entry['remote'])  # fail early on invalid remotes
+    sources.append(PullSource(
+      remote = entry['remote'],
+      dataset = f'{parent}/{entry["dataset"]}' if parent else entry['dataset'],
+      port = entry.get('port'),
+      recursive = entry.get('recursive')
+    ))
+  if not sources:
+    raise ValueError(f'No sources in manifest "{path}"')
+  return sources
+
+
+@dataclass
+class PullResult:
+  source: PullSource
+  seconds: float = 0
+  error: Optional[Exception] = None
+
+
+class SourcePrefix(logging.Filter):
+  """Prefixes the messages logged by a worker thread with the source that it is pulling"""
+  names: dict[int, str]
+
+  def __init__(self) -> None:
+    super().__init__()
+    self.names = {}
+
+  def filter(self, record: logging.LogRecord) -> bool:
+    name = self.names.get(record.thread or 0)
+    if name is not None and not getattr(record, 'prefixed', False):
+      record.msg = f'[{name}] {record.msg}'
+      record.prefixed = True  # a record passes every handler
+    return True
+
+
+def pull_concurrently(
+  sources: list[PullSource],
+  pull: Callable[[PullSource], Any],
+  *,
+  jobs: int = 1,
+  jobs_per_host: int = 1
+) -> list[PullResult]:
+  """
+  Pulls from up to jobs sources at once, with at most jobs_per_host of them on the same host.
+  A failing source does not affect the others. Results are returned in source order.
+  A source is only handed to the pool once its host has a free slot, so that a saturated host
+  does not keep workers waiting while sources of other hosts could run.
+  """
+  jobs, jobs_per_host = max(jobs, 1), max(jobs_per_host, 1)
+  prefix = SourcePrefix()
+  handlers = logging.getLogger().handlers
+
+  def run(source: PullSource) -> PullResult:
+    result = PullResult(source)
+    prefix.names[threading.get_ident()] = str(source)
+    start = time.monotonic()
+    try:
+      pull(source)
+    except Exception as e:
+      log.error(f'Failed: {e}')
+      result.error = e
+    finally:
+      result.seconds = time.monotonic() - start
+      del prefix.names[threading.get_ident()]
+    return result
+
+  for h in handlers:
+    h.addFilter(prefix)
+  try:
+    pending = list(range(len(sources)))  # indexes of the sources not yet submitted, in source order
+    running: dict[Future[PullResult], int] = {}
+    per_host: dict[str, int] = {}
+    results: list[Optional[PullResult]] = [None] * len(sources)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+      while pending or running:
+        # submit the first runnable sources until the pool is full
+        for i in list(pending):
+          if len(running) >= jobs:
+            break
+          host = sources[i].host
+          if per_host.get(host, 0) >= jobs_per_host:
+            continue
+          pending.remove(i)
+          per_host[host] = per_host.get(host, 0) + 1
+          running[executor.submit(run, sources[i])] = i
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for f in done:
+          i = running.pop(f)
+          per_host[sources[i].host] -= 1
+          results[i] = f.result()
+    return [r for r in results if r is not None]
+  finally:
+    for h in handlers:
+      h.removeFilter(prefix)
+
+
+def summarize(results: list[PullResult]) -> list[str]:
+  failed = [r for r in results if r.error is not None]
+  lines = [f'Pulled {len(results) - len(failed)} of {len(results)} sources']
+  for r in results:
+    status = 'ok' if r.error is None else f'FAILED: {r.error}'
+    lines.append(f'  {str(r.source):<60} {r.seconds:>8.1f}s  {status}')
+  return lines
@@ -4,7 +4,10 @@ from typing import cast, Optional
 import logging
 
 from ..zfs import LocalZfsCli, RemoteZfsCli
-from ..replication_common import parse_remote, replicate
+from ..replication_common import parse_remote, replicate, TransferBudget, get_dest_policy
+from ..transport import Transport
+from ..filter import parse_tags
+from ..locking import LockKey, lock_datasets, subtree_keys
 from .arguments import Args
 
 
@@ -22,13 +25,24 @@ def entrypoint(raw_args: Namespace) -> None:
   log.info(f'Pushing from local source dataset "{local_dataset}" to remote dest dataset "{remote_dataset}"')
 
   local_cli = LocalZfsCli()
-  remote_cli = RemoteZfsCli(host=host, user=user, port=args.port)
-
-  replicate(
-    source_cli=local_cli,
-    source_dataset=local_dataset,
-    dest_cli=remote_cli,
-    dest_dataset=remote_dataset,
-    recursive=args.recursive,
-    initialize=args.init
-  )
+  remote_cli = RemoteZfsCli(host=host, user=user, port=args.port, cipher=args.ssh_cipher, ssh_options=args.ssh_option)
+
+  # the remote target is locked on this host, against other replications to or from it
+  locks = lambda: subtree_keys(local_cli, local_dataset, args.recursive) + [LockKey(host, remote_dataset)]
+  with lock_datasets(args, locks, dry_run=args.dry_run):
+    replicate(
+      source_cli=local_cli,
+      source_dataset=local_dataset,
+      dest_cli=remote_cli,
+      dest_dataset=remote_dataset,
+      recursive=args.recursive,
+      initialize=args.init,
+      bookmark=args.bookmark,
+      rollback=args.rollback,
+      dry_run=args.dry_run,
+      budget=TransferBudget(args.max_bytes, args.deadline) if args.max_bytes is not None or args.deadline is not None else None,
+      transport=Transport(compression=args.compress, tcp_port=args.tcp_port if args.transport == 'tcp' else None),
+      dest_policy=get_dest_policy(args),
+      tag=parse_tags(args.tag),
+      name=args.name
+    )
@@ -0,0 +1,13 @@
+from argparse import ArgumentParser
+
+from ..utils import parse_duration
+
+
+def setup(parser: ArgumentParser) -> None:
+  parser.add_argument('what', choices=['datasets', 'snapshots', 'replications'])
+  parser.add_argument('--host', type=str, help='only this host, localhost for the local host')
+  parser.add_argument('--stale', type=parse_duration, metavar='DURATION',
+                      help='only datasets without a snapshot, or replications without a replicated snapshot, newer than DURATION')
+  parser.add_argument('--tag', type=str, action='append', default=[])
+  parser.add_argument('--guid', type=int)
+  parser.add_argument('--format', type=str, choices={'table', 'json'}, default='table')
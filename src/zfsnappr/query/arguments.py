@@ -0,0 +1,16 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+from dateutil.relativedelta import relativedelta
+
+from ..arguments import Args as GeneralArgs
+
+
+@dataclass
+class Args(GeneralArgs):
+  what: str
+  host: Optional[str]
+  stale: Optional[relativedelta]
+  tag: list[str]
+  guid: Optional[int]
+  format: str
@@ -0,0 +1,72 @@
+from __future__ import annotations
+from argparse import Namespace
+from typing import Any, cast
+from dataclasses import asdict
+from datetime import datetime, timedelta
+import json
+import sys
+import logging
+
+from ..catalog import catalog
+from ..filter import parse_tags, matches_tags
+from ..table import print_table, format_time
+from .arguments import Args
+
+
+log = logging.getLogger(__name__)
+
+
+def entrypoint(raw_args: Namespace) -> None:
+  args = cast(Args, raw_args)
+
+  if not catalog.enabled:
+    raise ValueError(f"No catalog provided")
+
+  # the catalog is queried by creation time, in seconds since the epoch
+  threshold = int((datetime.now() - args.stale).timestamp()) if args.stale is not None else None
+
+  header: list[str]
+  rows: list[list[str]]
+  records: list[Any]
+  if args.what == 'datasets':
+    datasets = catalog.datasets(args.host, args.dataset, args.recursive)
+    if threshold is not None:
+      datasets = [d for d in datasets if d.newest is None or d.newest < threshold]
+    header = ['HOST', 'DATASET', 'SNAPSHOTS', 'NEWEST', 'LISTED']
+    rows = [[d.host, d.dataset, str(d.snapshots), format_time(d.newest), format_time(d.listed)] for d in datasets]
+    records = datasets
+  elif args.what == 'snapshots':
+    snapshots = catalog.snapshots(args.host, args.dataset, args.recursive, args.guid)
+    tag = parse_tags(args.tag)
+    if tag is not None:
+      snapshots = [s for s in snapshots if matches_tags(s.tags, tag)]
+    if threshold is not None:
+      snapshots = [s for s in snapshots if s.creation < threshold]
+    header = ['HOST', 'DATASET', 'SHORT NAME', 'GUID', 'TAGS', 'TIMESTAMP', 'HOLDS']
+    rows = [
+      [s.host, s.dataset, s.shortname, str(s.guid), ','.join(s.tags) if s.tags is not None else 'UNSET', format_time(s.creation), str(s.holds)]
+      for s in snapshots
+    ]
+    records = snapshots
+  elif args.what == 'replications':
+    replications = catalog.replications(args.host, args.dataset, args.recursive)
+    if threshold is not None:
+      replications = [r for r in replications if r.replicated_creation is None or r.replicated_creation < threshold]
+    header = ['SOURCE', 'DEST', 'REPLICATED', 'LAG', 'LAST RUN']
+    rows = [
+      [f'{r.source_host}:{r.source_dataset}', f'{r.dest_host}:{r.dest_dataset}', format_time(r.replicated_creation),
+       str(timedelta(seconds=r.source_newest - r.replicated_creation)) if r.source_newest is not None and r.replicated_creation is not None else '',
+       format_time(r.replicated)]
+      for r in replications
+    ]
+    records = replications
+  else:
+    assert False
+
+  if args.format == 'table':
+    print_table(header, rows)
+  elif args.format == 'json':
+    sys.stdout.writelines(json.dumps(asdict(r)) + '\n' for r in records)
+  else:
+    assert False
+
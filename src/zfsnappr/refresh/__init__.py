@@ -0,0 +1,3 @@
+from .argparser import *
+from .arguments import *
+from .entrypoint import *
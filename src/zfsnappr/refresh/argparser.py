@@ -0,0 +1,8 @@
+from argparse import ArgumentParser
+
+
+def setup(parser: ArgumentParser) -> None:
+  parser.add_argument('remote', nargs='*', metavar='USER@HOST:DATASET', help='remote datasets to refresh, in addition to the local dataset')
+  parser.add_argument('-p', '--port', type=int)
+  parser.add_argument('--ssh-option', type=str, action='append', default=[], metavar='OPTION', help='ssh_config option like Compression=no')
+  parser.add_argument('-j', '--jobs', type=int, metavar='N', default=4, help='number of hosts that are listed concurrently')
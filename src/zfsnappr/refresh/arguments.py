@@ -0,0 +1,13 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+
+from ..arguments import Args as GeneralArgs
+
+
+@dataclass
+class Args(GeneralArgs):
+  remote: list[str]
+  port: Optional[int]
+  ssh_option: list[str]
+  jobs: int
@@ -0,0 +1,60 @@
+from __future__ import annotations
+from argparse import Namespace
+from typing import Optional, cast
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import CalledProcessError
+import logging
+
+from ..zfs import ZfsCli, LocalZfsCli, RemoteZfsCli, ZfsCommands, ZfsProperty
+from ..catalog import catalog
+from ..replication_common import parse_remote
+from .arguments import Args
+
+
+log = logging.getLogger(__name__)
+
+
+def entrypoint(raw_args: Namespace) -> None:
+  args = cast(Args, raw_args)
+
+  if not catalog.enabled:
+    raise ValueError(f"No catalog provided")
+
+  # the local host is refreshed if a dataset is given or nothing else is
+  targets: list[tuple[ZfsCli, Optional[str]]] = []
+  if args.dataset or not args.remote:
+    targets.append((LocalZfsCli(), args.dataset))
+  for remote in args.remote:
+    user, host, dataset = parse_remote(remote)
+    targets.append((RemoteZfsCli(host=host, user=user, port=args.port, ssh_options=args.ssh_option), dataset))
+
+  with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+    futures = [executor.submit(refresh, cli, dataset, args.recursive) for cli, dataset in targets]
+  failed = 0
+  for (cli, dataset), future in zip(targets, futures):
+    name = f'{cli.host or "localhost"}:{dataset or "*"}'
+    try:
+      count = future.result()
+    except CalledProcessError as e:
+      failed += 1
+      log.error(f'Failed to refresh "{name}": {e}')
+      continue
+    log.info(f'Refreshed "{name}": {count} snapshots')
+  if failed:
+    raise RuntimeError(f'Failed to refresh {failed} of {len(targets)} targets')
+
+
+def refresh(cli: ZfsCli, dataset: Optional[str], recursive: bool) -> int:
+  """
+  Replaces what the catalog knows about dataset (if recursive, with descendants) by a fresh listing, in a single call.
+  If dataset is None, all datasets of the host are refreshed. Returns the number of snapshots.
+  """
+  with cli.batch() as batch:
+    datasets = batch.add(ZfsCommands.get_all_datasets())
+    snapshots = batch.add(ZfsCommands.get_all_snapshots(dataset, recursive or dataset is None, sort_by=ZfsProperty.CREATION))
+  names = [
+    d.name for d in datasets.result()
+    if dataset is None or d.name == dataset or recursive and d.name.startswith(dataset + '/')
+  ]
+  catalog.record_listing(cli.host, dataset, recursive or dataset is None, snapshots.result(), names)
+  return len(snapshots.result())
@@ -1,2 +1,5 @@
 from .parse_remote import *
-from .replicate import *
\ No newline at end of file
+from .replicate import *
+from .send_receive_snap import bookmark_holdtag
+from .budget import TransferBudget, parse_deadline
+from .dest_prune import setup_dest_policy, get_dest_policy
@@ -0,0 +1,69 @@
+from __future__ import annotations
+from typing import Optional
+from datetime import datetime, timedelta
+import re
+import threading
+
+from ..utils import parse_duration
+
+
+def parse_deadline(input: str) -> datetime:
+  """input is either a time of day like 06:30, meaning its next occurrence, or a duration from now like 4h"""
+  now = datetime.now()
+  match = re.fullmatch(r'(\d{1,2}):(\d{2})', input)
+  if match is None:
+    return now + parse_duration(input)
+  deadline = now.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+  if deadline <= now:
+    deadline += timedelta(days=1)
+  return deadline
+
+
+class TransferBudget:
+  """
+  Limits the transfers of a run to complete snapshots that fit into max_bytes and are expected to finish before the deadline.
+  The duration of a transfer is predicted from the rate observed on the previous transfers of the run.
+  A single budget is shared by all datasets that are replicated in a run, also by concurrent replications.
+  """
+  max_bytes: Optional[int]
+  deadline: Optional[datetime]
+  sent_bytes: int
+  _reserved: int  # admitted but not yet recorded
+  _seconds: float  # time spent transferring
+  _lock: threading.Lock
+
+  def __init__(self, max_bytes: Optional[int] = None, deadline: Optional[datetime] = None) -> None:
+    self.max_bytes = max_bytes
+    self.deadline = deadline
+    self.sent_bytes = 0
+    self._reserved = 0
+    self._seconds = 0
+    self._lock = threading.Lock()
+
+  def rate(self) -> Optional[float]:
+    """Observed bytes per second, None if nothing was transferred yet"""
+    if self.sent_bytes == 0 or self._seconds <= 0:
+      return None
+    return self.sent_bytes / self._seconds
+
+  def admits(self, size: int) -> bool:
+    """
+    An admitted size is reserved until it is recorded, so that concurrent transfers cannot exceed max_bytes together.
+    The reservation of a failed transfer is kept, which errs on the safe side.
+    """
+    with self._lock:
+      if self.max_bytes is not None and self.sent_bytes + self._reserved + size > self.max_bytes:
+        return False
+      if self.deadline is not None:
+        rate = self.rate()
+        expected = timedelta(seconds=size / rate) if rate is not None else timedelta()
+        if datetime.now() + expected > self.deadline:
+          return False
+      self._reserved += size
+      return True
+
+  def record(self, size: int, seconds: float) -> None:
+    with self._lock:
+      self._reserved -= size
+      self.sent_bytes += size
+      self._seconds += seconds
@@ -0,0 +1,100 @@
+from __future__ import annotations
+from typing import Optional, Any
+from collections.abc import Collection
+from argparse import ArgumentParser
+from subprocess import CalledProcessError
+from dateutil.relativedelta import relativedelta
+import logging
+import re
+
+from ..zfs import Snapshot, ZfsCli, ZfsCommands, ZfsProperty
+from ..policy import KeepPolicy, apply_policy
+from ..utils import parse_duration, batched
+from ..catalog import catalog
+from ..metrics import metrics
+from ..setup_logging import log_lines
+
+
+log = logging.getLogger(__name__)
+
+# snapshots per zfs destroy call, which keeps the command line short
+DESTROY_BATCH_SIZE = 100
+
+COUNT_OPTS = ['last', 'hourly', 'daily', 'weekly', 'monthly', 'yearly']
+WITHIN_OPTS = ['within', 'within-hourly', 'within-daily', 'within-weekly', 'within-monthly', 'within-yearly']
+
+
+def setup_dest_policy(parser: ArgumentParser) -> None:
+  """Keep policy options like those of prune, prefixed with --dest-keep"""
+  for opt in COUNT_OPTS:
+    parser.add_argument(f'--dest-keep-{opt}', type=int, metavar='N', default=0)
+  for opt in WITHIN_OPTS:
+    parser.add_argument(f'--dest-keep-{opt}', type=parse_duration, metavar='DURATION', default=relativedelta())
+  parser.add_argument('--dest-keep-name', type=re.compile, metavar='REGEX')
+  parser.add_argument('--dest-keep-tag', type=str, action='append', default=[])
+
+
+def get_dest_policy(args: Any) -> Optional[KeepPolicy]:
+  """None if no --dest-keep option is given, in which case the destination is not pruned"""
+  policy = KeepPolicy(
+    last = args.dest_keep_last,
+    hourly = args.dest_keep_hourly,
+    daily = args.dest_keep_daily,
+    weekly = args.dest_keep_weekly,
+    monthly = args.dest_keep_monthly,
+    yearly = args.dest_keep_yearly,
+
+    within = args.dest_keep_within,
+    within_hourly = args.dest_keep_within_hourly,
+    within_daily = args.dest_keep_within_daily,
+    within_weekly = args.dest_keep_within_weekly,
+    within_monthly = args.dest_keep_within_monthly,
+    within_yearly = args.dest_keep_within_yearly,
+
+    name = args.dest_keep_name,
+    tags = frozenset(args.dest_keep_tag)
+  )
+  return policy if policy != KeepPolicy() else None
+
+
+def dest_fields(policy: Optional[KeepPolicy]) -> list[str]:
+  """Fields of the dest snapshots beyond guid and creation: the tags only if the policy keeps snapshots by tag"""
+  return [ZfsProperty.CUSTOM_TAGS] if policy is not None and policy.tags else []
+
+
+def prune_dest(
+  cli: ZfsCli, snapshots: Collection[Snapshot], policy: KeepPolicy, holds: dict[str, set[str]], base: Optional[Snapshot],
+  dry_run: bool = False
+) -> None:
+  """
+  Applies policy to the dest snapshots as they are after replicating, without listing them again.
+  base is the new incremental basis on dest, which is always kept. Held snapshots are kept as well,
+  like the bases of other replications. holds maps longnames to hold tags and may lack new snapshots, which are not held.
+  Snapshots are destroyed with one call per DESTROY_BATCH_SIZE snapshots, in a single round trip.
+  """
+  keep, destroy = apply_policy(snapshots, policy)
+  protected = [s for s in destroy if holds.get(s.longname) or (base is not None and s.guid == base.guid)]
+  destroy = [s for s in destroy if s not in protected]
+  dataset = next(iter(snapshots)).dataset if snapshots else ''
+  log.info(f'Destination policy keeps {len(keep) + len(protected)} and destroys {len(destroy)} snapshots of "{dataset}"'
+           + (f', {len(protected)} held snapshots are kept' if protected else ''))
+  if not destroy:
+    return
+  if dry_run:
+    log_lines(log, (f'Would destroy "{s.longname}"' for s in destroy))
+    return
+
+  chunks = list(batched([s.shortname for s in destroy], DESTROY_BATCH_SIZE))
+  with cli.batch() as batch:
+    results = [batch.add(ZfsCommands.destroy_snapshots(dataset, c)) for c in chunks]
+  destroyed = 0
+  for chunk, result in zip(chunks, results):
+    try:
+      result.result()
+    except (CalledProcessError, RuntimeError) as e:
+      # the batch stops at the first failure, later chunks did not run
+      log.warning(f'Failed to destroy {len(destroy) - destroyed} snapshots of "{dataset}": {e}')
+      break
+    catalog.record_destroyed(cli.host, dataset, chunk)
+    metrics.record_destroyed(cli.host, dataset, len(chunk))
+    destroyed += len(chunk)
@@ -0,0 +1,83 @@
+from __future__ import annotations
+from collections.abc import Collection
+from concurrent.futures import Executor, Future
+from subprocess import CalledProcessError
+from dataclasses import dataclass, field
+from typing import Optional
+
+from ..zfs import Snapshot, ZfsCli, ZfsProperty, Dataset, Bookmark, SNAPSHOT_FIELDS
+
+
+@dataclass
+class SourceState:
+  dataset: Dataset
+  holds: dict[str, set[str]]
+  bookmarks: list[Bookmark] = field(default_factory=list)
+
+@dataclass
+class DestState:
+  exists: bool
+  dataset: Optional[Dataset] = None
+  snaps: list[Snapshot] = field(default_factory=list)  # newest first
+  holds: dict[str, set[str]] = field(default_factory=dict)
+
+
+def get_holdtags(cli: ZfsCli, snaps: Collection[Snapshot]) -> dict[str, set[str]]:
+  """Maps the longname of each snapshot to the tags of its holds"""
+  holds: dict[str, set[str]] = {s.longname: set() for s in snaps}
+  for h in cli.get_holds([s.longname for s in snaps]):
+    holds[h.snap_longname].add(h.tag)
+  return holds
+
+
+def discover_dest(cli: ZfsCli, dataset: str, fields: Collection[str] = SNAPSHOT_FIELDS) -> DestState:
+  """fields of the dest snapshots, see ZfsCli.get_all_snapshots"""
+  try:
+    dest_dataset = next(iter(cli.get_all_datasets(dataset=dataset)))
+  except CalledProcessError as e:
+    # zfs fails with 1 if the dataset does not exist, ssh with 255 if the host is unreachable
+    if e.returncode != 1:
+      raise
+    return DestState(exists=False)
+  snaps = cli.get_all_snapshots(dataset, sort_by=ZfsProperty.CREATETXG, reverse=True, fields=fields)
+  return DestState(
+    exists=True,
+    dataset=dest_dataset,
+    snaps=snaps,
+    holds=get_holdtags(cli, snaps)
+  )
+
+
+class PendingDiscovery:
+  """
+  Metadata queries for one source/dest dataset pair, running in the background.
+  Source-side and dest-side queries do not depend on each other and are issued concurrently.
+  """
+  _source_dataset: Future[Dataset]
+  _source_holds: Future[dict[str, set[str]]]
+  _source_bookmarks: Optional[Future[list[Bookmark]]]
+  _dest: Future[DestState]
+
+  def __init__(
+    self, executor: Executor, source_cli: ZfsCli, source_snaps: Collection[Snapshot], dest_cli: ZfsCli, dest_dataset: str,
+    dest: Optional[Future[DestState]] = None, bookmarks: bool = False, dest_fields: Collection[str] = SNAPSHOT_FIELDS
+  ) -> None:
+    """
+    dest may be an already running discover_dest call for dest_dataset
+    If bookmarks is set, the source bookmarks are fetched as well
+    """
+    source_dataset = next(iter(source_snaps)).dataset
+    self._source_dataset = executor.submit(source_cli.get_dataset, source_dataset)
+    self._source_holds = executor.submit(get_holdtags, source_cli, source_snaps)
+    self._source_bookmarks = executor.submit(source_cli.get_all_bookmarks, source_dataset) if bookmarks else None
+    self._dest = dest if dest is not None else executor.submit(discover_dest, dest_cli, dest_dataset, dest_fields)
+
+  def source(self) -> SourceState:
+    return SourceState(
+      dataset=self._source_dataset.result(),
+      holds=self._source_holds.result(),
+      bookmarks=self._source_bookmarks.result() if self._source_bookmarks is not None else []
+    )
+
+  def dest(self) -> DestState:
+    return self._dest.result()
@@ -0,0 +1,191 @@
+from __future__ import annotations
+from typing import Optional, Union
+from dataclasses import dataclass, field
+
+from ..zfs import Snapshot, Bookmark
+from ..utils import format_size
+from .send_receive_snap import bookmark_name, bookmark_holdtag
+
+
+@dataclass
+class Transfer:
+  snapshot: Snapshot
+  base: Union[Snapshot, Bookmark]
+  size: Optional[int] = None  # estimated stream size in bytes
+
+
+@dataclass
+class ReplicationPlan:
+  """
+  Everything that replicating one dataset is going to do, in execution order:
+  release obsolete holds, roll back dest, set up the incremental basis, transfer.
+  Each transfer moves the holds (or source bookmark) from its base to the sent snapshot.
+  """
+  source_dataset: str
+  dest_dataset: str
+  holdtags: tuple[str, str]
+  bookmark: bool
+
+  # newest snapshot that exists on both sides, or an own source bookmark of it
+  base: Union[Snapshot, Bookmark]
+  # dest snapshot to roll back to if dest has snapshots newer than base, and those snapshots
+  rollback: Optional[Snapshot] = None
+  discard: list[Snapshot] = field(default_factory=list)
+
+  # longnames of snapshots whose holds are released, per side
+  release: tuple[list[str], list[str]] = field(default_factory=lambda: ([], []))
+  # longnames of snapshots that are held before transferring, per side
+  hold: tuple[list[str], list[str]] = field(default_factory=lambda: ([], []))
+  # source bookmarks to create as (snapshot longname, bookmark shortname), and to destroy
+  create_bookmarks: list[tuple[str, str]] = field(default_factory=list)
+  destroy_bookmarks: list[str] = field(default_factory=list)
+
+  transfers: list[Transfer] = field(default_factory=list)
+
+  def describe(self) -> list[str]:
+    lines = [f'Replicating "{self.source_dataset}" to "{self.dest_dataset}"']
+    kind = 'bookmark' if isinstance(self.base, Bookmark) else 'snapshot'
+    lines.append(f'  Common base: {kind} "{self.base.shortname}" ({self.base.timestamp})')
+    if self.rollback is not None:
+      lines.append(f'  Rolling back destination to "{self.rollback.shortname}", discarding {len(self.discard)} snapshots')
+      lines += [f'    {s.timestamp}  {s.longname}' for s in self.discard]
+    if self.release[0] or self.release[1]:
+      lines.append(f'  Releasing {len(self.release[0])} holds in source and {len(self.release[1])} holds in destination')
+    if self.hold[0] or self.hold[1]:
+      lines.append(f'  Holding {len(self.hold[0])} snapshots in source and {len(self.hold[1])} snapshots in destination')
+    if self.create_bookmarks:
+      lines.append(f'  Creating {len(self.create_bookmarks)} bookmarks in source')
+    if self.destroy_bookmarks:
+      lines.append(f'  Destroying {len(self.destroy_bookmarks)} obsolete bookmarks in source')
+    lines.append(f'  Transferring {len(self.transfers)} snapshots')
+    lines += [
+      f'    {t.snapshot.timestamp}  {t.base.shortname} -> {t.snapshot.shortname}' + (f'  ({format_size(t.size)})' if t.size is not None else '')
+      for t in self.transfers
+    ]
+    return lines
+
+
+def plan_replication(
+  source_snaps: list[Snapshot],
+  dest_snaps: list[Snapshot],
+  dest_dataset: str,
+  source_bookmarks: list[Bookmark],
+  holds: tuple[dict[str, set[str]], dict[str, set[str]]],
+  holdtags: tuple[str, str],
+  bookmark: bool = False,
+  selected: Optional[set[int]] = None
+) -> ReplicationPlan:
+  """
+  source_snaps and dest_snaps must be sorted newest first by createtxg and dest_snaps must not be empty.
+  holds maps the longname of each snapshot to its hold tags, see get_holdtags.
+
+  The base is the newest dest snapshot whose GUID exists on source, either as snapshot or as own bookmark.
+  If it is not the newest dest snapshot, the timelines diverged and dest is rolled back to the base.
+  If selected is given, only source snapshots with these GUIDs are transferred, each one based on the previous one.
+  The base may be any source snapshot.
+  """
+  src_holds, dest_holds = holds
+  src_tag, dest_tag = holdtags
+
+  # GUID indexes of both timelines
+  src_index: dict[int, int] = {s.guid: i for i, s in enumerate(source_snaps)}
+  own_bookmarks = [b for b in source_bookmarks if bookmark_holdtag(b) == src_tag]
+  bookmark_index: dict[int, Bookmark] = {b.guid: b for b in own_bookmarks}
+
+  # find newest common snapshot
+  base: Union[Snapshot, Bookmark, None] = None
+  for d, dest_snap in enumerate(dest_snaps):
+    if dest_snap.guid in src_index:
+      base = source_snaps[src_index[dest_snap.guid]]
+      pending = source_snaps[:src_index[dest_snap.guid]]
+      break
+    if dest_snap.guid in bookmark_index:
+      base = bookmark_index[dest_snap.guid]
+      # creation has a resolution of one second, snapshots taken in the same second as the base are newer by createtxg
+      pending = [s for s in source_snaps if s.createtxg > base.createtxg]
+      break
+  if base is None:
+    raise RuntimeError(f'Source and destination dataset do not have any snapshot in common')
+
+  plan = ReplicationPlan(
+    source_dataset=source_snaps[0].dataset,
+    dest_dataset=dest_dataset,
+    holdtags=holdtags,
+    bookmark=bookmark,
+    base=base
+  )
+
+  # divergence
+  kept_dest_snaps = dest_snaps[d:]
+  if d > 0:
+    plan.rollback = dest_snaps[d]
+    plan.discard = dest_snaps[:d]
+    for s in plan.discard:
+      foreign = dest_holds[s.longname] - {dest_tag}
+      if foreign:
+        raise RuntimeError(f'Cannot roll back destination, snapshot "{s.longname}" is held by {", ".join(sorted(foreign))}')
+      if dest_tag in dest_holds[s.longname]:
+        plan.release[1].append(s.longname)
+
+  # holds and bookmarks
+  if bookmark:
+    _plan_bookmarks(plan, source_snaps, kept_dest_snaps, own_bookmarks, holds)
+  else:
+    _plan_holds(plan, source_snaps, src_index, kept_dest_snaps, holds)
+
+  # transfers, oldest first
+  sends = [s for s in reversed(pending) if selected is None or s.guid in selected]
+  bases: list[Union[Snapshot, Bookmark]] = [base, *sends]
+  plan.transfers = [Transfer(snapshot=s, base=b) for b, s in zip(bases, sends)]
+  return plan
+
+
+def _plan_holds(
+  plan: ReplicationPlan,
+  source_snaps: list[Snapshot],
+  src_index: dict[int, int],
+  dest_snaps: list[Snapshot],
+  holds: tuple[dict[str, set[str]], dict[str, set[str]]]
+) -> None:
+  """Finds the latest snapshot that exists on both sides and is held on both sides.
+  Remove holds from any older snaps."""
+  src_holds, dest_holds = holds
+  src_tag, dest_tag = plan.holdtags
+
+  # without a commonly held snap, all holds are released
+  newest_held = (-1, -1)
+  for d, dest_snap in enumerate(dest_snaps):
+    s = src_index.get(dest_snap.guid)
+    if s is None:
+      continue
+    if src_tag in src_holds[source_snaps[s].longname] and dest_tag in dest_holds[dest_snap.longname]:
+      newest_held = (s, d)
+      break
+
+  plan.release[0].extend(s.longname for s in source_snaps[newest_held[0]+1:] if src_tag in src_holds[s.longname])
+  plan.release[1].extend(s.longname for s in dest_snaps[newest_held[1]+1:] if dest_tag in dest_holds[s.longname])
+
+
+def _plan_bookmarks(
+  plan: ReplicationPlan,
+  source_snaps: list[Snapshot],
+  dest_snaps: list[Snapshot],
+  own_bookmarks: list[Bookmark],
+  holds: tuple[dict[str, set[str]], dict[str, set[str]]]
+) -> None:
+  """Bookmark counterpart of _plan_holds.
+  Ensures that the base is bookmarked on source and held on dest,
+  then removes all other own bookmarks on source and all holds on both sides."""
+  src_holds, dest_holds = holds
+  src_tag, dest_tag = plan.holdtags
+  base = plan.base
+
+  if isinstance(base, Snapshot) and not any(b.guid == base.guid for b in own_bookmarks):
+    plan.create_bookmarks.append((base.longname, bookmark_name(src_tag, base)))
+  # base is the newest kept dest snap
+  if dest_tag not in dest_holds[dest_snaps[0].longname]:
+    plan.hold[1].append(dest_snaps[0].longname)
+
+  plan.destroy_bookmarks.extend(b.longname for b in own_bookmarks if b.guid != base.guid)
+  plan.release[0].extend(s.longname for s in source_snaps if src_tag in src_holds[s.longname])
+  plan.release[1].extend(s.longname for s in dest_snaps[1:] if dest_tag in dest_holds[s.longname])
@@ -1,13 +1,56 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from collections.abc import Collection
+import re
 
-from ..zfs import ZfsCli, ZfsProperty
-from .replicate_snaps import replicate_snaps
+from ..zfs import ZfsCli, ZfsProperty, Snapshot
+from ..filter import filter_snaps
+from .replicate_snaps import replicate_snaps, DISCOVERY_WORKERS
 from .replicate_hierarchy import replicate_hierarchy
+from .discovery import PendingDiscovery, discover_dest
+from .dest_prune import dest_fields
+from .budget import TransferBudget
+from ..policy import KeepPolicy
+from ..transport import Transport
 
 
-def replicate(source_cli: ZfsCli, source_dataset: str, dest_cli: ZfsCli, dest_dataset: str, recursive: bool=False, initialize: bool=False):
-  source_snaps = source_cli.get_all_snapshots(source_dataset, recursive=recursive, sort_by=ZfsProperty.CREATION, reverse=True)
+# tags of the source snapshots are copied to dest, the snapshots are ordered by createtxg and matched by guid
+SOURCE_FIELDS = [ZfsProperty.CUSTOM_TAGS, ZfsProperty.CREATETXG]
+
+
+def replicate(
+  source_cli: ZfsCli, source_dataset: str, dest_cli: ZfsCli, dest_dataset: str,
+  recursive: bool=False, initialize: bool=False, bookmark: bool=False, rollback: bool=False, dry_run: bool=False,
+  budget: Optional[TransferBudget]=None, transport: Transport=Transport(), dest_policy: Optional[KeepPolicy]=None,
+  tag: Optional[Collection[Collection[str]]]=None, name: Optional[re.Pattern]=None
+):
+  """
+  If tag or name is given, only the matching source snapshots are transferred, see filter.filter_snaps.
+  The other source snapshots may still serve as incremental basis.
+  """
+  options = dict(initialize=initialize, bookmark=bookmark, rollback=rollback, dry_run=dry_run, budget=budget, transport=transport, dest_policy=dest_policy)
+
   if recursive:
-    replicate_hierarchy(source_cli, source_dataset, source_snaps, dest_cli, dest_dataset, initialize=initialize)
-  else:
-    replicate_snaps(source_cli, source_snaps, dest_cli, dest_dataset, initialize=initialize)
+    source_snaps = source_cli.get_all_snapshots(source_dataset, recursive=recursive, sort_by=ZfsProperty.CREATETXG, reverse=True,
+                                                fields=SOURCE_FIELDS)
+    replicate_hierarchy(source_cli, source_dataset, source_snaps, dest_cli, dest_dataset, **options,
+                        selected=select(source_snaps, tag, name))
+    return
+
+  with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+    # the dest side does not depend on the source listing
+    dest = executor.submit(discover_dest, dest_cli, dest_dataset, dest_fields(dest_policy))
+    source_snaps = source_cli.get_all_snapshots(source_dataset, recursive=recursive, sort_by=ZfsProperty.CREATETXG, reverse=True,
+                                                fields=SOURCE_FIELDS)
+    discovery = PendingDiscovery(executor, source_cli, source_snaps, dest_cli, dest_dataset, dest=dest, bookmarks=bookmark,
+                                 dest_fields=dest_fields(dest_policy)) if source_snaps else None
+    replicate_snaps(source_cli, source_snaps, dest_cli, dest_dataset, discovery=discovery, **options,
+                    selected=select(source_snaps, tag, name))
+
+
+def select(snaps: list[Snapshot], tag: Optional[Collection[Collection[str]]], name: Optional[re.Pattern]) -> Optional[set[int]]:
+  """GUIDs of the snapshots to transfer, None for all"""
+  if tag is None and name is None:
+    return None
+  return {s.guid for s in filter_snaps(snaps, tag=tag, name=name)}
@@ -1,24 +1,50 @@
 from __future__ import annotations
 from collections.abc import Collection
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from ..zfs import Snapshot, ZfsCli
 from ..utils import group_snaps_by
-from .replicate_snaps import replicate_snaps
+from .replicate_snaps import replicate_snaps, DISCOVERY_WORKERS
+from .discovery import PendingDiscovery
+from .budget import TransferBudget
+from .dest_prune import dest_fields
+from ..policy import KeepPolicy
+from ..transport import Transport
 
 
 def replicate_hierarchy(
     source_cli: ZfsCli, source_dataset_root: str, source_snaps: Collection[Snapshot],
     dest_cli: ZfsCli, dest_dataset_root: str,
-    initialize: bool
+    initialize: bool, bookmark: bool = False, rollback: bool = False, dry_run: bool = False,
+    budget: Optional[TransferBudget] = None, transport: Transport = Transport(), dest_policy: Optional[KeepPolicy] = None,
+    selected: Optional[set[int]] = None
 ):
   """
   replicates given snaps under dest_dataset
   keeps the dataset hierarchy
   all source_snaps must be under source_dataset_root
+
+  While a dataset is being transferred, the metadata of the next dataset is already being fetched.
   """
-  for abs_source_dataset, source_snaps in group_snaps_by(source_snaps, lambda s: s.dataset).items():
+  jobs: list[tuple[list[Snapshot], str]] = []
+  for abs_source_dataset, snaps in group_snaps_by(source_snaps, lambda s: s.dataset).items():
     assert abs_source_dataset.startswith(source_dataset_root)
     rel_dataset = abs_source_dataset.removeprefix(source_dataset_root)
-    abs_dest_dataset = dest_dataset_root + rel_dataset
+    jobs.append((snaps, dest_dataset_root + rel_dataset))
+
+  if not jobs:
+    return
 
-    replicate_snaps(source_cli, source_snaps, dest_cli, abs_dest_dataset, initialize=initialize)
+  # two discoveries may be in flight at once: the current one and the prefetched one
+  with ThreadPoolExecutor(max_workers=2*DISCOVERY_WORKERS) as executor:
+    discover = lambda job: PendingDiscovery(executor, source_cli, job[0], dest_cli, job[1], bookmarks=bookmark,
+                                            dest_fields=dest_fields(dest_policy))
+    next_discovery: Optional[PendingDiscovery] = discover(jobs[0])
+    for i, (snaps, abs_dest_dataset) in enumerate(jobs):
+      assert next_discovery is not None
+      discovery = next_discovery
+      next_discovery = discover(jobs[i+1]) if i+1 < len(jobs) else None
+      replicate_snaps(source_cli, snaps, dest_cli, abs_dest_dataset, initialize=initialize, discovery=discovery, bookmark=bookmark,
+                      rollback=rollback, dry_run=dry_run, budget=budget, transport=transport,
+                      dest_policy=dest_policy, selected=selected)
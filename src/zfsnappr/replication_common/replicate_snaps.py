@@ -1,14 +1,30 @@
 from __future__ import annotations
 from typing import Optional, cast
 from collections.abc import Collection
+from concurrent.futures import Executor, ThreadPoolExecutor
 import logging
+import time
 
-from ..zfs import Snapshot, ZfsCli, ZfsProperty, Dataset
+from ..zfs import Snapshot, ZfsCli, ZfsCommands, ZfsProperty, Dataset, Bookmark
 from .send_receive_snap import send_receive_incremental, send_receive_initial
+from .discovery import PendingDiscovery, SourceState, discover_dest, get_holdtags
+from .plan import ReplicationPlan, plan_replication
+from .budget import TransferBudget
+from .dest_prune import prune_dest, dest_fields
+from ..policy import KeepPolicy
+from ..transport import Transport
+from ..utils import format_size
+from ..trace import tracer
+from ..catalog import catalog
+from ..metrics import metrics
+from ..setup_logging import log_lines, DETAIL
 
 
 log = logging.getLogger(__name__)
 
+# source dataset, source holds and dest listing are queried concurrently
+DISCOVERY_WORKERS = 3
+
 
 def holdtag_src(dest_dataset: Dataset):
   return f'zfsnappr-sendbase-{dest_dataset.guid}'
@@ -18,109 +34,235 @@ def holdtag_dest(src_dataset: Dataset):
 
 
 # TODO: raw send for encrypted datasets?
-def replicate_snaps(source_cli: ZfsCli, source_snaps: Collection[Snapshot], dest_cli: ZfsCli, dest_dataset: str, initialize: bool):
+def replicate_snaps(
+  source_cli: ZfsCli, source_snaps: Collection[Snapshot], dest_cli: ZfsCli, dest_dataset: str, initialize: bool,
+  discovery: Optional[PendingDiscovery] = None, bookmark: bool = False, rollback: bool = False, dry_run: bool = False,
+  budget: Optional[TransferBudget] = None, transport: Transport = Transport(), dest_policy: Optional[KeepPolicy] = None,
+  selected: Optional[set[int]] = None
+):
   """
   replicates source_snaps to dest_dataset
   all source_snaps must be of same dataset
 
-  Let S and D be the snapshots on source and dest, newest first.
-  Then D[0] = S[b] for some index b.
-  We call b the base index. It is used as an incremental basis for sending snapshots S[:b]
+  The newest snapshot that exists on both sides is used as incremental basis for sending all newer source snapshots,
+  see plan_replication. Dest is only rolled back to that basis if rollback is set.
+
+  If bookmark is set, the incremental basis on the source is kept by a bookmark instead of a hold,
+  and a bookmark may serve as incremental basis as well.
+
+  If given, discovery must have been started for the same source_snaps and dest_dataset.
+
+  Every pending stream is estimated before transferring. If budget is given, only the oldest pending
+  snapshots that fit into it are transferred and the rest is left for the next run.
+
+  If dest_policy is given, it is applied to the dest snapshots right after transferring, see prune_dest.
+
+  If selected is given, only the source snapshots with these GUIDs are transferred, see plan_replication.
   """
   if not source_snaps:
     log.info(f'No source snapshots given, nothing to do')
     return
 
+  if discovery is None:
+    with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+      replicate_snaps(source_cli, source_snaps, dest_cli, dest_dataset, initialize,
+                      PendingDiscovery(executor, source_cli, source_snaps, dest_cli, dest_dataset, bookmarks=bookmark,
+                                       dest_fields=dest_fields(dest_policy)),
+                      bookmark=bookmark, rollback=rollback, dry_run=dry_run, budget=budget, transport=transport,
+                      dest_policy=dest_policy, selected=selected)
+    return
+
   # sorting is required
-  source_snaps = sorted(source_snaps, key=lambda s: s.timestamp, reverse=True)
+  source_snaps = sorted(source_snaps, key=lambda s: s.createtxg, reverse=True)
+  candidates = [s for s in source_snaps if selected is None or s.guid in selected]
 
   # ensure dest dataset exists
-  dest_exists: bool = any(dest_dataset == d.name for d in dest_cli.get_all_datasets())
-  if not dest_exists:
-    if initialize:
-      log.info(f"Creating destination dataset by transferring the oldest snapshot")
-      send_receive_initial(
-        clis=(source_cli, dest_cli),
-        dest_dataset=dest_dataset,
-        snapshot=source_snaps[-1],
-        holdtags=(holdtag_src, holdtag_dest)
-      )
-    else:
+  with tracer.phase('discovery'):
+    dest = discovery.dest()
+  initialized = False
+  if not dest.exists:
+    if not initialize:
       raise RuntimeError(f'Destination dataset does not exists and will not be created')
+    if not candidates:
+      log.info(f'No selected source snapshots, not creating destination dataset "{dest_dataset}"')
+      return
+    initial = candidates[-1]
+    size = source_cli.estimate_send_size(initial.longname)
+    if dry_run:
+      log.info(f'Would create destination dataset "{dest_dataset}" by transferring the oldest snapshot ({format_size(size)}), '
+               f'then transfer {len(candidates)-1} snapshots')
+      return
+    if budget is not None and not budget.admits(size):
+      log.info(f'Transfer budget exhausted, deferring creation of "{dest_dataset}" ({format_size(size)}) to the next run')
+      return
+    log.info(f"Creating destination dataset by transferring the oldest snapshot ({format_size(size)})")
+    start = time.monotonic()
+    send_receive_initial(
+      clis=(source_cli, dest_cli),
+      dest_dataset=dest_dataset,
+      snapshot=initial,
+      holdtags=(holdtag_src, holdtag_dest),
+      bookmark=bookmark,
+      transport=transport
+    )
+    seconds = time.monotonic() - start
+    if budget is not None:
+      budget.record(size, seconds)
+    catalog.record_replication((source_cli.host, initial.dataset), (dest_cli.host, dest_dataset), initial)
+    metrics.record_transfer((source_cli.host, initial.dataset), (dest_cli.host, dest_dataset), size, seconds)
+    dest = discover_dest(dest_cli, dest_dataset, dest_fields(dest_policy))
+    initialized = True
 
   # get dest snaps
-  dest_snaps = dest_cli.get_all_snapshots(dest_dataset, sort_by=ZfsProperty.CREATION, reverse=True)
+  dest_snaps = dest.snaps
   if not dest_snaps:
     raise RuntimeError(f'Destination dataset does not contain any snapshots')
 
-  # figure out base index
-  base = next((i for i, s in enumerate(source_snaps) if s.guid == dest_snaps[0].guid), None)
-  if base is None:
-    raise RuntimeError(f'Latest destination snapshot "{dest_snaps[0].shortname}" does not exist on source dataset')
-
   # resolve hold tags
-  source_tag = holdtag_src(dest_cli.get_dataset(dest_dataset))
-  dest_tag = holdtag_dest(source_cli.get_dataset(next(iter(source_snaps)).dataset))
-
-  release_obsolete_holds((source_cli, dest_cli), (source_snaps, dest_snaps), (source_tag, dest_tag))
+  with tracer.phase('discovery'):
+    source = discovery.source()
+  assert dest.dataset is not None
+  source_tag = holdtag_src(dest.dataset)
+  dest_tag = holdtag_dest(source.dataset)
 
-  if base == 0:
-    log.info(f'Source dataset does not have any new snapshots, nothing to do')
-    return
+  if initialized:
+    # the initial transfer placed a hold or bookmark that the prefetched source state does not know about
+    source = SourceState(
+      dataset=source.dataset,
+      holds=get_holdtags(source_cli, source_snaps),
+      bookmarks=source_cli.get_all_bookmarks(source.dataset.name) if bookmark else []
+    )
 
-  log.info(f'Transferring {base} snapshots')
-  for i in range(base):
-    send_receive_incremental(
-      clis=(source_cli, dest_cli),
-      dest_dataset=dest_dataset,
+  with tracer.phase('plan'):
+    plan = plan_replication(
+      source_snaps, dest_snaps, dest_dataset, source.bookmarks,
+      holds=(source.holds, dest.holds),
       holdtags=(source_tag, dest_tag),
-      snapshot=source_snaps[base-i-1],
-      base=source_snaps[base-i],
-      unsafe_release=(i > 0)
+      bookmark=bookmark,
+      selected=selected
     )
-    log.info(f'{i+1}/{base} transferred')
-  dest_snaps = [s.with_dataset(dest_dataset) for s in source_snaps[:base]] + dest_snaps
-  log.info(f'Transfer completed')
+    estimate_transfers(source_cli, plan)
+  log_lines(log, plan.describe(), logging.INFO if dry_run else logging.DEBUG)
 
+  if plan.rollback is not None and not rollback:
+    raise RuntimeError(
+      f'Latest destination snapshot "{dest_snaps[0].shortname}" does not exist on source dataset. '
+      f'Rolling back destination to the common snapshot "{plan.rollback.shortname}" would discard {len(plan.discard)} snapshots'
+    )
+  if dry_run:
+    if dest_policy is not None:
+      prune_dest_after(dest_cli, plan, dest_snaps, dest.holds, [t.snapshot for t in plan.transfers], dest_policy, dry_run=True)
+    return
+
+  with tracer.phase('transfer'):
+    transferred = execute_plan((source_cli, dest_cli), plan, budget, transport)
+  if dest_policy is not None:
+    with tracer.phase('prune'):
+      prune_dest_after(dest_cli, plan, dest_snaps, dest.holds, transferred, dest_policy)
+
+
+def prune_dest_after(
+  cli: ZfsCli, plan: ReplicationPlan, dest_snaps: list[Snapshot], dest_holds: dict[str, set[str]],
+  transferred: list[Snapshot], policy: KeepPolicy, dry_run: bool = False
+) -> None:
+  """Prunes dest as it is after executing plan, where transferred are the source snapshots that were transferred"""
+  discarded = {s.guid for s in plan.discard}
+  received = [s.with_dataset(plan.dest_dataset) for s in transferred]
+  snaps = [s for s in dest_snaps if s.guid not in discarded] + received
+  # the hold of this replication has moved to the new base, which is protected anyway
+  holds = {name: tags - {plan.holdtags[1]} for name, tags in dest_holds.items()}
+  base = received[-1] if received else next((s for s in snaps if s.guid == plan.base.guid), None)
+  prune_dest(cli, snaps, policy, holds, base, dry_run=dry_run)
 
 
-def release_obsolete_holds(clis: tuple[ZfsCli,ZfsCli], snaps: tuple[list[Snapshot],list[Snapshot]], holdtags: tuple[str,str]):
-  """Finds the latest snapshot that exists on both sides and is held on both sides.
-  Remove holds from any older snaps."""
-  # find common snaps
-  common_guids = {s.guid for s in snaps[0]} & {s.guid for s in snaps[1]}
-  src_common_snaps = [(s,i) for i,s in enumerate(snaps[0]) if s.guid in common_guids]
-  dest_common_snaps = [(s,i) for i,s in enumerate(snaps[1]) if s.guid in common_guids]
-
-  # get source holds
-  src_holds = {s.longname: set() for s in snaps[0]}
-  for h in clis[0].get_holds([s.longname for s in snaps[0]]):
-    src_holds[h.snap_longname].add(h.tag)
-
-  # get dest holds
-  dest_holds = {s.longname: set() for s in snaps[1]}
-  for h in clis[1].get_holds([s.longname for s in snaps[1]]):
-    dest_holds[h.snap_longname].add(h.tag)
-
-  # find index in source and dest of latest common snap with holdtags
-  for i in range(len(common_guids)):
-    src_snap, src_index = src_common_snaps[i]
-    dest_snap, dest_index = dest_common_snaps[i]
-    if holdtags[0] in src_holds[src_snap.longname] and holdtags[1] in dest_holds[dest_snap.longname]:
-      newest_common_snap = (src_index, dest_index)
-      break
-  else:
-    # no commonly held snap
-    newest_common_snap = (-1, -1)
-  
-  log.debug(f"Newest common snap is at indices {newest_common_snap}")
-  
-  # remove holdtag from all older snaps
-  src_release = [s.longname for s in snaps[0][newest_common_snap[0]+1:] if holdtags[0] in src_holds[s.longname]]
-  dest_release = [s.longname for s in snaps[1][newest_common_snap[1]+1:] if holdtags[1] in dest_holds[s.longname]]
-  if src_release:
-    log.info(f"Releasing {len(src_release)} obsolete holds in source")
-  if dest_release:
-    log.info(f"Releasing {len(dest_release)} obsolete holds in destination")
-  clis[0].release(src_release, holdtags[0])
-  clis[1].release(dest_release, holdtags[1])
+def estimate_transfers(cli: ZfsCli, plan: ReplicationPlan) -> None:
+  """Sets the estimated stream size of each transfer, with a single call"""
+  if not plan.transfers:
+    return
+  with cli.batch() as batch:
+    estimates = [batch.add(ZfsCommands.estimate_send(t.snapshot.longname, t.base.longname)) for t in plan.transfers]
+  for t, e in zip(plan.transfers, estimates):
+    t.size = e.result()
+  total = sum(t.size or 0 for t in plan.transfers)
+  log.info(f'{len(plan.transfers)} pending snapshots of "{plan.source_dataset}" sum up to an estimated {format_size(total)}')
+
+
+def execute_plan(
+  clis: tuple[ZfsCli, ZfsCli], plan: ReplicationPlan, budget: Optional[TransferBudget] = None, transport: Transport = Transport()
+) -> list[Snapshot]:
+  """
+  Metadata changes are batched per side, so each side costs a single round trip before the transfers.
+  Returns the transferred snapshots, oldest first.
+  """
+  src_cli, dest_cli = clis
+  src_tag, dest_tag = plan.holdtags
+
+  if plan.release[0]:
+    log.info(f"Releasing {len(plan.release[0])} obsolete holds in source")
+  if plan.release[1]:
+    log.info(f"Releasing {len(plan.release[1])} obsolete holds in destination")
+  if plan.rollback is not None:
+    log.info(f'Rolling back destination to "{plan.rollback.shortname}", discarding {len(plan.discard)} snapshots')
+  for snapshot, _ in plan.create_bookmarks:
+    log.info(f'Bookmarking incremental basis "{snapshot}" in source')
+  if plan.destroy_bookmarks:
+    log.info(f"Destroying {len(plan.destroy_bookmarks)} obsolete bookmarks in source")
+
+  with dest_cli.batch() as batch:
+    if plan.release[1]:
+      batch.add(ZfsCommands.release(plan.release[1], dest_tag))
+    if plan.rollback is not None:
+      batch.add(ZfsCommands.rollback(plan.rollback.longname))
+    if plan.hold[1]:
+      batch.add(ZfsCommands.hold(plan.hold[1], dest_tag))
+
+  with src_cli.batch() as batch:
+    if plan.release[0]:
+      batch.add(ZfsCommands.release(plan.release[0], src_tag))
+    for snapshot, name in plan.create_bookmarks:
+      batch.add(ZfsCommands.create_bookmark(snapshot, name))
+    if plan.hold[0]:
+      batch.add(ZfsCommands.hold(plan.hold[0], src_tag))
+    # only destroyed once the new basis is in place
+    for b in plan.destroy_bookmarks:
+      batch.add(ZfsCommands.destroy_bookmark(b))
+
+  source, dest = (src_cli.host, plan.source_dataset), (dest_cli.host, plan.dest_dataset)
+  if not plan.transfers:
+    if isinstance(plan.base, Snapshot):
+      catalog.record_replication(source, dest, plan.base)
+    log.info(f'Source dataset does not have any new snapshots, nothing to do')
+    return []
+
+  if isinstance(plan.base, Bookmark):
+    log.info(f'Using bookmark "{plan.base.shortname}" as incremental basis')
+  n = len(plan.transfers)
+  log.info(f'Transferring {n} snapshots')
+  transferred: list[Snapshot] = []
+  for i, transfer in enumerate(plan.transfers):
+    size = transfer.size or 0
+    # each transfer is based on the previous one, so the remaining ones are deferred as a whole
+    if budget is not None and not budget.admits(size):
+      deferred = sum(t.size or 0 for t in plan.transfers[i:])
+      log.info(f'Transfer budget exhausted, deferring {n-i} snapshots ({format_size(deferred)}) to the next run')
+      return transferred
+    start = time.monotonic()
+    send_receive_incremental(
+      clis=clis,
+      dest_dataset=plan.dest_dataset,
+      holdtags=plan.holdtags,
+      snapshot=transfer.snapshot,
+      base=transfer.base,
+      unsafe_release=(i > 0),
+      bookmark=plan.bookmark,
+      transport=transport
+    )
+    seconds = time.monotonic() - start
+    if budget is not None:
+      budget.record(size, seconds)
+    catalog.record_replication(source, dest, transfer.snapshot)
+    metrics.record_transfer(source, dest, size, seconds)
+    transferred.append(transfer.snapshot)
+    log.info(f'{i+1}/{n} transferred', extra=DETAIL)
+  log.info(f'Transfer completed')
+  return transferred
@@ -1,26 +1,52 @@
-from typing import Optional, Callable, Union
-from subprocess import CalledProcessError
+from typing import Optional, Callable, Union, IO, cast
+from subprocess import CalledProcessError, DEVNULL
 import time
+import re
 
-from ..zfs import ZfsCli, Snapshot, ZfsProperty, Dataset
+from ..zfs import ZfsCli, ZfsCommand, ZfsCommands, Snapshot, ZfsProperty, Dataset, Bookmark
+from ..transport import Transport
 
 Holdtag = Union[str, Callable[[Dataset],str]]
 
 
+def bookmark_name(holdtag: str, snapshot: Snapshot) -> str:
+  """Name of the bookmark that replaces the source hold with given tag when replicating with bookmarks"""
+  return f'{holdtag}_{snapshot.shortname}'
+
+def bookmark_holdtag(bookmark: Bookmark) -> Optional[str]:
+  """Inverse of bookmark_name. Returns None if bookmark was not created by replication"""
+  match = re.fullmatch(r'(zfsnappr-sendbase-\d+)_.*', bookmark.shortname)
+  return match.group(1) if match else None
+
+
 def _send_receive(
   clis: tuple[ZfsCli, ZfsCli],
   dest_dataset: str,
   snapshot: Snapshot,
-  base: Optional[Snapshot],
+  base: Union[Snapshot, Bookmark, None],
   holdtags: tuple[Holdtag,Holdtag],
-  properties: dict[str, str] = {}
+  properties: dict[str, str] = {},
+  bookmark: bool = False,
+  cleanup: tuple[list[ZfsCommand], list[ZfsCommand]] = ([], []),
+  transport: Transport = Transport()
 ) -> None:
+  """
+  If bookmark is set, the sent snapshot is bookmarked on the source instead of held
+  cleanup contains commands per side that run after the sent snapshot is held
+  """
   src_cli, dest_cli = clis
+  send_filters, recv_filters = transport.filters(src_cli.host, dest_cli.host)
 
   # create sending and receiving process
-  send_proc = src_cli.send_snapshot_async(snapshot.longname, base.longname if base else None)
-  assert send_proc.stdout is not None
-  recv_proc = dest_cli.receive_snapshot_async(dest_dataset, send_proc.stdout, properties)
+  base_name = base.longname if base else None
+  if transport.tcp_port is None:
+    send_proc = src_cli.send_snapshot_async(snapshot.longname, base_name, send_filters)
+    assert send_proc.stdout is not None
+    recv_proc = dest_cli.receive_snapshot_async(dest_dataset, send_proc.stdout, properties, recv_filters)
+  else:
+    # the filters connect both sides over TCP
+    recv_proc = dest_cli.receive_snapshot_async(dest_dataset, cast(IO[bytes], DEVNULL), properties, recv_filters)
+    send_proc = src_cli.send_snapshot_async(snapshot.longname, base_name, send_filters, stdout=DEVNULL)
   
   # wait for both processes to terminate
   while True:
@@ -28,36 +54,44 @@ def _send_receive(
     if send_status is not None and recv_status is not None:
       # both terminated
       break
-    if send_status is not None and send_status > 0:
+    if send_status is not None and send_status != 0:
       # zfs send process died with error
       recv_proc.terminate()
-    if recv_status is not None and recv_status > 0:
+    if recv_status is not None and recv_status != 0:
       # zfs receive process died with error
       send_proc.terminate()
     time.sleep(0.1)
 
-  # check exit codes
-  for p in send_proc, recv_proc:
-    if p.returncode > 0:
+  # check exit codes, an actual error takes precedence over being terminated
+  for p in sorted((send_proc, recv_proc), key=lambda p: p.returncode < 0):
+    if p.returncode != 0:
       raise CalledProcessError(p.returncode, cmd=p.args)
     
-  # set tags on dest snapshot
-  if snapshot.tags is not None:
-    dest_cli.set_tags(snapshot.with_dataset(dest_dataset).longname, snapshot.tags)
-
-  # hold snaps
+  # set tags and hold snaps, then clean up, with a single call per side
   src_tag = holdtags[0] if isinstance(holdtags[0], str) else holdtags[0](dest_cli.get_dataset(dest_dataset))
   dest_tag = holdtags[1] if isinstance(holdtags[1], str) else holdtags[1](src_cli.get_dataset(snapshot.dataset))
-  src_cli.hold([snapshot.longname], src_tag)
-  dest_cli.hold([snapshot.with_dataset(dest_dataset).longname], dest_tag)
-
+  with dest_cli.batch() as batch:
+    if snapshot.tags is not None:
+      batch.add(ZfsCommands.set_tags(snapshot.with_dataset(dest_dataset).longname, snapshot.tags))
+    batch.add(ZfsCommands.hold([snapshot.with_dataset(dest_dataset).longname], dest_tag))
+    for c in cleanup[1]:
+      batch.add(c)
+  with src_cli.batch() as batch:
+    if bookmark:
+      batch.add(ZfsCommands.create_bookmark(snapshot.longname, bookmark_name(src_tag, snapshot)))
+    else:
+      batch.add(ZfsCommands.hold([snapshot.longname], src_tag))
+    for c in cleanup[0]:
+      batch.add(c)
 
 
 def send_receive_initial(
   clis: tuple[ZfsCli, ZfsCli],
   dest_dataset: str,
   snapshot: Snapshot,
-  holdtags: tuple[Callable[[Dataset], str], Callable[[Dataset], str]]
+  holdtags: tuple[Callable[[Dataset], str], Callable[[Dataset], str]],
+  bookmark: bool = False,
+  transport: Transport = Transport()
 ) -> None:
   _send_receive(
     clis=clis,
@@ -69,6 +103,8 @@ def send_receive_initial(
       ZfsProperty.READONLY: 'on',
       ZfsProperty.ATIME: 'off'
     },
+    bookmark=bookmark,
+    transport=transport
   )
   
 
@@ -77,21 +113,44 @@ def send_receive_incremental(
   dest_dataset: str,
   holdtags: tuple[str,str],
   snapshot: Snapshot,
-  base: Optional[Snapshot]=None,
-  unsafe_release: bool=False
+  base: Union[Snapshot, Bookmark, None]=None,
+  unsafe_release: bool=False,
+  bookmark: bool=False,
+  transport: Transport=Transport()
 ) -> None:
+  """
+  base may be a bookmark only if bookmark is set.
+  If bookmark is set, the bookmark of the base replaces the source hold and is destroyed instead of released.
+  """
+  # release base snaps once the sent snapshot is held
+  src_cleanup: list[ZfsCommand] = []
+  dest_cleanup: list[ZfsCommand] = []
+  if isinstance(base, Bookmark):
+    assert bookmark
+    src_cleanup.append(ZfsCommands.destroy_bookmark(base.longname))
+    s = f'{dest_dataset}@{base.shortname.removeprefix(holdtags[0] + "_")}'
+    if unsafe_release or clis[1].has_hold(s, holdtags[1]):
+      dest_cleanup.append(ZfsCommands.release([s], holdtags[1]))
+  elif base:
+    if bookmark:
+      b = f'{base.dataset}#{bookmark_name(holdtags[0], base)}'
+      if unsafe_release or any(x.longname == b for x in clis[0].get_all_bookmarks(base.dataset)):
+        src_cleanup.append(ZfsCommands.destroy_bookmark(b))
+    else:
+      s = base.longname
+      if unsafe_release or clis[0].has_hold(s, holdtags[0]):
+        src_cleanup.append(ZfsCommands.release([s], holdtags[0]))
+    s = base.with_dataset(dest_dataset).longname
+    if unsafe_release or clis[1].has_hold(s, holdtags[1]):
+      dest_cleanup.append(ZfsCommands.release([s], holdtags[1]))
+
   _send_receive(
     clis=clis,
     dest_dataset=dest_dataset,
     snapshot=snapshot,
     base=base,
-    holdtags=holdtags
+    holdtags=holdtags,
+    bookmark=bookmark,
+    cleanup=(src_cleanup, dest_cleanup),
+    transport=transport
   )
-  # release base snaps
-  if base:
-    s = base.longname
-    if unsafe_release or clis[0].has_hold(s, holdtags[0]):
-      clis[0].release([s], holdtags[0])
-    s = base.with_dataset(dest_dataset).longname
-    if unsafe_release or clis[1].has_hold(s, holdtags[1]):
-      clis[1].release([s], holdtags[1])
@@ -0,0 +1,154 @@
+from __future__ import annotations
+from typing import Optional, IO
+from collections import deque
+from collections.abc import Iterable
+import hashlib
+import json
+import re
+import secrets
+import threading
+
+
+# batches frame their output with a random token, which differs between recording and replay
+_BATCH_TOKEN = re.compile(r'zfsnappr-batch-[0-9a-f]{16}')
+_BATCH_PLACEHOLDER = 'zfsnappr-batch-TOKEN'
+# candidates for names, which are hashed if they contain a separator or are a known pool
+_TOKEN = re.compile(r'''[^\s'"=;&|<>()$]+''')
+_SEPARATORS = re.compile(r'([/@#,%:])')
+# prefix of replication hold tags and bookmarks that must survive anonymization
+_HOLDTAG_PREFIX = re.compile(r'(zfsnappr-(?:send|recv)base-\d+_)(.*)')
+
+
+class Anonymizer:
+  """
+  Replaces dataset, snapshot and bookmark names by salted hashes, component by component,
+  so that the hierarchy and the relations between names are preserved.
+  """
+  _salt: bytes
+  _pools: set[str]
+
+  def __init__(self) -> None:
+    self._salt = secrets.token_bytes(16)
+    self._pools = set()
+
+  def learn(self, text: str) -> None:
+    """Collects pool names from the names in text, so that bare pool names are recognized"""
+    for token in _TOKEN.findall(text):
+      if any(c in token for c in '/@#'):
+        self._pools.add(re.split(r'[/@#]', token, maxsplit=1)[0])
+
+  def anonymize_host(self, host: str) -> str:
+    return self._component(host)
+
+  def anonymize(self, text: str) -> str:
+    return _TOKEN.sub(lambda m: self._token(m.group(0)), text)
+
+  def _token(self, token: str) -> str:
+    if any(c in token for c in '/@#'):
+      return ''.join(part if _SEPARATORS.fullmatch(part) else self._component(part) for part in _SEPARATORS.split(token))
+    if token in self._pools:
+      return self._component(token)
+    return token
+
+  def _component(self, component: str) -> str:
+    if not component:
+      return component
+    match = _HOLDTAG_PREFIX.fullmatch(component)
+    if match is not None:
+      return match.group(1) + self._component(match.group(2))
+    return 'h' + hashlib.sha256(self._salt + component.encode()).hexdigest()[:12]
+
+
+class Recorder:
+  """
+  Writes the argv, stdout and exit code of each CLI call to a file in JSON lines format.
+  Used as context manager, the command line of the recorded run is written on exit,
+  when all pool names are known to the anonymizer.
+  """
+  file: IO[str]
+  anonymizer: Optional[Anonymizer]
+  argv: list[str]
+  _lock: threading.Lock
+
+  def __init__(self, file: IO[str], anonymize: bool = False, argv: list[str] = []) -> None:
+    self.file = file
+    self.anonymizer = Anonymizer() if anonymize else None
+    self.argv = argv
+    self._lock = threading.Lock()
+
+  def __enter__(self) -> Recorder:
+    return self
+
+  def __exit__(self, exc_type, exc, tb) -> None:
+    with self._lock:
+      self._write({'run': {'argv': self._anonymize_argv(self.argv)}})
+
+  def record(self, host: Optional[str], argv: list[str], stdout: str, returncode: int) -> None:
+    with self._lock:
+      if self.anonymizer is not None:
+        self.anonymizer.learn(stdout)
+      self._write({
+        'host': self.anonymizer.anonymize_host(host) if self.anonymizer is not None and host is not None else host,
+        'argv': self._anonymize_argv(argv),
+        'stdout': _BATCH_TOKEN.sub(_BATCH_PLACEHOLDER, self._anonymize(stdout)),
+        'returncode': returncode
+      })
+
+  def _anonymize_argv(self, argv: list[str]) -> list[str]:
+    if self.anonymizer is not None:
+      for arg in argv:
+        self.anonymizer.learn(arg)
+    return [_BATCH_TOKEN.sub(_BATCH_PLACEHOLDER, self._anonymize(a)) for a in argv]
+
+  def _anonymize(self, text: str) -> str:
+    return self.anonymizer.anonymize(text) if self.anonymizer is not None else text
+
+  def _write(self, entry: dict) -> None:
+    self.file.write(json.dumps(entry) + '\n')
+    self.file.flush()
+
+
+class Replay:
+  """Serves recorded responses. Responses to the same call on the same host are served in recorded order."""
+  argv: list[str]  # command line of the recorded run
+  _responses: dict[tuple[Optional[str], tuple[str, ...]], deque[tuple[str, int]]]
+  _lock: threading.Lock
+
+  def __init__(self, lines: Iterable[str]) -> None:
+    self.argv = []
+    self._responses = {}
+    self._lock = threading.Lock()
+    for line in lines:
+      entry = json.loads(line)
+      if 'run' in entry:
+        self.argv = entry['run']['argv']
+        continue
+      key = (entry['host'], tuple(entry['argv']))
+      self._responses.setdefault(key, deque()).append((entry['stdout'], entry['returncode']))
+
+  @classmethod
+  def load(cls, path: str) -> Replay:
+    with open(path) as f:
+      return cls(f)
+
+  def respond(self, host: Optional[str], argv: list[str]) -> tuple[str, int]:
+    """Returns stdout and exit code of the next recorded call"""
+    match = _BATCH_TOKEN.search(' '.join(argv))
+    key = (host, tuple(_BATCH_TOKEN.sub(_BATCH_PLACEHOLDER, a) for a in argv))
+    with self._lock:
+      responses = self._responses.get(key)
+      if not responses:
+        raise RuntimeError(f'No recorded response left for "{" ".join(argv)}" on {host or "local host"}')
+      stdout, returncode = responses.popleft()
+    if match is not None:
+      stdout = stdout.replace(_BATCH_PLACEHOLDER, match.group(0))
+    return stdout, returncode
+
+
+class Session:
+  """Global record or replay mode of all ZfsCli instances"""
+  recorder: Optional[Recorder] = None
+  replay: Optional[Replay] = None
+
+
+session = Session()
@@ -1,7 +1,20 @@
 import logging
 from logging import Formatter
-from typing import Optional
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Callable
+from collections.abc import Iterable
+from datetime import datetime
+import json
+import queue
 import sys
+import threading
+import time
+
+
+# extra= of records that carry many lines of output, see log_lines
+BULK = {'bulk': True}
+# extra= of per-item records that may be rate-limited, like the progress of each snapshot
+DETAIL = {'detail': True}
 
 
 def setup_logging(root_loglevel: int = logging.INFO, include_packages: Optional[set[str]] = None, others_loglevel: int = logging.WARNING):
@@ -56,6 +69,61 @@ def _setup_root_logger(loglevel: int):
     sys.excepthook = handle_exception
 
 
+def configure_output(log_format: str = 'text', queued: bool = False, detail_rate: Optional[float] = None) -> Callable[[], None]:
+    """
+    Reconfigures the handlers of the root logger once the command line is known:
+    - log_format 'json' writes one JSON object per line
+    - queued hands records to a background thread that formats and writes them, so a slow terminal or pipe
+      does not hold up the program
+    - detail_rate limits records marked with DETAIL to that many per second
+    Returns a function that writes all queued records and restores the synchronous handlers.
+    """
+    logger = logging.getLogger()
+    handlers = list(logger.handlers)
+    if log_format == 'json':
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+
+    listener: Optional[QueueListener] = None
+    front: list[logging.Handler] = handlers
+    if queued:
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(records, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        front = [QueueHandler(records)]
+        logger.addHandler(front[0])
+        listener.start()
+
+    # filter before queueing, so that suppressed records cost nothing further
+    detail_filter = DetailFilter(detail_rate) if detail_rate is not None else None
+    if detail_filter is not None:
+        for handler in front:
+            handler.addFilter(detail_filter)
+
+    def restore() -> None:
+        if detail_filter is not None:
+            for handler in front:
+                handler.removeFilter(detail_filter)
+            detail_filter.report()
+        if listener is not None:
+            logger.removeHandler(front[0])
+            listener.stop()
+            for handler in handlers:
+                logger.addHandler(handler)
+
+    return restore
+
+
+def log_lines(logger: logging.Logger, lines: Iterable[str], level: int = logging.INFO) -> None:
+    """Logs lines of output, like a table, as a single record instead of one record per line"""
+    if not logger.isEnabledFor(level):
+        return
+    text = '\n'.join(lines)
+    if text:
+        logger.log(level, text, extra=BULK)
+
+
 class LeveledFormatter(Formatter):
     _formats: dict[int, Formatter] = {}
 
@@ -63,5 +131,74 @@ class LeveledFormatter(Formatter):
         self._formats[level] = formatter
 
     def format(self, record):
+        if record.levelno == logging.INFO and getattr(record, 'bulk', False) and not record.args:
+            # plain output, no need to look up a formatter or interpolate
+            return record.msg
         formatter = self._formats.get(record.levelno) or super()
         return formatter.format(record)
+
+
+# attributes of every LogRecord, the others were passed with extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'bulk', 'detail', 'prefixed'}
+
+
+class JsonFormatter(Formatter):
+    """One JSON object per line, with the fields passed with extra=. Bulk records become one object per line of output."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname.strip(),
+            'logger': record.name,
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS})
+        message = record.getMessage()
+        if getattr(record, 'bulk', False):
+            return '\n'.join(json.dumps({**entry, 'message': line}, default=str) for line in message.split('\n'))
+        entry['message'] = message
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DetailFilter(logging.Filter):
+    """
+    Lets through at most rate records per second that are marked with DETAIL, with bursts of up to rate records.
+    The next record that passes tells how many were suppressed.
+    """
+    rate: float
+    _allowance: float
+    _last: float
+    _suppressed: int
+    _total: int
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._allowance = max(rate, 1)
+        self._last = time.monotonic()
+        self._suppressed = 0
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'detail', False):
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self._allowance + (now - self._last) * self.rate, max(self.rate, 1))
+            self._last = now
+            if self._allowance < 1:
+                self._suppressed += 1
+                self._total += 1
+                return False
+            self._allowance -= 1
+            suppressed, self._suppressed = self._suppressed, 0
+        if suppressed and not getattr(record, 'suppressed', None):
+            record.suppressed = suppressed  # a record passes every handler
+            record.msg = f'{record.msg} ({suppressed} similar messages suppressed)'
+        return True
+
+    def report(self) -> None:
+        if self._total:
+            logging.getLogger(__name__).info(f'{self._total} detail messages were suppressed in total')
@@ -0,0 +1,13 @@
+from argparse import ArgumentParser
+
+from ..utils import parse_duration
+
+
+def setup(parser: ArgumentParser) -> None:
+  parser.add_argument('remote', metavar='USER@HOST:DATASET', help='the destination, or with --pull the source, of the local dataset')
+  parser.add_argument('--pull', action='store_true', help='the remote dataset is replicated to the local one')
+  parser.add_argument('-p', '--port', type=int)
+  parser.add_argument('--ssh-option', type=str, action='append', default=[], metavar='OPTION', help='ssh_config option like Compression=no')
+  parser.add_argument('--max-lag', type=parse_duration, metavar='DURATION',
+                      help='fail if a destination is missing or not in sync, or lags more than DURATION behind its source')
+  parser.add_argument('--format', type=str, choices={'table', 'json'}, default='table')
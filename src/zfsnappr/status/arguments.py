@@ -0,0 +1,16 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+from dateutil.relativedelta import relativedelta
+
+from ..arguments import Args as GeneralArgs
+
+
+@dataclass
+class Args(GeneralArgs):
+  remote: str
+  pull: bool
+  port: Optional[int]
+  ssh_option: list[str]
+  max_lag: Optional[relativedelta]
+  format: str
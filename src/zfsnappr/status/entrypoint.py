@@ -0,0 +1,63 @@
+from __future__ import annotations
+from argparse import Namespace
+from typing import Optional, cast
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timedelta
+import json
+import sys
+import logging
+
+from ..zfs import LocalZfsCli, RemoteZfsCli
+from ..replication_common import parse_remote
+from ..table import print_table, format_time
+from .arguments import Args
+from .lag import fetch_side, compare
+
+
+log = logging.getLogger(__name__)
+
+
+def entrypoint(raw_args: Namespace) -> None:
+  args = cast(Args, raw_args)
+
+  if not args.dataset:
+    raise ValueError(f"No dataset provided")
+  user, host, remote_dataset = parse_remote(args.remote)
+  local = (LocalZfsCli(), args.dataset)
+  remote = (RemoteZfsCli(host=host, user=user, port=args.port, ssh_options=args.ssh_option), remote_dataset)
+  (source_cli, source_dataset), (dest_cli, dest_dataset) = (remote, local) if args.pull else (local, remote)
+
+  # both sides are listed at the same time
+  with ThreadPoolExecutor(max_workers=2) as executor:
+    source_future = executor.submit(fetch_side, source_cli, source_dataset, args.recursive, bookmarks=True)
+    dest_future = executor.submit(fetch_side, dest_cli, dest_dataset, args.recursive, must_exist=False)
+    source, dest = source_future.result(), dest_future.result()
+  statuses = compare(source, source_dataset, dest, dest_dataset)
+
+  if args.format == 'table':
+    print_table(
+      ['SOURCE', 'DEST', 'STATE', 'BEHIND', 'LAG', 'BASE', 'BASE TIMESTAMP', 'STALE HOLDS'],
+      [
+        [s.source, s.dest, s.state, str(s.behind), format_lag(s.lag), s.base or '', format_time(s.base_creation), str(len(s.stale_holds))]
+        for s in statuses
+      ]
+    )
+    for s in statuses:
+      for hold in s.stale_holds:
+        log.warning(f'Stale replication hold "{hold}"')
+  elif args.format == 'json':
+    sys.stdout.writelines(json.dumps(asdict(s)) + '\n' for s in statuses)
+  else:
+    assert False
+
+  if args.max_lag is not None:
+    now = datetime.now()
+    max_lag = (now - (now - args.max_lag)).total_seconds()
+    failing = [s for s in statuses if not s.ok or s.lag is not None and s.lag > max_lag]
+    if failing:
+      raise RuntimeError(f'{len(failing)} of {len(statuses)} datasets are not replicated within {timedelta(seconds=max_lag)}')
+
+
+def format_lag(seconds: Optional[int]) -> str:
+  return str(timedelta(seconds=seconds)) if seconds is not None else ''
@@ -0,0 +1,150 @@
+from __future__ import annotations
+from typing import Optional, Union
+from dataclasses import dataclass, field
+from subprocess import CalledProcessError
+
+from ..zfs import ZfsCli, ZfsCommands, ZfsProperty, Dataset, Snapshot, Bookmark
+from ..replication_common.replicate_snaps import holdtag_src, holdtag_dest
+from ..replication_common.send_receive_snap import bookmark_holdtag
+
+
+# snapshots per zfs holds call
+HOLDS_BATCH_SIZE = 1000
+
+# the holds count tells which snapshots to ask zfs holds about, createtxg orders them exactly, the tags are not needed
+FIELDS = [ZfsProperty.USERREFS, ZfsProperty.CREATETXG]
+
+
+@dataclass
+class Side:
+  """Datasets and snapshots of one side of a replication, fetched with a single recursive listing"""
+  exists: bool
+  datasets: dict[str, Dataset] = field(default_factory=dict)
+  snaps: dict[str, list[Snapshot]] = field(default_factory=dict)  # per dataset, oldest first
+  holds: dict[str, set[str]] = field(default_factory=dict)  # hold tags per longname, only held snapshots
+  bookmarks: dict[str, list[Bookmark]] = field(default_factory=dict)  # per dataset, only if fetched
+
+
+@dataclass
+class DatasetStatus:
+  source: str
+  dest: str
+  state: str  # current, behind, diverged, no common snapshot, no snapshots or missing
+  behind: int  # source snapshots newer than the common base
+  lag: Optional[int]  # seconds between the newest source snapshot and the common base
+  base: Optional[str]  # shortname of the newest snapshot on both sides
+  base_creation: Optional[int]
+  stale_holds: list[str]  # replication holds on other snapshots than the common base, as LONGNAME:TAG
+
+  @property
+  def ok(self) -> bool:
+    return self.state in ('current', 'behind', 'no snapshots')
+
+
+def fetch_side(cli: ZfsCli, dataset: str, recursive: bool, must_exist: bool = True, bookmarks: bool = False) -> Side:
+  """
+  Lists only name, guid, creation, createtxg and userrefs of the snapshots, and the bookmarks if requested,
+  in one round trip, and the holds of the held snapshots in another one if there are any.
+  """
+  try:
+    with cli.batch() as batch:
+      datasets = batch.add(ZfsCommands.get_all_datasets(dataset=dataset, recursive=recursive))
+      snapshots = batch.add(ZfsCommands.get_all_snapshots(dataset, recursive, sort_by=ZfsProperty.CREATETXG, fields=FIELDS))
+      bookmark_list = batch.add(ZfsCommands.get_all_bookmarks(dataset, recursive)) if bookmarks else None
+  except CalledProcessError as e:
+    # zfs fails with 1 if the dataset does not exist, ssh with 255 if the host is unreachable
+    if must_exist or e.returncode != 1:
+      raise
+    return Side(exists=False)
+
+  side = Side(exists=True, datasets={d.name: d for d in datasets.result()})
+  side.snaps = {name: [] for name in side.datasets}
+  held: list[str] = []
+  for snap in snapshots.result():
+    side.snaps.setdefault(snap.dataset, []).append(snap)
+    if snap.holds:
+      held.append(snap.longname)
+  if bookmark_list is not None:
+    for b in bookmark_list.result():
+      side.bookmarks.setdefault(b.dataset, []).append(b)
+
+  if held:
+    with cli.batch() as batch:
+      results = [batch.add(ZfsCommands.get_holds(held[i:i+HOLDS_BATCH_SIZE])) for i in range(0, len(held), HOLDS_BATCH_SIZE)]
+    for r in results:
+      for hold in r.result():
+        side.holds.setdefault(hold.snap_longname, set()).add(hold.tag)
+  return side
+
+
+def compare(source: Side, source_root: str, dest: Side, dest_root: str) -> list[DatasetStatus]:
+  """Merges the timelines of each source dataset and its dest dataset by guid"""
+  statuses: list[DatasetStatus] = []
+  for source_name, source_dataset in source.datasets.items():
+    dest_name = dest_root + source_name.removeprefix(source_root)
+    statuses.append(compare_dataset(
+      source_dataset, source.snaps.get(source_name, []), source.holds,
+      dest.datasets.get(dest_name), dest_name, dest.snaps.get(dest_name, []), dest.holds,
+      source.bookmarks.get(source_name, [])
+    ))
+  return statuses
+
+
+def compare_dataset(
+  source_dataset: Dataset, source_snaps: list[Snapshot], source_holds: dict[str, set[str]],
+  dest_dataset: Optional[Dataset], dest_name: str, dest_snaps: list[Snapshot], dest_holds: dict[str, set[str]],
+  source_bookmarks: list[Bookmark] = []
+) -> DatasetStatus:
+  """
+  Like plan_replication, the base is the newest dest snapshot whose GUID exists on source, either as snapshot
+  or as bookmark of this replication, so that replicating with --bookmark may prune the source snapshot.
+  """
+  status = DatasetStatus(source_dataset.name, dest_name, 'current', 0, None, None, None, [])
+  if dest_dataset is None:
+    status.state = 'missing'
+    status.behind = len(source_snaps)
+    return status
+  if not source_snaps:
+    status.state = 'no snapshots'
+    return status
+
+  # the base as found on source
+  source_index: dict[int, Union[Snapshot, Bookmark]] = {
+    b.guid: b for b in source_bookmarks if bookmark_holdtag(b) == holdtag_src(dest_dataset)
+  }
+  source_index.update((s.guid, s) for s in source_snaps)
+  base_index: Optional[int] = None  # in dest_snaps
+  for i in range(len(dest_snaps) - 1, -1, -1):
+    if dest_snaps[i].guid in source_index:
+      base_index = i
+      break
+
+  base = dest_snaps[base_index] if base_index is not None else None
+  if base is None:
+    status.state = 'no common snapshot'
+    status.behind = len(source_snaps)
+  else:
+    source_base = source_index[base.guid]
+    status.base = base.shortname
+    status.base_creation = _seconds(base)
+    status.behind = sum(1 for s in source_snaps if s.createtxg > source_base.createtxg)
+    status.lag = _seconds(source_snaps[-1]) - _seconds(base)
+    if base_index != len(dest_snaps) - 1:
+      status.state = 'diverged'  # dest has newer snapshots that are not on source
+    elif status.behind:
+      status.state = 'behind'
+
+  # the holds that this replication keeps on its base, see replicate_snaps
+  for snaps, holds, tag in (
+    (source_snaps, source_holds, holdtag_src(dest_dataset)),
+    (dest_snaps, dest_holds, holdtag_dest(source_dataset))
+  ):
+    status.stale_holds += [
+      f'{s.longname}:{tag}' for s in snaps
+      if tag in holds.get(s.longname, ()) and (base is None or s.guid != base.guid)
+    ]
+  return status
+
+
+def _seconds(snap: Snapshot) -> int:
+  return int(snap.timestamp.timestamp())
@@ -0,0 +1,29 @@
+from __future__ import annotations
+from typing import Optional
+from datetime import datetime
+import logging
+
+from .setup_logging import log_lines
+
+
+log = logging.getLogger(__name__)
+
+COLUMN_SEPARATOR = ' | '
+HEADER_SEPARATOR = '-'
+
+
+def print_table(header: list[str], rows: list[list[str]]) -> None:
+  """Prints rows aligned under header, as a single log message"""
+  widths: list[int] = [max(len(h), *(len(r[i]) for r in rows), 0) for i, h in enumerate(header)]
+  total_width = (len(COLUMN_SEPARATOR) * ((len(header) or 1) - 1)) + sum(widths)
+
+  log_lines(log, [
+    COLUMN_SEPARATOR.join(h.ljust(w) for h, w in zip(header, widths)),
+    (HEADER_SEPARATOR * (total_width//len(HEADER_SEPARATOR) + 1))[:total_width],
+    *(COLUMN_SEPARATOR.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows)
+  ])
+
+
+def format_time(timestamp: Optional[int]) -> str:
+  """timestamp in seconds since the epoch, as local time"""
+  return str(datetime.fromtimestamp(timestamp)) if timestamp is not None else ''
@@ -5,6 +5,7 @@ import logging
 
 from ..zfs import LocalZfsCli, ZfsProperty, ZfsCli, Snapshot
 from .. import filter
+from ..locking import lock_datasets, subtree_keys
 from .arguments import Args
 
 
@@ -12,6 +13,11 @@ log = logging.getLogger(__name__)
 
 TAG_SEPARATOR = "_"
 
+Operation = tuple[
+  Callable[[Snapshot], Optional[set[str]]],
+  Literal['ADD', 'SET', 'REMOVE']
+]
+
 
 def entrypoint(raw_args: Namespace) -> None:
   args = cast(Args, raw_args)
@@ -19,12 +25,7 @@ def entrypoint(raw_args: Namespace) -> None:
   cli = LocalZfsCli()
 
   # --- determine operations ---
-  operations: list[
-    tuple[
-      Callable[[Snapshot], Optional[set[str]]],
-      Literal['ADD', 'SET', 'REMOVE']
-    ]
-  ] = []
+  operations: list[Operation] = []
 
   # TODO: remove
   ...
@@ -48,6 +49,11 @@ def entrypoint(raw_args: Namespace) -> None:
     return
   
 
+  with lock_datasets(args, lambda: subtree_keys(cli, args.dataset, args.recursive)):
+    apply_operations(cli, args, operations)
+
+
+def apply_operations(cli: ZfsCli, args: Args, operations: list[Operation]) -> None:
   # --- get snapshots ---
   props = [p for p in [args.add_from_prop, args.set_from_prop] if p is not None]
   snapshots = cli.get_all_snapshots(args.dataset, recursive=args.recursive, properties=props)
@@ -0,0 +1,178 @@
+from __future__ import annotations
+from typing import Optional
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from subprocess import Popen
+import shlex
+import threading
+import time
+
+
+@dataclass
+class CallRecord:
+  argv: list[str]  # without SSH prefix
+  host: Optional[str]  # None for local calls
+  phase: str
+  start: float
+  duration: Optional[float] = None  # None while running
+  output_bytes: Optional[int] = None  # None if stdout was not captured
+  returncode: Optional[int] = None
+
+  @property
+  def command(self) -> str:
+    return command_name(self.argv)
+
+  @property
+  def summary(self) -> str:
+    s = shlex.join(self.argv)
+    return s if len(s) <= 100 else s[:97] + '...'
+
+
+def command_name(argv: list[str]) -> str:
+  """What calls are aggregated by, like zfs list"""
+  return ' '.join(argv[:2])
+
+
+@dataclass
+class PhaseRecord:
+  seconds: float = 0
+  entered: int = 0
+  calls: int = 0
+
+
+class Tracer:
+  """
+  Records every CLI call and the phases of a run. Disabled unless enabled is set, in which case recording costs nothing.
+  Each thread has its own phases, nested in the phase of the main thread. Calls from worker threads
+  that have not entered a phase are attributed to the current phase of the main thread.
+  """
+  enabled: bool
+  records: list[CallRecord]
+  phases: dict[str, PhaseRecord]
+  parse_seconds: dict[tuple[Optional[str], str], float]  # per host and command
+  _stacks: dict[int, list[str]]  # per thread
+  _main: int
+  _lock: threading.Lock
+
+  def __init__(self) -> None:
+    self.enabled = False
+    self.records = []
+    self.phases = {}
+    self.parse_seconds = {}
+    self._stacks = {}
+    self._main = threading.main_thread().ident or 0
+    self._lock = threading.Lock()
+
+  @property
+  def current_phase(self) -> str:
+    stack = self._stacks.get(threading.get_ident())
+    if stack is None:
+      stack = self._stacks.get(self._main, [])
+    return '/'.join(stack)
+
+  @contextmanager
+  def phase(self, name: str) -> Iterator[None]:
+    if not self.enabled:
+      yield
+      return
+    ident = threading.get_ident()
+    with self._lock:
+      own = ident in self._stacks
+      stack = self._stacks.setdefault(ident, list(self._stacks.get(self._main, [])))
+    stack.append(name)
+    key = '/'.join(stack)
+    start = time.monotonic()
+    try:
+      yield
+    finally:
+      with self._lock:
+        p = self.phases.setdefault(key, PhaseRecord())
+        p.seconds += time.monotonic() - start
+        p.entered += 1
+        stack.pop()
+        # thread idents are reused, so a worker thread must not leave its stack behind
+        if not own and ident != self._main:
+          del self._stacks[ident]
+
+  def start(self, argv: list[str], host: Optional[str]) -> Optional[CallRecord]:
+    """Returns None if disabled"""
+    if not self.enabled:
+      return None
+    record = CallRecord(argv=argv, host=host, phase=self.current_phase, start=time.monotonic())
+    with self._lock:
+      self.records.append(record)
+      self.phases.setdefault(record.phase, PhaseRecord()).calls += 1
+    return record
+
+  def finish(self, record: Optional[CallRecord], returncode: int, output_bytes: Optional[int] = None) -> None:
+    if record is None or record.duration is not None:
+      return
+    record.duration = time.monotonic() - record.start
+    record.returncode = returncode
+    if output_bytes is not None:
+      record.output_bytes = output_bytes
+
+  def record_parse(self, argv: list[str], host: Optional[str], seconds: float) -> None:
+    key = (host, command_name(argv))
+    with self._lock:
+      self.parse_seconds[key] = self.parse_seconds.get(key, 0) + seconds
+
+  def summarize(self, top: int = 10) -> list[str]:
+    from .utils import format_size  # utils depends on zfs, which depends on this module
+    finished = [r for r in self.records if r.duration is not None]
+    total = sum(r.duration or 0 for r in finished)
+    lines = [f'Traced {len(self.records)} calls, {total:.2f}s in total']
+
+    by_command: dict[tuple[Optional[str], str], list[CallRecord]] = {}
+    for r in finished:
+      by_command.setdefault((r.host, r.command), []).append(r)
+    ranked = sorted(by_command.items(), key=lambda item: sum(r.duration or 0 for r in item[1]), reverse=True)
+    lines.append(f'Top commands by total time:')
+    for (host, command), records in ranked[:top]:
+      seconds = sum(r.duration or 0 for r in records)
+      parse = self.parse_seconds.get((host, command), 0)
+      output = sum(r.output_bytes or 0 for r in records)
+      failed = sum(1 for r in records if r.returncode)
+      lines.append(
+        f'  {command:<16} {host or "local":<12} {len(records):>5} calls {seconds:>8.2f}s'
+        f'  parse {parse:.2f}s  output {format_size(output)}' + (f'  {failed} failed' if failed else '')
+      )
+    if ranked:
+      slowest = max(finished, key=lambda r: r.duration or 0)
+      lines.append(f'Slowest call: {slowest.summary} ({slowest.duration:.2f}s)')
+
+    lines.append(f'Phases:')
+    for name, p in sorted(self.phases.items()):
+      lines.append(f'  {name or "(none)":<28} {p.seconds:>8.2f}s {p.calls:>5} calls')
+    return lines
+
+
+class TracedPopen(Popen):
+  """Popen that finishes its call record as soon as the process is known to have terminated"""
+  record: CallRecord
+
+  def __init__(self, record: CallRecord, *args, **kwargs) -> None:
+    self.record = record
+    super().__init__(*args, **kwargs)
+
+  def poll(self):
+    code = super().poll()
+    if code is not None:
+      tracer.finish(self.record, code)
+    return code
+
+  def wait(self, timeout=None):
+    code = super().wait(timeout)
+    tracer.finish(self.record, code)
+    return code
+
+  def communicate(self, input=None, timeout=None):
+    stdout, stderr = super().communicate(input, timeout)
+    if stdout is not None:
+      self.record.output_bytes = len(stdout)
+    return stdout, stderr
+
+
+# global tracer of the run
+tracer = Tracer()
@@ -0,0 +1,101 @@
+from __future__ import annotations
+from typing import Optional, Literal
+from dataclasses import dataclass
+import re
+import shlex
+
+
+@dataclass(frozen=True)
+class Compression:
+  algorithm: Literal['zstd', 'lz4']
+  level: Optional[int] = None
+
+  def compress_command(self) -> list[str]:
+    cmd = [self.algorithm, '-c']
+    if self.level is not None:
+      cmd += [f'-{self.level}']
+    return cmd
+
+  def decompress_command(self) -> list[str]:
+    return [self.algorithm, '-dc']
+
+
+def parse_compression(input: str) -> Compression:
+  """input has format like zstd, zstd:3 or lz4:1"""
+  match = re.fullmatch(r'(zstd|lz4)(?::(\d+))?', input)
+  if match is None:
+    raise ValueError(f'Invalid compression "{input}", expected zstd[:LEVEL] or lz4[:LEVEL]')
+  algorithm: Literal['zstd', 'lz4'] = 'zstd' if match.group(1) == 'zstd' else 'lz4'
+  return Compression(algorithm, int(match.group(2)) if match.group(2) is not None else None)
+
+
+@dataclass(frozen=True)
+class Transport:
+  """
+  How a replication stream gets from zfs send to zfs receive.
+  By default, the stream is piped through the CLI processes, i.e. through SSH for remote hosts.
+  With a TCP port, the stream bypasses SSH: the remote side listens with socat and the local side connects to it.
+  """
+  compression: Optional[Compression] = None
+  tcp_port: Optional[int] = None
+
+  def send_filters(self, listen: bool, address: str) -> list[list[str]]:
+    """Commands that the stream is piped through on the sending host, after zfs send"""
+    filters: list[list[str]] = []
+    if self.compression is not None:
+      filters.append(self.compression.compress_command())
+    if self.tcp_port is not None:
+      if listen:
+        filters.append(['socat', '-u', 'STDIN', f'TCP-LISTEN:{self.tcp_port},reuseaddr'])
+      else:
+        filters.append(['socat', '-u', 'STDIN', f'TCP:{address}:{self.tcp_port},retry=10,interval=1'])
+    return filters
+
+  def receive_filters(self, listen: bool, address: str) -> list[list[str]]:
+    """Commands that the stream is piped through on the receiving host, before zfs receive"""
+    filters: list[list[str]] = []
+    if self.tcp_port is not None:
+      if listen:
+        filters.append(['socat', '-u', f'TCP-LISTEN:{self.tcp_port},reuseaddr', 'STDOUT'])
+      else:
+        filters.append(['socat', '-u', f'TCP:{address}:{self.tcp_port},retry=10,interval=1', 'STDOUT'])
+    if self.compression is not None:
+      filters.append(self.compression.decompress_command())
+    return filters
+
+
+  def filters(self, source_host: Optional[str], dest_host: Optional[str]) -> tuple[list[list[str]], list[list[str]]]:
+    """Send and receive filters for the given hosts, where None is the local host"""
+    if self.tcp_port is None:
+      return self.send_filters(False, ''), self.receive_filters(False, '')
+    if source_host is not None and dest_host is not None:
+      raise ValueError(f'TCP transport requires either source or destination to be local')
+    # the remote side listens, the local side connects to it
+    source_listens = source_host is not None
+    address = source_host or dest_host or 'localhost'
+    return self.send_filters(source_listens, address), self.receive_filters(not source_listens, address)
+
+
+# exit status of a command killed by SIGPIPE, because a later command of the pipeline exited before reading everything
+SIGPIPE_STATUS = 128 + 13
+
+
+def pipeline_script(commands: list[list[str]]) -> str:
+  """
+  Shell script that pipes the commands into each other and exits with the status of the first command that failed.
+  Since POSIX sh has no pipefail, each command but the last writes its status to a temporary directory.
+  A command killed by SIGPIPE only failed because a later one did, so the later one is reported instead.
+  """
+  *heads, last = [shlex.join(c) for c in commands]
+  stages = [f'{{ {h}; echo $? > "$s/{i}"; }}' for i, h in enumerate(heads)]
+  return '\n'.join([
+    's=$(mktemp -d) || exit 1',
+    ' | '.join([*stages, last]),
+    'rc=$?',
+    f'for i in {" ".join(map(str, range(len(heads))))}; do',
+    f'  r=$(cat "$s/$i" 2>/dev/null); r=${{r:-0}}',
+    f'  if [ "$r" -ne 0 ] && [ "$r" -ne {SIGPIPE_STATUS} ]; then rc=$r; break; fi',
+    'done',
+    'rm -rf "$s"',
+    'exit $rc'
+  ])
@@ -1,12 +1,81 @@
 from typing import TypeVar, Callable, Optional, Literal
-from collections.abc import Collection, Hashable
+from collections.abc import Collection, Hashable, Iterable, Iterator
+from itertools import islice
+from dateutil.relativedelta import relativedelta
 
 from .zfs import Snapshot
 
 
 T = TypeVar('T', bound=Hashable)
-def group_snaps_by(snapshots: Collection[Snapshot], get_group: Callable[[Snapshot], T]) -> dict[T, list[Snapshot]]:
-  groups: dict[T, list[Snapshot]] = {get_group(s): [] for s in snapshots}
+S = TypeVar('S')  # usually Snapshot
+def group_snaps_by(snapshots: Collection[S], get_group: Callable[[S], T]) -> dict[T, list[S]]:
+  groups: dict[T, list[S]] = {get_group(s): [] for s in snapshots}
   for snap in snapshots:
     groups[get_group(snap)].append(snap)
   return groups
+
+
+def batched(items: Iterable[S], n: int) -> Iterator[list[S]]:
+  """Splits items into lists of length n. The last list may be shorter."""
+  it = iter(items)
+  while batch := list(islice(it, n)):
+    yield batch
+
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4, 'P': 1024**5}
+
+def parse_size(input: str) -> int:
+  """Parses a size like 500M or 1.5T into bytes. Units are binary like in the zfs command."""
+  value = input.strip().upper().removesuffix('B').removesuffix('I')
+  unit = value[-1:] if value[-1:] in SIZE_UNITS else ''
+  try:
+    number = float(value[:len(value)-len(unit)])
+  except ValueError:
+    raise ValueError(f'Invalid size "{input}"')
+  if number < 0:
+    raise ValueError(f'Invalid size "{input}"')
+  return int(number * SIZE_UNITS[unit])
+
+def format_size(size: int) -> str:
+  value = float(size)
+  for unit in SIZE_UNITS:
+    if abs(value) < 1024 or unit == 'P':
+      break
+    value /= 1024
+  return f'{value:.1f}{unit}' if unit else f'{size}B'
+
+
+class ParseError(Exception):
+  def __init__(self, input: str, msg: str) -> None:
+    super().__init__(f'Failed to parse duration "{input}": {msg}')
+
+
+ # input has format like 2y5m7d3h
+def parse_duration(input: str) -> relativedelta:
+  res: dict[str, int] = dict()
+  start = 0
+
+  for i, c in enumerate(input):
+    if c not in {'h', 'd', 'w', 'm', 'y'}:
+      continue
+    num = input[start:i]
+    start = i+1
+    if not num:
+      raise ParseError(input, f'Unit "{c}" is without number')
+    if c in res:
+      raise ParseError(input, f'Duplicate unit "{c}"')
+    try:
+      res[c] = int(num)
+    except ValueError:
+      raise ParseError(input, f'Invalid number "{num}"')
+
+  if not start == len(input):
+    raise ParseError(input, f'Number "{input[start:]}" is without unit')
+
+  return relativedelta(
+    years=res.get('y', 0),
+    months=res.get('m', 0),
+    weeks=res.get('w', 0),
+    days=res.get('d', 0),
+    hours=res.get('h', 0)
+  )
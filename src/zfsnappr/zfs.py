@@ -1,34 +1,71 @@
 from __future__ import annotations
 from datetime import datetime
 from subprocess import Popen, PIPE, CalledProcessError
-from typing import Optional, IO, Literal
-from collections.abc import Collection
+from typing import Optional, IO, Literal, Generic, TypeVar, Callable
+from collections.abc import Collection, Iterator
 from dataclasses import dataclass
+import logging
+import secrets
+import time
+import shlex
+import re
+
+from .trace import tracer, TracedPopen
+from .session import session, Replay
+from .transport import pipeline_script
+from .catalog import catalog
+from .listing_cache import listing_cache, CacheEntry
+from .metrics import metrics
+
+
+log = logging.getLogger(__name__)
 
 
 class ZfsProperty:
   NAME = 'name'
   CREATION = 'creation'
   GUID = 'guid'
+  CREATETXG = 'createtxg'
   USERREFS = 'userrefs'
   READONLY = 'readonly'
   ATIME = 'atime'
+  USED = 'used'
+  WRITTEN = 'written'
+  AVAILABLE = 'available'
+  USEDBYSNAPSHOTS = 'usedbysnapshots'
+  SNAPSHOTS_CHANGED = 'snapshots_changed'
   CUSTOM_TAGS = 'zfsnappr:tags'  # the user property used to store and read tags
 
 
-# properties that will always be fetched
-REQUIRED_PROPS = [ZfsProperty.NAME, ZfsProperty.CREATION, ZfsProperty.GUID, ZfsProperty.CUSTOM_TAGS, ZfsProperty.USERREFS]
+# properties that are always fetched, a Snapshot cannot be built without them
+KEY_PROPS = [ZfsProperty.NAME, ZfsProperty.CREATION, ZfsProperty.GUID]
+# properties behind all fields of a Snapshot, fetched unless the caller declares that it needs fewer fields
+SNAPSHOT_FIELDS = [*KEY_PROPS, ZfsProperty.CUSTOM_TAGS, ZfsProperty.USERREFS, ZfsProperty.CREATETXG]
+# properties that are always fetched for a Dataset
+DATASET_PROPS = [ZfsProperty.NAME, ZfsProperty.GUID]
+
+# datasets per zfs list call when re-listing the datasets that changed since they were cached
+LIST_BATCH_SIZE = 100
+
+
+class MissingPropertyError(LookupError):
+  """Raised on access to a field of a partial Snapshot whose property was not fetched"""
 
 
 class Snapshot:
+  """
+  May be partial: only the KEY_PROPS are required. Accessing tags, holds or createtxg of a snapshot that was listed
+  without their property raises MissingPropertyError.
+  """
   properties: dict[str, str]
 
   dataset: str
   shortname: str
   guid: int
   timestamp: datetime
-  tags: Optional[set[str]]
-  holds: int
+  _tags: Optional[set[str]]
+  _holds: Optional[int]
+  _createtxg: Optional[int]
 
   def __init__(self, properties: dict[str,str]):
     P = ZfsProperty
@@ -38,16 +75,41 @@ class Snapshot:
     self.dataset, self.shortname = ps[P.NAME].split('@')
     self.guid = int(ps[P.GUID])
     self.timestamp = datetime.fromtimestamp(int(ps[P.CREATION]))
-    self.holds = int(ps[P.USERREFS])
+    self._holds = int(ps[P.USERREFS]) if P.USERREFS in ps else None
+    self._createtxg = int(ps[P.CREATETXG]) if P.CREATETXG in ps else None
 
-    if ps[P.CUSTOM_TAGS] == '-':
-      self.tags = None
+    if ps.get(P.CUSTOM_TAGS, '-') == '-':
+      self._tags = None
     else:
-      self.tags = set(t for t in ps[P.CUSTOM_TAGS].split(',') if t)  # ignore empty tags
+      self._tags = set(t for t in ps[P.CUSTOM_TAGS].split(',') if t)  # ignore empty tags
 
   def __repr__(self) -> str:
     return f"Snapshot({self.properties})"
 
+  def _require(self, property: str) -> None:
+    if property not in self.properties:
+      raise MissingPropertyError(f'Property "{property}" of snapshot "{self.longname}" was not fetched, '
+                                 f'it must be among the fields of the listing')
+
+  @property
+  def tags(self) -> Optional[set[str]]:
+    """None if the tags are unset"""
+    self._require(ZfsProperty.CUSTOM_TAGS)
+    return self._tags
+
+  @property
+  def holds(self) -> int:
+    self._require(ZfsProperty.USERREFS)
+    assert self._holds is not None
+    return self._holds
+
+  @property
+  def createtxg(self) -> int:
+    """Orders the snapshots of a dataset exactly, unlike the creation time with its resolution of one second"""
+    self._require(ZfsProperty.CREATETXG)
+    assert self._createtxg is not None
+    return self._createtxg
+
   @property
   def longname(self):
     return f'{self.dataset}@{self.shortname}'
@@ -63,6 +125,33 @@ class Snapshot:
     return Snapshot(new_props)
 
 
+class Bookmark:
+  properties: dict[str, str]
+
+  dataset: str
+  shortname: str
+  guid: int
+  timestamp: datetime
+  createtxg: int  # of the bookmarked snapshot
+
+  def __init__(self, properties: dict[str,str]):
+    P = ZfsProperty
+    ps = properties
+
+    self.properties = ps
+    self.dataset, self.shortname = ps[P.NAME].split('#')
+    self.guid = int(ps[P.GUID])
+    self.timestamp = datetime.fromtimestamp(int(ps[P.CREATION]))
+    self.createtxg = int(ps[P.CREATETXG])
+
+  def __repr__(self) -> str:
+    return f"Bookmark({self.properties})"
+
+  @property
+  def longname(self):
+    return f'{self.dataset}#{self.shortname}'
+
+
 @dataclass(eq=True, frozen=True)
 class Pool:
   name: str
@@ -91,47 +180,414 @@ class Hold:
   tag: str
 
 
+T = TypeVar('T')
+
+@dataclass
+class ZfsCommand(Generic[T]):
+  """A single CLI call and how to parse its stdout"""
+  args: list[str]
+  parse: Callable[[str], T]
+  # datasets whose snapshot properties the command changes without moving their snapshots_changed
+  touches: tuple[str, ...] = ()
+
+
+def _no_result(_: str) -> None:
+  return None
+
+def _with_required(properties: Collection[str], required: list[str] = DATASET_PROPS) -> list[str]:
+  return list(dict.fromkeys(required + list(properties)))  # eliminate duplicates
+
+def _projection(fields: Collection[str], properties: Collection[str]) -> list[str]:
+  """Properties to fetch for snapshots with given fields, see SNAPSHOT_FIELDS, and additional properties"""
+  return _with_required([*fields, *properties], KEY_PROPS)
+
+def _parse_rows(properties: list[str], stdout: str) -> list[dict[str, str]]:
+  """Parses the output of zfs list -H -o properties"""
+  return [{p: v for p, v in zip(properties, line.split('\t'))} for line in stdout.splitlines()]
+
+def _datasets_of(snapshots_fullnames: Collection[str]) -> tuple[str, ...]:
+  return tuple(dict.fromkeys(n.split('@')[0] for n in snapshots_fullnames))
+
+def _sort_key(value: str) -> tuple[int, int, str]:
+  """Orders property values like zfs list -s, numbers numerically"""
+  return (0, int(value), '') if value.isdigit() else (1, 0, value)
+
+def _parse_values(count: int, properties: list[str], stdout: str) -> list[dict[str, str]]:
+  """Parses the output of zfs get -H -o value properties, for count objects"""
+  lines = stdout.splitlines()
+  return [{p: v for p, v in zip(properties, lines[i*len(properties):(i+1)*len(properties)])} for i in range(count)]
+
+def _parse_holds(stdout: str) -> set[Hold]:
+  holds: set[Hold] = set()
+  for line in stdout.splitlines():
+    snapname, tag, _ = line.split('\t')
+    holds.add(Hold(
+      snap_longname=snapname,
+      tag=tag
+    ))
+  return holds
+
+def _parse_send_size(stdout: str) -> int:
+  for line in stdout.splitlines():
+    key, *values = line.split('\t')
+    if key == 'size':
+      return int(values[-1])
+  raise RuntimeError(f'zfs send did not report stream size')
+
+def _parse_reclaim(stdout: str) -> int:
+  for line in stdout.splitlines():
+    key, *values = line.split('\t')
+    if key == 'reclaim':
+      return int(values[-1])
+  raise RuntimeError(f'zfs destroy did not report reclaimable space')
+
+
+class ZfsCommands:
+  """Builds the CLI call of each operation. Shared by all CLI implementations."""
+
+  @staticmethod
+  def send(snapshot_fullname: str, base_fullname: Optional[str] = None) -> list[str]:
+    """base_fullname may be a snapshot or a bookmark"""
+    cmd = ['zfs', 'send']
+    if base_fullname:
+      cmd += ['-i', base_fullname]
+    cmd += [snapshot_fullname]
+    return cmd
+
+  @staticmethod
+  def estimate_send(snapshot_fullname: str, base_fullname: Optional[str] = None) -> ZfsCommand[int]:
+    """Dry run of send that reports the stream size in bytes"""
+    cmd = ['zfs', 'send', '-nP']
+    if base_fullname:
+      cmd += ['-i', base_fullname]
+    cmd += [snapshot_fullname]
+    return ZfsCommand(cmd, _parse_send_size)
+
+  @staticmethod
+  def receive(dataset: str, properties: dict[str, str] = {}) -> list[str]:
+    cmd = ['zfs', 'receive']
+    for property, value in properties.items():
+      cmd += ['-o', f'{property}={value}']
+    cmd += [dataset]
+    return cmd
+
+  # TrueNAS CORE 13.0 does not support holds -p, so we do not fetch timestamp
+  @staticmethod
+  def get_holds(snapshots_fullnames: Collection[str]) -> ZfsCommand[set[Hold]]:
+    return ZfsCommand(['zfs', 'holds', '-H', *snapshots_fullnames], _parse_holds)
+
+  @staticmethod
+  def hold(snapshots_fullnames: Collection[str], tag: str) -> ZfsCommand[None]:
+    return ZfsCommand(['zfs', 'hold', tag, *snapshots_fullnames], _no_result, _datasets_of(snapshots_fullnames))
+
+  @staticmethod
+  def release(snapshots_fullnames: Collection[str], tag: str) -> ZfsCommand[None]:
+    return ZfsCommand(['zfs', 'release', tag, *snapshots_fullnames], _no_result, _datasets_of(snapshots_fullnames))
+
+  @staticmethod
+  def get_pool_from_dataset(dataset: str) -> ZfsCommand[Pool]:
+    name = dataset.split('/')[0]
+    return ZfsCommand(['zpool', 'get', '-Hp', '-o', 'value', 'guid', name], lambda out: Pool(name=name, guid=int(out)))
+
+  @staticmethod
+  def get_pool_freeing(pool: str) -> ZfsCommand[int]:
+    """Bytes that the pool still has to free asynchronously, e.g. after destroying snapshots"""
+    return ZfsCommand(['zpool', 'get', '-Hp', '-o', 'value', 'freeing', pool], lambda out: int(out))
+
+  @staticmethod
+  def get_datasets(names: Collection[str], properties: Collection[str] = []) -> ZfsCommand[list[Dataset]]:
+    props = _with_required(properties)
+    cmd = ['zfs', 'get', '-Hp', '-o', 'value', ','.join(props), *names]
+    return ZfsCommand(cmd, lambda out: [Dataset(p) for p in _parse_values(len(names), props, out)])
+
+  @staticmethod
+  def get_all_datasets(
+    properties: Collection[str] = [],
+    dataset: Optional[str] = None,
+    recursive: bool = False
+  ) -> ZfsCommand[list[Dataset]]:
+    """All datasets if dataset is None"""
+    props = _with_required(properties)
+    cmd = ['zfs', 'list', '-Hp', '-o', ','.join(props)]
+    if dataset:
+      cmd += [*(['-r'] if recursive else []), dataset]
+    return ZfsCommand(cmd, lambda out: [Dataset(p) for p in _parse_rows(props, out)])
+
+  @staticmethod
+  def create_snapshot(fullname: str, recursive: bool = False, properties: dict[str, str] = {}) -> ZfsCommand[None]:
+    cmd = ['zfs', 'snapshot']
+    if recursive:
+      cmd += ['-r']
+    for property, value in properties.items():
+      cmd += ['-o', f'{property}={value}']
+    cmd += [fullname]
+    return ZfsCommand(cmd, _no_result)
+
+  @staticmethod
+  def rename_snapshot(fullname: str, new_shortname: str) -> ZfsCommand[None]:
+    return ZfsCommand(['zfs', 'rename', fullname, new_shortname], _no_result, _datasets_of([fullname]))
+
+  @staticmethod
+  def get_snapshots(
+    fullnames: Collection[str], properties: Collection[str] = [], fields: Collection[str] = SNAPSHOT_FIELDS
+  ) -> ZfsCommand[list[Snapshot]]:
+    props = _projection(fields, properties)
+    cmd = ['zfs', 'get', '-Hp', '-o', 'value', ','.join(props), *fullnames]
+    return ZfsCommand(cmd, lambda out: [Snapshot(p) for p in _parse_values(len(fullnames), props, out)])
+
+  @staticmethod
+  def get_all_snapshots(
+    dataset: Optional[str] = None,
+    recursive: bool = False,
+    properties: Collection[str] = [],
+    sort_by: Optional[str] = None,
+    reverse: bool = False,
+    fields: Collection[str] = SNAPSHOT_FIELDS
+  ) -> ZfsCommand[list[Snapshot]]:
+    """fields are the properties of SNAPSHOT_FIELDS that the caller needs, the others are left out of the listing"""
+    props = _projection(fields, properties)
+    cmd = ['zfs', 'list', '-Hp', '-t', 'snapshot', '-o', ','.join(props)]
+    if recursive:
+      cmd += ['-r']
+    if sort_by is not None:
+      cmd += ['-s' if not reverse else '-S', sort_by]
+    if dataset:
+      cmd += [dataset]
+    return ZfsCommand(cmd, lambda out: [Snapshot(p) for p in _parse_rows(props, out)])
+
+  @staticmethod
+  def get_snapshots_of(
+    datasets: Collection[str], properties: Collection[str] = [], fields: Collection[str] = SNAPSHOT_FIELDS
+  ) -> ZfsCommand[list[Snapshot]]:
+    """Snapshots of each of the datasets, without descendants"""
+    props = _projection(fields, properties)
+    cmd = ['zfs', 'list', '-Hp', '-t', 'snapshot', '-o', ','.join(props), '-d', '1', *datasets]
+    return ZfsCommand(cmd, lambda out: [Snapshot(p) for p in _parse_rows(props, out)])
+
+  @staticmethod
+  def set_tags(snap_fullname: str, tags: Collection[str]) -> ZfsCommand[None]:
+    return ZfsCommand(
+      ['zfs', 'set', f"{ZfsProperty.CUSTOM_TAGS}={','.join(tags)}", snap_fullname], _no_result, _datasets_of([snap_fullname])
+    )
+
+  @staticmethod
+  def destroy_snapshots(dataset: str, snapshots_shortnames: Collection[str]) -> ZfsCommand[None]:
+    shortnames_str = ','.join(snapshots_shortnames)
+    return ZfsCommand(['zfs', 'destroy', f'{dataset}@{shortnames_str}'], _no_result)
+
+  @staticmethod
+  def rollback(snapshot_fullname: str) -> ZfsCommand[None]:
+    return ZfsCommand(['zfs', 'rollback', '-r', snapshot_fullname], _no_result)
+
+  @staticmethod
+  def estimate_destroy(dataset: str, snapshots_spec: str) -> ZfsCommand[int]:
+    return ZfsCommand(['zfs', 'destroy', '-nvp', f'{dataset}@{snapshots_spec}'], _parse_reclaim)
+
+  @staticmethod
+  def create_bookmark(snapshot_fullname: str, bookmark_shortname: str) -> ZfsCommand[None]:
+    dataset = snapshot_fullname.split('@')[0]
+    return ZfsCommand(['zfs', 'bookmark', snapshot_fullname, f'{dataset}#{bookmark_shortname}'], _no_result)
+
+  @staticmethod
+  def get_all_bookmarks(
+    dataset: Optional[str] = None,
+    recursive: bool = False,
+    sort_by: Optional[str] = None,
+    reverse: bool = False
+  ) -> ZfsCommand[list[Bookmark]]:
+    props = [ZfsProperty.NAME, ZfsProperty.CREATION, ZfsProperty.GUID, ZfsProperty.CREATETXG]
+    cmd = ['zfs', 'list', '-Hp', '-t', 'bookmark', '-o', ','.join(props)]
+    if recursive:
+      cmd += ['-r']
+    if sort_by is not None:
+      cmd += ['-s' if not reverse else '-S', sort_by]
+    if dataset:
+      cmd += [dataset]
+    return ZfsCommand(cmd, lambda out: [Bookmark(p) for p in _parse_rows(props, out)])
+
+  @staticmethod
+  def destroy_bookmark(bookmark_fullname: str) -> ZfsCommand[None]:
+    return ZfsCommand(['zfs', 'destroy', bookmark_fullname], _no_result)
+
+
+class BatchResult(Generic[T]):
+  """Result of a command queued in a CommandBatch, available once the batch has run"""
+  command: ZfsCommand[T]
+  returncode: Optional[int]  # None if the command did not run
+  stdout: str
+
+  def __init__(self, command: ZfsCommand[T]) -> None:
+    self.command = command
+    self.returncode = None
+    self.stdout = ''
+
+  def result(self) -> T:
+    if self.returncode is None:
+      raise RuntimeError(f'Command "{shlex.join(self.command.args)}" was not run')
+    if self.returncode > 0:
+      raise CalledProcessError(self.returncode, cmd=self.command.args, output=self.stdout)
+    return self.command.parse(self.stdout)
+
+
+class CommandBatch:
+  """
+  Runs queued commands one after another in a single shell invocation, i.e. in a single SSH round trip for RemoteZfsCli.
+  The stdout and exit code of each command are framed by a random boundary token.
+  Commands after the first failing one are not run. Their results raise RuntimeError.
+  """
+  cli: ZfsCli
+  _results: list[BatchResult]
+
+  def __init__(self, cli: ZfsCli) -> None:
+    self.cli = cli
+    self._results = []
+
+  def __enter__(self) -> CommandBatch:
+    return self
+
+  def __exit__(self, exc_type, exc, tb) -> None:
+    if exc_type is None:
+      self.run()
+
+  def add(self, command: ZfsCommand[T]) -> BatchResult[T]:
+    r = BatchResult(command)
+    self._results.append(r)
+    return r
+
+  def run(self) -> None:
+    """Runs all queued commands and raises the error of the failed command, if any"""
+    results, self._results = self._results, []
+    if not results:
+      return
+    for r in results:
+      listing_cache.invalidate(self.cli.host, r.command.touches)
+    token = f'zfsnappr-batch-{secrets.token_hex(8)}'
+    script = '\n'.join(
+      f"{shlex.join(r.command.args)}; rc=$?; printf '\\n{token} {i} %d\\n' $rc; [ $rc -eq 0 ] || exit 0"
+      for i, r in enumerate(results)
+    )
+    stdout = self.cli.run_text_command(self.cli.shell_command(script))
+
+    pos = 0
+    for m in re.finditer(rf'\n{token} (\d+) (\d+)\n', stdout):
+      r = results[int(m.group(1))]
+      r.stdout = stdout[pos:m.start()]
+      r.returncode = int(m.group(2))
+      pos = m.end()
+    for r in results:
+      r.result()
+
+
 """
 Each method call should correspond to exactly one CLI call
 """
 class ZfsCli:
+  host: Optional[str] = None  # None for the local host
+
+  def run(self, command: ZfsCommand[T]) -> T:
+    listing_cache.invalidate(self.host, command.touches)
+    stdout = self.run_text_command(command.args)
+    if not tracer.enabled:
+      return command.parse(stdout)
+    start = time.monotonic()
+    try:
+      return command.parse(stdout)
+    finally:
+      tracer.record_parse(command.args, self.host, time.monotonic() - start)
+
+  def batch(self) -> CommandBatch:
+    """Queues commands to run them in a single CLI call. Used as context manager, the batch runs on exit."""
+    return CommandBatch(self)
+
+  def shell_command(self, script: str) -> list[str]:
+    return ['sh', '-c', script]
+
+  def replay(self) -> Optional[Replay]:
+    """Recorded session that serves the calls of this CLI instead of running them"""
+    return session.replay
+
   def run_text_command(self, cmd: list[str]) -> str:
+    replay = self.replay()
+    if replay is not None:
+      stdout, returncode = replay.respond(self.host, cmd)
+    else:
+      p: Popen[str] = self.start_command(cmd, stdout=PIPE, text=True)
+      stdout, _ = p.communicate()
+      returncode = p.returncode
+      if session.recorder is not None:
+        session.recorder.record(self.host, cmd, stdout, returncode)
+    if returncode > 0:
+      raise CalledProcessError(returncode, cmd=cmd, output=stdout)
+    return stdout
+
+  def stream_text_command(self, cmd: list[str]) -> Iterator[str]:
+    """Yields stdout lines as soon as they are written. Terminates the command if the iterator is not exhausted."""
+    replay = self.replay()
+    if replay is not None:
+      stdout, returncode = replay.respond(self.host, cmd)
+      yield from stdout.splitlines()
+      if returncode > 0:
+        raise CalledProcessError(returncode, cmd=cmd)
+      return
+
     p: Popen[str] = self.start_command(cmd, stdout=PIPE, text=True)
-    stdout, _ = p.communicate()
+    assert p.stdout is not None
+    lines: list[str] = []
+    try:
+      for line in p.stdout:
+        if session.recorder is not None:
+          lines.append(line)
+        yield line.rstrip('\n')
+    finally:
+      if p.poll() is None:
+        p.terminate()
+      p.stdout.close()
+      p.wait()
+      if session.recorder is not None:
+        # only what was read, which is what a replay has to serve
+        session.recorder.record(self.host, cmd, ''.join(lines), p.returncode)
     if p.returncode > 0:
-      raise CalledProcessError(p.returncode, cmd=p.args, output=stdout)
-    return stdout
+      raise CalledProcessError(p.returncode, cmd=cmd)
   
   def start_command(self, cmd: list[str], stdin=None, stdout=None, stderr=None, text=False) -> Popen:
-    return Popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr, text=text)
+    if self.replay() is not None:
+      raise RuntimeError(f'Cannot replay a streaming command, run with --dry-run: {" ".join(cmd)}')
+    record = tracer.start(cmd, self.host)
+    if record is None:
+      return Popen(self.wrap_command(cmd), stdin=stdin, stdout=stdout, stderr=stderr, text=text)
+    return TracedPopen(record, self.wrap_command(cmd), stdin=stdin, stdout=stdout, stderr=stderr, text=text)
+
+  def wrap_command(self, cmd: list[str]) -> list[str]:
+    """Turns cmd into the command line that runs it on the host"""
+    return cmd
   
-  def send_snapshot_async(self, snapshot_fullname: str, base_fullname: Optional[str] = None) -> Popen[bytes]:
-    cmd = ['zfs', 'send']
-    if base_fullname:
-      cmd += ['-i', base_fullname]
-    cmd += [snapshot_fullname]
-    return self.start_command(cmd, stdout=PIPE)
+  def start_pipeline(self, cmds: list[list[str]], stdin=None, stdout=None) -> Popen:
+    """Starts the commands piped into each other on the host. Fails if any of them fails."""
+    if len(cmds) == 1:
+      return self.start_command(cmds[0], stdin=stdin, stdout=stdout)
+    return self.start_command(self.shell_command(pipeline_script(cmds)), stdin=stdin, stdout=stdout)
+
+  def send_snapshot_async(self, snapshot_fullname: str, base_fullname: Optional[str] = None,
+                          filters: list[list[str]] = [], stdout=PIPE) -> Popen[bytes]:
+    """
+    base_fullname may be a snapshot or a bookmark
+    filters are commands that the stream is piped through on the host, like a compressor
+    """
+    return self.start_pipeline([ZfsCommands.send(snapshot_fullname, base_fullname), *filters], stdout=stdout)
   
-  def receive_snapshot_async(self, dataset: str, stdin: IO[bytes], properties: dict[str, str] = {}) -> Popen[bytes]:
-    cmd = ['zfs', 'receive']
-    for property, value in properties.items():
-      cmd += ['-o', f'{property}={value}']
-    cmd += [dataset]
-    return self.start_command(cmd, stdin=stdin)
+  def receive_snapshot_async(self, dataset: str, stdin: Optional[IO[bytes]], properties: dict[str, str] = {},
+                             filters: list[list[str]] = []) -> Popen[bytes]:
+    """filters are commands that the stream is piped through on the host before it is received"""
+    return self.start_pipeline([*filters, ZfsCommands.receive(dataset, properties)], stdin=stdin)
+
+  def estimate_send_size(self, snapshot_fullname: str, base_fullname: Optional[str] = None) -> int:
+    """Size in bytes of the stream that send_snapshot_async would produce"""
+    return self.run(ZfsCommands.estimate_send(snapshot_fullname, base_fullname))
 
-  # TrueNAS CORE 13.0 does not support holds -p, so we do not fetch timestamp
   def get_holds(self, snapshots_fullnames: Collection[str]) -> set[Hold]:
     if not snapshots_fullnames:
       return set()
-    lines = self.run_text_command(['zfs', 'holds', '-H', *snapshots_fullnames]).splitlines()
-    holds: set[Hold] = set()
-    for line in lines:
-      snapname, tag, _ = line.split('\t')
-      holds.add(Hold(
-        snap_longname=snapname,
-        tag=tag
-      ))
-    return holds
+    return self.run(ZfsCommands.get_holds(snapshots_fullnames))
   
   def has_hold(self, snapshot_fullname: str, tag: str) -> bool:
     """Convenience method for checking if snapshot has hold with certain name"""
@@ -140,76 +596,48 @@ class ZfsCli:
   def hold(self, snapshots_fullnames: Collection[str], tag: str) -> None:
     if not snapshots_fullnames:
       return
-    self.run_text_command(['zfs', 'hold', tag, *snapshots_fullnames])
+    self.run(ZfsCommands.hold(snapshots_fullnames, tag))
 
   def release(self, snapshots_fullnames: Collection[str], tag: str) -> None:
     if not snapshots_fullnames:
       return
-    self.run_text_command(['zfs', 'release', tag, *snapshots_fullnames])
+    self.run(ZfsCommands.release(snapshots_fullnames, tag))
 
   def get_pool_from_dataset(self, dataset: str) -> Pool:
-    name = dataset.split('/')[0]
-    guid = self.run_text_command(['zpool', 'get', '-Hp', '-o', 'value', 'guid', name])
-    return Pool(name=name, guid=int(guid))
+    return self.run(ZfsCommands.get_pool_from_dataset(dataset))
   
+  def get_pool_freeing(self, pool: str) -> int:
+    return self.run(ZfsCommands.get_pool_freeing(pool))
+
   def get_datasets(self, names: Collection[str], properties: Collection[str] = []) -> list[Dataset]:
     if not names:
       return []
-    properties = list(dict.fromkeys(REQUIRED_PROPS + list(properties)))  # eliminate duplicates
-    
-    cmd = ['zfs', 'get', '-Hp', '-o', 'value', ','.join(properties), *names]
-    lines = self.run_text_command(cmd).splitlines()
-
-    datasets: list[Dataset] = []
-    for i in range(len(names)):
-      props = {p: v for p, v in zip(properties, lines[i*len(properties):(i+1)*len(properties)])}
-      datasets.append(Dataset(props))
-    return datasets
-  
+    return self.run(ZfsCommands.get_datasets(names, properties))
 
   def get_dataset(self, name: str, properties: Collection[str] = []) -> Dataset:
     """Shorthand method"""
     return next(iter(self.get_datasets([name], properties)))
 
-  
-  def get_all_datasets(self, properties: Collection[str] = []) -> list[Dataset]:
-    properties = list(dict.fromkeys(REQUIRED_PROPS + list(properties)))  # eliminate duplicates
-
-    cmd = ['zfs', 'list', '-Hp', '-o', ','.join(properties)]
-    lines = self.run_text_command(cmd).splitlines()
-
-    datasets: list[Dataset] = []
-    for line in lines:
-      props = {p: v for p, v in zip(properties, line.split('\t'))}
-      datasets.append(Dataset(props))
-  
-    return datasets
+  def get_all_datasets(self, properties: Collection[str] = [], dataset: Optional[str] = None, recursive: bool = False) -> list[Dataset]:
+    return self.run(ZfsCommands.get_all_datasets(properties, dataset, recursive))
   
   def create_snapshot(self, fullname: str, recursive: bool = False, properties: dict[str, str] = {}) -> None:
-    cmd = ['zfs', 'snapshot']
-    if recursive:
-      cmd += ['-r']
-    for property, value in properties.items():
-      cmd += ['-o', f'{property}={value}']
-    cmd += [fullname]
-    self.run_text_command(cmd)
+    self.run(ZfsCommands.create_snapshot(fullname, recursive, properties))
   
   def rename_snapshot(self, fullname: str, new_shortname: str) -> None:
-    cmd = ['zfs', 'rename', fullname, new_shortname]
-    self.run_text_command(cmd)
+    self.run(ZfsCommands.rename_snapshot(fullname, new_shortname))
+
+  def _fields(self, fields: Collection[str]) -> Collection[str]:
+    # the catalog records all fields of the snapshots that it sees
+    return SNAPSHOT_FIELDS if catalog.enabled else fields
 
-  def get_snapshots(self, fullnames: Collection[str], properties: Collection[str] = []) -> list[Snapshot]:
+  def get_snapshots(
+    self, fullnames: Collection[str], properties: Collection[str] = [], fields: Collection[str] = SNAPSHOT_FIELDS
+  ) -> list[Snapshot]:
     if not fullnames:
       return []
-    properties = list(dict.fromkeys(REQUIRED_PROPS + list(properties)))  # eliminate duplicates
-    
-    cmd = ['zfs', 'get', '-Hp', '-o', 'value', ','.join(properties), *fullnames]
-    lines = self.run_text_command(cmd).splitlines()
-
-    snaps: list[Snapshot] = []
-    for i in range(len(fullnames)):
-      props = {p: v for p, v in zip(properties, lines[i*len(properties):(i+1)*len(properties)])}
-      snaps.append(Snapshot(props))
+    snaps = self.run(ZfsCommands.get_snapshots(fullnames, properties, self._fields(fields)))
+    catalog.record_snapshots(self.host, snaps)
     return snaps
 
   def get_all_snapshots(self,
@@ -217,56 +645,193 @@ class ZfsCli:
     recursive: bool = False,
     properties: Collection[str] = [],
     sort_by: Optional[str] = None,
-    reverse: bool = False
+    reverse: bool = False,
+    fields: Collection[str] = SNAPSHOT_FIELDS
   ) -> list[Snapshot]:
-    properties = list(dict.fromkeys(REQUIRED_PROPS + list(properties)))  # eliminate duplicates
+    """fields are the properties of SNAPSHOT_FIELDS that the caller needs, snapshots may lack the others"""
+    snaps: Optional[list[Snapshot]] = None
+    cached = self._use_listing_cache(properties)
+    if cached:
+      snaps = self._get_all_snapshots_cached(dataset, recursive, sort_by, reverse)
+    if snaps is None:
+      snaps = self.run(ZfsCommands.get_all_snapshots(dataset, recursive, properties, sort_by, reverse, self._fields(fields)))
+      if cached:
+        # the dataset exists, so fetching the stamps failed because ZFS does not know snapshots_changed
+        listing_cache.mark_unsupported(self.host)
+    catalog.record_listing(self.host, dataset, recursive, snaps)
+    metrics.record_listing(self.host, snaps)
+    return snaps
 
-    cmd = ['zfs', 'list', '-Hp', '-t', 'snapshot', '-o', ','.join(properties)]
-    if recursive:
-      cmd += ['-r']
+  def _use_listing_cache(self, properties: Collection[str]) -> bool:
+    # the cache holds all fields but no other properties, and recordings and replays must see the plain listing
+    return (
+      listing_cache.supports(self.host) and set(properties) <= set(SNAPSHOT_FIELDS)
+      and self.replay() is None and session.recorder is None
+    )
+
+  def _get_all_snapshots_cached(
+    self, dataset: Optional[str], recursive: bool, sort_by: Optional[str], reverse: bool
+  ) -> Optional[list[Snapshot]]:
+    """
+    Lists only the datasets whose snapshots_changed differs from their cache entry, in a single round trip,
+    and loads the others from the cache. If most datasets changed, all of them are listed at once.
+    None if the stamps cannot be fetched, e.g. because the host does not report snapshots_changed.
+    """
+    try:
+      datasets = self.get_all_datasets([ZfsProperty.SNAPSHOTS_CHANGED], dataset, recursive or dataset is None)
+    except CalledProcessError:
+      return None
+    props = _projection(SNAPSHOT_FIELDS, [])
+
+    rows: dict[str, list[dict[str, str]]] = {}
+    changed: list[Dataset] = []
+    for d in datasets:
+      stamp = d.properties[ZfsProperty.SNAPSHOTS_CHANGED]
+      entry = listing_cache.load(self.host, d.name)
+      # '-' if no snapshot was created or destroyed since the pool supports the property
+      if entry is not None and stamp.isdigit() and entry.valid_for(d.guid, int(stamp), props):
+        rows[d.name] = [dict(zip(props, r)) for r in entry.rows]
+      else:
+        changed.append(d)
+
+    listed = time.time()
+    if len(changed) > len(datasets) // 2:
+      # a single listing of everything is cheaper than many partial ones
+      relisted, changed = self.run(ZfsCommands.get_all_snapshots(dataset, recursive)), datasets
+    elif changed:
+      names = [d.name for d in changed]
+      with self.batch() as batch:
+        results = [batch.add(ZfsCommands.get_snapshots_of(names[i:i+LIST_BATCH_SIZE])) for i in range(0, len(names), LIST_BATCH_SIZE)]
+      relisted = [s for r in results for s in r.result()]
+    else:
+      relisted = []
+
+    for d in changed:
+      rows[d.name] = []
+    for s in relisted:
+      if s.dataset in rows:  # not if the dataset was created after the stamps were fetched
+        rows[s.dataset].append(s.properties)
+    for d in changed:
+      stamp = d.properties[ZfsProperty.SNAPSHOTS_CHANGED]
+      if stamp.isdigit():
+        listing_cache.store(self.host, d.name, CacheEntry(
+          d.guid, int(stamp), listed, tuple(props), [[p[k] for k in props] for p in rows[d.name]]
+        ))
+    log.debug(f'Listed snapshots of {len(changed)} datasets, {len(datasets) - len(changed)} served from the listing cache')
+
+    snaps = [Snapshot(p) for d in datasets for p in rows[d.name]]
     if sort_by is not None:
-      cmd += ['-s' if not reverse else '-S', sort_by]
-    if dataset:
-      cmd += [dataset]
-    lines = self.run_text_command(cmd).splitlines()
-
-    snapshots: list[Snapshot] = []
-    for line in lines:
-      props = {p: v for p, v in zip(properties, line.split('\t'))}
-      snapshots.append(Snapshot(props))
-
-    return snapshots
+      snaps.sort(key=lambda s: _sort_key(s.properties[sort_by]), reverse=reverse)
+    return snaps
 
+  def iter_all_snapshots(self,
+    dataset: Optional[str] = None,
+    recursive: bool = False,
+    properties: Collection[str] = [],
+    sort_by: Optional[str] = None,
+    reverse: bool = False,
+    fields: Collection[str] = SNAPSHOT_FIELDS
+  ) -> Iterator[Snapshot]:
+    """
+    Like get_all_snapshots, but yields each snapshot as soon as it is listed.
+    Listings that the listing cache can serve are taken from it instead, which is faster than streaming.
+    """
+    if self._use_listing_cache(properties):
+      yield from self.get_all_snapshots(dataset, recursive, properties, sort_by, reverse, fields)
+      return
+    command = ZfsCommands.get_all_snapshots(dataset, recursive, properties, sort_by, reverse, self._fields(fields))
+    listed: list[Snapshot] = []
+    for line in self.stream_text_command(command.args):
+      snaps = command.parse(line)
+      if catalog.enabled or metrics.enabled:
+        listed += snaps
+      yield from snaps
+    catalog.record_listing(self.host, dataset, recursive, listed)
+    metrics.record_listing(self.host, listed)
   
   def set_tags(self, snap_fullname: str, tags: Collection[str]):
-    cmd = ['zfs', 'set', f"{ZfsProperty.CUSTOM_TAGS}={','.join(tags)}", snap_fullname]
-    self.run_text_command(cmd)
+    self.run(ZfsCommands.set_tags(snap_fullname, tags))
 
   def destroy_snapshots(self, dataset: str, snapshots_shortnames: Collection[str]) -> None:
     if not snapshots_shortnames:
       return
-    shortnames_str = ','.join(snapshots_shortnames)
-    self.run_text_command(['zfs', 'destroy', f'{dataset}@{shortnames_str}'])
+    self.run(ZfsCommands.destroy_snapshots(dataset, snapshots_shortnames))
+    catalog.record_destroyed(self.host, dataset, snapshots_shortnames)
+    metrics.record_destroyed(self.host, dataset, len(snapshots_shortnames))
+
+  def rollback(self, snapshot_fullname: str) -> None:
+    """Rolls back to given snapshot, destroying all newer snapshots"""
+    self.run(ZfsCommands.rollback(snapshot_fullname))
+
+  def estimate_destroy(self, dataset: str, snapshots_spec: str) -> int:
+    """
+    Returns the number of bytes that destroying the snapshots would reclaim, without destroying them.
+    snapshots_spec is a comma-separated list of shortnames and shortname ranges like a%b
+    """
+    return self.run(ZfsCommands.estimate_destroy(dataset, snapshots_spec))
+
+  def create_bookmark(self, snapshot_fullname: str, bookmark_shortname: str) -> None:
+    self.run(ZfsCommands.create_bookmark(snapshot_fullname, bookmark_shortname))
+
+  def get_all_bookmarks(self,
+    dataset: Optional[str] = None,
+    recursive: bool = False,
+    sort_by: Optional[str] = None,
+    reverse: bool = False
+  ) -> list[Bookmark]:
+    return self.run(ZfsCommands.get_all_bookmarks(dataset, recursive, sort_by, reverse))
+
+  def destroy_bookmark(self, bookmark_fullname: str) -> None:
+    self.run(ZfsCommands.destroy_bookmark(bookmark_fullname))
 
 
 class LocalZfsCli(ZfsCli):
   pass
 
 
+class ReplayZfsCli(ZfsCli):
+  """Serves recorded calls of given host, e.g. to benchmark planning against a recorded snapshot layout"""
+  _replay: Replay
+
+  def __init__(self, replay: Replay, host: Optional[str] = None) -> None:
+    super().__init__()
+    self._replay = replay
+    self.host = host
+
+  def replay(self) -> Optional[Replay]:
+    return self._replay
+
+
+def build_ssh_command(
+  host: str, user: Optional[str], port: Optional[int], cipher: Optional[str] = None, options: Collection[str] = []
+) -> list[str]:
+  """options are ssh_config options like Compression=no"""
+  cmd = ['ssh']
+  if user is not None:
+    cmd += ['-l', user]
+  if port is not None:
+    cmd += ['-p', str(port)]
+  if cipher is not None:
+    cmd += ['-c', cipher]
+  for option in options:
+    cmd += ['-o', option]
+  cmd += [host]
+  return cmd
+
+
 class RemoteZfsCli(ZfsCli):
   ssh_command: list[str]
 
-  def __init__(self, host: str, user: Optional[str], port: Optional[int]) -> None:
+  def __init__(
+    self, host: str, user: Optional[str], port: Optional[int], cipher: Optional[str] = None, ssh_options: Collection[str] = []
+  ) -> None:
     super().__init__()
+    self.host = host
+    self.ssh_command = build_ssh_command(host, user, port, cipher, ssh_options)
 
-    cmd = ['ssh']
-    if user is not None:
-      cmd += ['-l', user]
-    if port is not None:
-      cmd += ['-p', str(port)]
-    cmd += [host]
-    self.ssh_command = cmd
+  def shell_command(self, script: str) -> list[str]:
+    # ssh joins its arguments into a command line for the remote shell
+    return ['sh', '-c', shlex.quote(script)]
 
-  def start_command(self, cmd: list[str], stdin=None, stdout=None, stderr=None, text=False) -> Popen:
-    cmd = self.ssh_command + cmd
-    return super().start_command(cmd, stdin, stdout, stderr, text)
+  def wrap_command(self, cmd: list[str]) -> list[str]:
+    return self.ssh_command + cmd
@@ -0,0 +1,85 @@
+from __future__ import annotations
+from typing import Any
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+FAKE_ZFS = os.path.join(os.path.dirname(__file__), 'fake_zfs.py')
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+class FakeZfs:
+  """State and command log of the stub zfs on PATH"""
+  def __init__(self, directory: str) -> None:
+    self.state_path = os.path.join(directory, 'state.json')
+    self.log_path = os.path.join(directory, 'commands.log')
+    open(self.log_path, 'w').close()
+    self.write({'datasets': {}, 'snapshots': {}, 'bookmarks': {}, 'txg': 1, 'freeing': {}, 'clock': 1_000_000})
+
+  def read(self) -> dict[str, Any]:
+    with open(self.state_path) as f:
+      return json.load(f)
+
+  def write(self, state: dict[str, Any]) -> None:
+    with open(self.state_path, 'w') as f:
+      json.dump(state, f)
+
+  def add_datasets(self, *names: str, available: int = 10**9) -> None:
+    state = self.read()
+    for i, n in enumerate(names):
+      state['datasets'][n] = {'guid': 100 + len(state['datasets']), 'available': available, 'props': {}}
+    self.write(state)
+
+  def add_snapshot(self, name: str, used: int = 1000, tags: str = '') -> None:
+    state = self.read()
+    state['txg'] += 1
+    dataset = name.split('@')[0]
+    state['snapshots'][name] = {
+      'guid': state['txg'] * 1000 + 7, 'creation': state['clock'], 'txg': state['txg'], 'used': used,
+      'props': {'zfsnappr:tags': tags}, 'holds': []
+    }
+    state['datasets'][dataset]['changed'] = state['clock']
+    self.write(state)
+
+  def tick(self, seconds: int = 10) -> None:
+    """Advances the clock that stamps new snapshots and snapshots_changed"""
+    state = self.read()
+    state['clock'] += seconds
+    self.write(state)
+
+  def commands(self) -> list[str]:
+    with open(self.log_path) as f:
+      return f.read().splitlines()
+
+  def clear_commands(self) -> None:
+    open(self.log_path, 'w').close()
+
+
+@pytest.fixture
+def zfs(tmp_path, monkeypatch) -> FakeZfs:
+  """Puts stub zfs and zpool commands on PATH"""
+  bin_dir = tmp_path / 'bin'
+  bin_dir.mkdir()
+  for program in ('zfs', 'zpool'):
+    script = bin_dir / program
+    script.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_ZFS}" {program} "$@"\n')
+    script.chmod(0o755)
+  fake = FakeZfs(str(tmp_path))
+  monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+  monkeypatch.setenv('FAKEZFS_STATE', fake.state_path)
+  monkeypatch.setenv('FAKEZFS_LOG', fake.log_path)
+  return fake
+
+
+def run_zfsnappr(*args: str) -> subprocess.CompletedProcess[str]:
+  return subprocess.run([sys.executable, '-m', 'zfsnappr', *args], env={**os.environ, 'PYTHONPATH': SRC}, capture_output=True, text=True)
+
+
+@pytest.fixture
+def zfsnappr():
+  """Runs the zfsnappr CLI in a subprocess, against the stub zfs if the zfs fixture is used as well"""
+  return run_zfsnappr
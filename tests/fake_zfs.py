@@ -0,0 +1,216 @@
+"""
+Stub of the zfs and zpool CLIs for tests, with its state in a JSON file.
+Invoked as "fake_zfs.py zfs|zpool ARGS...", see the zfs fixture in conftest.py.
+Supports the subcommands and options that zfsnappr uses, with the output format of zfs -Hp.
+"""
+from __future__ import annotations
+import fcntl
+import json
+import os
+import sys
+import time
+
+
+def load(path: str) -> dict:
+  if not os.path.exists(path):
+    return {'datasets': {}, 'snapshots': {}, 'bookmarks': {}, 'txg': 1, 'freeing': {}}
+  with open(path) as f:
+    return json.load(f)
+
+
+def save(path: str, state: dict) -> None:
+  with open(path + '.tmp', 'w') as f:
+    json.dump(state, f)
+  os.replace(path + '.tmp', path)
+
+
+def fail(message: str) -> None:
+  sys.stderr.write(message + '\n')
+  sys.exit(1)
+
+
+def snapshot_props(state: dict, name: str) -> dict[str, str]:
+  s = state['snapshots'][name]
+  return {
+    'name': name, 'guid': str(s['guid']), 'creation': str(s['creation']), 'createtxg': str(s['txg']),
+    'userrefs': str(len(s['holds'])), 'used': str(s['used']), **s['props']
+  }
+
+
+def dataset_props(state: dict, name: str) -> dict[str, str]:
+  d = state['datasets'][name]
+  used = sum(s['used'] for n, s in state['snapshots'].items() if n.split('@')[0] == name)
+  return {
+    'name': name, 'guid': str(d['guid']), 'creation': '1', 'usedbysnapshots': str(used), 'available': str(d['available']),
+    'snapshots_changed': str(d.get('changed', '-')), **d['props']
+  }
+
+
+def bookmark_props(state: dict, name: str) -> dict[str, str]:
+  b = state['bookmarks'][name]
+  return {'name': name, 'guid': str(b['guid']), 'creation': str(b['creation']), 'createtxg': str(b['txg'])}
+
+
+def list_(state: dict, args: list[str]) -> None:
+  types, props, recursive, sort, reverse, targets = ['filesystem'], ['name'], False, None, False, []
+  i = 0
+  while i < len(args):
+    a = args[i]
+    if a in ('-t', '-o', '-s', '-S', '-d'):
+      value = args[i+1]
+      if a == '-t':
+        types = value.split(',')
+      elif a == '-o':
+        props = value.split(',')
+      elif a == '-d':
+        recursive = value != '1'
+      else:
+        sort, reverse = value, a == '-S'
+      i += 2
+      continue
+    if a == '-r':
+      recursive = True
+    elif not a.startswith('-'):
+      targets.append(a)
+    i += 1
+
+  for t in targets:
+    if t not in state['datasets']:
+      fail(f"cannot open '{t}': dataset does not exist")
+
+  def selected(name: str) -> bool:
+    dataset = name.split('@')[0].split('#')[0]
+    return not targets or any(dataset == t or recursive and dataset.startswith(t + '/') for t in targets)
+
+  rows = []
+  if 'filesystem' in types:
+    rows += [dataset_props(state, n) for n in state['datasets'] if selected(n)]
+  if 'snapshot' in types:
+    rows += [snapshot_props(state, n) for n in state['snapshots'] if selected(n)]
+  if 'bookmark' in types:
+    rows += [bookmark_props(state, n) for n in state['bookmarks'] if selected(n)]
+  if sort is not None:
+    rows.sort(key=lambda r: int(r[sort]) if r.get(sort, '-').isdigit() else 0, reverse=reverse)
+  for r in rows:
+    print('\t'.join(r.get(p, '-') for p in props))
+
+
+def destroy(state: dict, args: list[str]) -> None:
+  flags = ''.join(a[1:] for a in args if a.startswith('-'))
+  [name] = [a for a in args if not a.startswith('-')]
+  if '#' in name:
+    if 'n' not in flags:
+      del state['bookmarks'][name]
+    return
+  dataset, spec = name.split('@')
+  order = sorted((n for n in state['snapshots'] if n.split('@')[0] == dataset), key=lambda n: state['snapshots'][n]['txg'])
+  shortnames = [n.split('@')[1] for n in order]
+  names: list[str] = []
+  for part in spec.split(','):
+    if '%' in part:
+      first, last = part.split('%')
+      if first not in shortnames or last not in shortnames:
+        fail('could not find any snapshots to destroy; check snapshot names.')
+      names += [f'{dataset}@{s}' for s in shortnames[shortnames.index(first):shortnames.index(last)+1]]
+    else:
+      names.append(f'{dataset}@{part}')
+  for n in names:
+    if n not in state['snapshots']:
+      fail('could not find any snapshots to destroy; check snapshot names.')
+    if state['snapshots'][n]['holds']:
+      fail(f'cannot destroy snapshot {n}: dataset is busy')
+  reclaimed = sum(state['snapshots'][n]['used'] for n in names)
+  if 'n' in flags:
+    if 'v' in flags:
+      for n in names:
+        print(f'destroy\t{n}')
+    if 'p' in flags:
+      print(f'reclaim\t{reclaimed}')
+    return
+  for n in names:
+    del state['snapshots'][n]
+  state['datasets'][dataset]['changed'] = state['clock']
+  pool = dataset.split('/')[0]
+  state['freeing'][pool] = state['freeing'].get(pool, 0) + reclaimed
+
+
+def zfs(state: dict, command: str, args: list[str]) -> None:
+  if command == 'list':
+    list_(state, args)
+  elif command == 'get':
+    values = [a for a in args if not a.startswith('-')][1:]  # without the "value" of -o value
+    props, names = values[0].split(','), values[1:]
+    for n in names:
+      if n in state['snapshots']:
+        p = snapshot_props(state, n)
+      elif n in state['datasets']:
+        p = dataset_props(state, n)
+      else:
+        fail(f"cannot open '{n}': dataset does not exist")
+      for k in props:
+        print(p.get(k, '-'))
+  elif command == 'holds':
+    for n in (a for a in args if not a.startswith('-')):
+      for tag in state['snapshots'][n]['holds']:
+        print(f'{n}\t{tag}\tThu Jan  1 00:00 1970')
+  elif command in ('hold', 'release'):
+    tag, names = args[0], args[1:]
+    for n in names:
+      holds = state['snapshots'][n]['holds']
+      if command == 'hold':
+        holds.append(tag)
+      elif tag in holds:
+        holds.remove(tag)
+      else:
+        fail(f"cannot release hold from snapshot '{n}': no such tag on this dataset")
+  elif command == 'snapshot':
+    props = dict(args[i+1].split('=', 1) for i, a in enumerate(args) if a == '-o')
+    [name] = [a for i, a in enumerate(args) if not a.startswith('-') and args[i-1] != '-o']
+    dataset, shortname = name.split('@')
+    for d in [d for d in state['datasets'] if d == dataset or '-r' in args and d.startswith(dataset + '/')]:
+      state['txg'] += 1
+      state['snapshots'][f'{d}@{shortname}'] = {
+        'guid': state['txg'] * 1000 + 7, 'creation': state['clock'], 'txg': state['txg'], 'used': 1000, 'props': props, 'holds': []
+      }
+      state['datasets'][d]['changed'] = state['clock']
+  elif command == 'bookmark':
+    snapshot, bookmark = args
+    s = state['snapshots'][snapshot]
+    state['bookmarks'][snapshot.split('@')[0] + bookmark] = {'guid': s['guid'], 'creation': s['creation'], 'txg': s['txg']}
+  elif command == 'destroy':
+    destroy(state, args)
+  elif command == 'set':
+    key, value = args[0].split('=', 1)
+    name = args[1]
+    (state['snapshots'][name] if name in state['snapshots'] else state['datasets'][name])['props'][key] = value
+  elif command == 'rename':
+    old, new = args
+    state['snapshots'][old.split('@')[0] + new] = state['snapshots'].pop(old)
+  else:
+    fail(f'fake zfs: unsupported command {command}')
+
+
+def zpool(state: dict, args: list[str]) -> None:
+  # zpool get -Hp -o value PROPERTY POOL
+  prop, pool = args[-2], args[-1]
+  print({'freeing': str(state['freeing'].get(pool, 0)), 'guid': str(sum(map(ord, pool)))}.get(prop, '-'))
+
+
+def main() -> None:
+  path = os.environ['FAKEZFS_STATE']
+  program, *args = sys.argv[1:]
+  with open(path + '.lock', 'a') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    with open(os.environ['FAKEZFS_LOG'], 'a') as log:
+      log.write(' '.join([program, *args]) + '\n')
+    state = load(path)
+    state.setdefault('clock', int(time.time()))
+    if program == 'zpool':
+      zpool(state, args)
+    else:
+      zfs(state, args[0], args[1:])
+    save(path, state)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,56 @@
+from __future__ import annotations
+from subprocess import CalledProcessError
+
+import pytest
+
+from zfsnappr.zfs import LocalZfsCli, ZfsCommand, ZfsCommands
+
+
+def echo(text: str) -> ZfsCommand[str]:
+  return ZfsCommand(['printf', '%s', text], lambda out: out)
+
+
+def test_each_result_gets_exactly_its_own_stdout():
+  with LocalZfsCli().batch() as batch:
+    results = [batch.add(echo(t)) for t in ['one\ntwo\n', '', 'no newline', '\n\n']]
+  assert [r.result() for r in results] == ['one\ntwo\n', '', 'no newline', '\n\n']
+  assert [r.returncode for r in results] == [0, 0, 0, 0]
+
+
+def test_commands_after_a_failure_do_not_run(zfs):
+  zfs.add_datasets('tank')
+  cli = LocalZfsCli()
+  batch = cli.batch()
+  first = batch.add(ZfsCommands.get_all_datasets(dataset='tank'))
+  failing = batch.add(ZfsCommands.get_all_datasets(dataset='tank/missing'))
+  skipped = batch.add(ZfsCommands.get_all_snapshots('tank'))
+
+  with pytest.raises(CalledProcessError) as e:
+    batch.run()
+  assert e.value.returncode == 1
+  assert [d.name for d in first.result()] == ['tank']
+  assert failing.returncode == 1
+  with pytest.raises(RuntimeError):
+    skipped.result()
+  assert not [c for c in zfs.commands() if '-t snapshot' in c]
+
+
+def test_a_single_round_trip(zfs):
+  zfs.add_datasets('tank')
+  calls: list[list[str]] = []
+  cli = LocalZfsCli()
+  run = cli.run_text_command
+  cli.run_text_command = lambda cmd: calls.append(cmd) or run(cmd)  # type: ignore[method-assign]
+  with cli.batch() as batch:
+    datasets = batch.add(ZfsCommands.get_all_datasets(dataset='tank'))
+    snaps = batch.add(ZfsCommands.get_all_snapshots('tank'))
+  assert len(calls) == 1 and calls[0][:2] == ['sh', '-c']
+  assert [d.name for d in datasets.result()] == ['tank']
+  assert snaps.result() == []
+
+
+def test_empty_batch_runs_nothing():
+  cli = LocalZfsCli()
+  cli.run_text_command = lambda cmd: pytest.fail('ran a command')  # type: ignore[method-assign]
+  with cli.batch():
+    pass
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+
+def test_recursive_create_records_the_snapshots_in_the_catalog(zfs, zfsnappr, tmp_path):
+  zfs.add_datasets('tank', 'tank/a', 'other')
+  catalog = str(tmp_path / 'catalog.db')
+  p = zfsnappr('--catalog', catalog, '--lock-dir', str(tmp_path / 'locks'), '-d', 'tank', '-r', 'create')
+  assert p.returncode == 0, p.stderr
+  assert sorted(s.split('@')[0] for s in zfs.read()['snapshots']) == ['tank', 'tank/a']
+
+  p = zfsnappr('--catalog', catalog, 'query', 'snapshots')
+  assert p.returncode == 0, p.stderr
+  assert 'tank/a' in p.stdout + p.stderr
+
+
+def test_dry_run_create_still_locks(zfs, zfsnappr, tmp_path):
+  from zfsnappr.locking import DatasetLocks, LockKey
+  zfs.add_datasets('tank')
+  locks = str(tmp_path / 'locks')
+  with DatasetLocks([LockKey('localhost', 'tank')], locks):
+    p = zfsnappr('-n', '--lock-dir', locks, '--lock-timeout', '0', '-d', 'tank', 'create')
+  assert p.returncode != 0
+  assert 'held by' in p.stderr
+  assert zfs.read()['snapshots'] == {}
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from zfsnappr.zfs import LocalZfsCli
+from zfsnappr.replication_common.discovery import discover_dest
+
+
+def test_existing_dest_is_listed_alone(zfs):
+  zfs.add_datasets('backup', 'backup/a', 'backup/b')
+  zfs.add_snapshot('backup/a@s1')
+  zfs.tick()
+  zfs.add_snapshot('backup/a@s2')
+  zfs.add_snapshot('backup/b@s1')
+
+  dest = discover_dest(LocalZfsCli(), 'backup/a')
+  assert dest.exists
+  assert dest.dataset is not None and dest.dataset.name == 'backup/a'
+  assert [s.shortname for s in dest.snaps] == ['s2', 's1']
+  # no listing of every dataset on the host
+  assert all(c.endswith('backup/a') or not c.startswith('zfs list') for c in zfs.commands())
+
+
+def test_missing_dest(zfs):
+  zfs.add_datasets('backup')
+  dest = discover_dest(LocalZfsCli(), 'backup/a')
+  assert not dest.exists
+  assert not [c for c in zfs.commands() if '-t snapshot' in c]
@@ -0,0 +1,17 @@
+from zfsnappr.filter import matches_tags, parse_tags
+
+
+def test_snapshot_needs_all_tags_of_one_group():
+  tag = parse_tags(['a,b', 'c'])
+  assert tag is not None
+  assert matches_tags({'a', 'b', 'x'}, tag)
+  assert matches_tags(['c'], tag)
+  assert not matches_tags({'a'}, tag)
+
+
+def test_unset_and_empty_tags_match_only_their_groups():
+  assert matches_tags(None, [{'UNSET'}])
+  assert not matches_tags(None, [{''}])
+  assert matches_tags(set(), [{''}])
+  assert not matches_tags(set(), [{'UNSET'}])
+  assert not matches_tags({'a'}, [{''}])
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+
+def snapshot_listings(zfs) -> list[str]:
+  return [c for c in zfs.commands() if '-t snapshot' in c]
+
+
+def test_lists_only_the_fields_of_the_columns(zfs, zfsnappr):
+  zfs.add_datasets('tank')
+  zfs.add_snapshot('tank@s1', tags='daily')
+
+  p = zfsnappr('-d', 'tank', 'list', '--format', 'tsv', '--columns', 'shortname,guid,holds')
+  assert p.returncode == 0, p.stderr
+  assert p.stdout.splitlines()[1].startswith('s1\t')
+  assert snapshot_listings(zfs) == ['zfs list -Hp -t snapshot -o name,creation,guid -s creation tank']
+
+
+def test_tags_are_listed_for_the_tag_column_and_filter(zfs, zfsnappr):
+  zfs.add_datasets('tank')
+  zfs.add_snapshot('tank@s1', tags='daily')
+  zfs.add_snapshot('tank@s2', tags='weekly')
+
+  p = zfsnappr('-d', 'tank', 'list', '--format', 'tsv', '--columns', 'shortname', '--tag', 'weekly')
+  assert p.returncode == 0, p.stderr
+  assert p.stdout.splitlines()[1:] == ['s2']
+  p = zfsnappr('-d', 'tank', 'list', '--format', 'tsv', '--columns', 'shortname,tags')
+  assert p.stdout.splitlines()[1:] == ['s1\tdaily', 's2\tweekly']
+  assert all('zfsnappr:tags' in c for c in snapshot_listings(zfs))
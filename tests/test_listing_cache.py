@@ -0,0 +1,160 @@
+from __future__ import annotations
+import json
+import os
+import pickle
+
+import pytest
+
+from zfsnappr import listing_cache as module
+from zfsnappr.listing_cache import CacheEntry, ListingCache, CLOCK_MARGIN
+
+
+PROPS = ('name', 'creation', 'guid')
+ROWS = [['tank/a@s1', '100', '11'], ['tank/a@s2', '200', '12']]
+
+
+@pytest.fixture
+def cache(tmp_path):
+  c = ListingCache()
+  c.open(str(tmp_path))
+  yield c
+  c.close()
+
+
+def entry(changed: int = 1000, listed: float = 2000) -> CacheEntry:
+  return CacheEntry(guid=7, changed=changed, listed=listed, properties=PROPS, rows=ROWS)
+
+
+def test_store_and_load(cache):
+  cache.store('h', 'tank/a', entry())
+  assert cache.load('h', 'tank/a') == entry()
+  assert cache.load(None, 'tank/a') is None  # hosts are separate
+  assert cache.load('h', 'tank/b') is None
+
+
+def test_files_are_json(cache, tmp_path):
+  cache.store(None, 'tank/a', entry())
+  [path] = [os.path.join(d, f) for d, _, files in os.walk(tmp_path) for f in files]
+  with open(path) as f:
+    assert json.load(f)['rows'] == ROWS
+
+
+def test_pickles_are_not_loaded(cache, tmp_path):
+  cache.store(None, 'tank/a', entry())
+  [path] = [os.path.join(d, f) for d, _, files in os.walk(tmp_path) for f in files]
+  with open(path, 'wb') as f:
+    pickle.dump((1, 7, 1000, 2000, PROPS, ROWS), f)
+  assert cache.load(None, 'tank/a') is None
+
+
+@pytest.mark.parametrize('content', ['', '[]', '{"format": 2}', '{"format": 2, "guid": 7, "changed": 1, "listed": 5, '
+                                     '"properties": ["name"], "rows": [["a", "b"]]}'])
+def test_malformed_files_are_ignored(cache, tmp_path, content):
+  cache.store(None, 'tank/a', entry())
+  [path] = [os.path.join(d, f) for d, _, files in os.walk(tmp_path) for f in files]
+  with open(path, 'w') as f:
+    f.write(content)
+  assert cache.load(None, 'tank/a') is None
+
+
+def test_other_format_is_ignored(cache, monkeypatch):
+  cache.store(None, 'tank/a', entry())
+  monkeypatch.setattr(module, 'FORMAT', module.FORMAT + 1)
+  assert cache.load(None, 'tank/a') is None
+
+
+def test_invalidate(cache):
+  cache.store('h', 'tank/a', entry())
+  cache.store('h', 'tank/b', entry())
+  cache.invalidate('h', ['tank/a', 'tank/missing'])
+  assert cache.load('h', 'tank/a') is None
+  assert cache.load('h', 'tank/b') is not None
+
+
+def test_valid_for():
+  e = entry(changed=1000, listed=1000 + 1 + CLOCK_MARGIN)
+  assert e.valid_for(7, 1000, PROPS)
+  assert not e.valid_for(8, 1000, PROPS)  # dataset was recreated
+  assert not e.valid_for(7, 1001, PROPS)  # snapshots changed
+  assert not e.valid_for(7, 1000, PROPS + ('userrefs',))
+
+
+def test_listing_in_the_second_of_the_last_change_is_not_trusted():
+  assert not entry(changed=1000, listed=1000.5).valid_for(7, 1000, PROPS)
+
+
+def test_disabled_cache_does_nothing(tmp_path):
+  c = ListingCache()
+  c.store(None, 'tank/a', entry())
+  assert c.load(None, 'tank/a') is None
+  assert not c.supports(None)
+
+
+def test_unsupported_hosts(cache):
+  assert cache.supports('h')
+  cache.mark_unsupported('h')
+  assert not cache.supports('h')
+  assert cache.supports(None)
+
+
+@pytest.fixture
+def global_cache(tmp_path):
+  module.listing_cache.open(str(tmp_path / 'cache'))
+  yield module.listing_cache
+  module.listing_cache.close()
+  module.listing_cache._unsupported.clear()
+
+
+def snapshot_listings(zfs) -> list[str]:
+  return [c for c in zfs.commands() if c.startswith('zfs list') and '-t snapshot' in c]
+
+
+def test_unchanged_datasets_are_served_from_cache(zfs, global_cache):
+  from zfsnappr.zfs import LocalZfsCli
+  zfs.add_datasets('tank', 'tank/a', 'tank/b')
+  for d in ('tank', 'tank/a', 'tank/b'):
+    zfs.add_snapshot(f'{d}@s1')
+  cli = LocalZfsCli()
+
+  first = cli.get_all_snapshots('tank', recursive=True)
+  assert len(snapshot_listings(zfs)) == 1
+  zfs.clear_commands()
+  second = cli.get_all_snapshots('tank', recursive=True)
+  assert snapshot_listings(zfs) == []
+  assert [s.properties for s in second] == [s.properties for s in first]
+
+  # a new snapshot moves snapshots_changed of its dataset only
+  zfs.tick()
+  zfs.add_snapshot('tank/a@s2')
+  zfs.clear_commands()
+  third = cli.get_all_snapshots('tank', recursive=True)
+  assert snapshot_listings(zfs) == ['zfs list -Hp -t snapshot -o name,creation,guid,zfsnappr:tags,userrefs,createtxg -d 1 tank/a']
+  assert sorted(s.longname for s in third) == ['tank/a@s1', 'tank/a@s2', 'tank/b@s1', 'tank@s1']
+
+
+def test_own_changes_invalidate_the_cache(zfs, global_cache):
+  from zfsnappr.zfs import LocalZfsCli
+  zfs.add_datasets('tank')
+  zfs.add_snapshot('tank@s1')
+  cli = LocalZfsCli()
+  cli.get_all_snapshots('tank')
+
+  # tags and holds do not move snapshots_changed
+  cli.set_tags('tank@s1', ['daily'])
+  cli.hold(['tank@s1'], 'keep')
+  [snap] = cli.get_all_snapshots('tank')
+  assert (snap.tags, snap.holds) == ({'daily'}, 1)
+
+
+def test_list_uses_the_cache(zfs, global_cache):
+  from zfsnappr.zfs import LocalZfsCli
+  zfs.add_datasets('tank')
+  zfs.add_snapshot('tank@s1')
+  cli = LocalZfsCli()
+  assert [s.longname for s in cli.iter_all_snapshots('tank')] == ['tank@s1']
+  zfs.clear_commands()
+  assert [s.longname for s in cli.iter_all_snapshots('tank')] == ['tank@s1']
+  assert snapshot_listings(zfs) == []
+  # extra properties are not cached
+  list(cli.iter_all_snapshots('tank', properties=['used']))
+  assert len(snapshot_listings(zfs)) == 1
@@ -0,0 +1,126 @@
+from __future__ import annotations
+from subprocess import CalledProcessError
+from types import SimpleNamespace
+import threading
+import time
+
+import pytest
+
+from zfsnappr import locking
+from zfsnappr.locking import DatasetLocks, LockKey, LockTimeout, lock_datasets, resolve_lock_dir, subtree_keys
+from zfsnappr.zfs import Dataset
+
+
+class FakeCli:
+  """Answers get_all_datasets like zfs list, recording the calls"""
+  host = None
+
+  def __init__(self, *names: str) -> None:
+    self.names = names
+    self.calls: list[tuple] = []
+
+  def get_all_datasets(self, properties=[], dataset=None, recursive=False):
+    self.calls.append((dataset, recursive))
+    if dataset is not None and dataset not in self.names:
+      raise CalledProcessError(1, ['zfs', 'list', dataset])
+    return [
+      Dataset({'name': n, 'guid': '1'}) for n in self.names
+      if dataset is None or n == dataset or recursive and n.startswith(dataset + '/')
+    ]
+
+
+def test_subtree_keys_lists_only_the_subtree():
+  cli = FakeCli('tank', 'tank/a', 'tank/a/b', 'tank/ab', 'other')
+  keys = subtree_keys(cli, 'tank/a', recursive=True)
+  assert sorted(k.dataset for k in keys) == ['tank/a', 'tank/a/b']
+  assert cli.calls == [('tank/a', True)]
+
+
+def test_subtree_keys_of_missing_dataset():
+  keys = subtree_keys(FakeCli('tank'), 'backup/new', recursive=True)
+  assert keys == [LockKey('localhost', 'backup/new')]
+
+
+def test_subtree_keys_without_recursion_lists_nothing():
+  cli = FakeCli('tank', 'tank/a')
+  assert subtree_keys(cli, 'tank', recursive=False) == [LockKey('localhost', 'tank')]
+  assert cli.calls == []
+
+
+def test_keys_are_locked_in_sorted_order(tmp_path):
+  keys = [LockKey('localhost', 'tank/b'), LockKey('localhost', 'tank/a'), LockKey('h', 'tank/a'), LockKey('localhost', 'tank/a')]
+  locks = DatasetLocks(keys, str(tmp_path))
+  assert locks.keys == sorted(set(keys))
+  with locks:
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(k.filename for k in set(keys))
+
+
+def test_overlapping_lock_times_out_and_names_holder(tmp_path):
+  key = LockKey('localhost', 'tank/a')
+  with DatasetLocks([key], str(tmp_path)):
+    with pytest.raises(LockTimeout, match='held by "zfsnappr'):
+      with DatasetLocks([LockKey('localhost', 'tank/b'), key], str(tmp_path), timeout=0.3):
+        pass
+  # the lock that was acquired before the timeout was released again
+  with DatasetLocks([LockKey('localhost', 'tank/b')], str(tmp_path), timeout=0):
+    pass
+
+
+def test_waiter_proceeds_after_release(tmp_path):
+  key = LockKey('localhost', 'tank/a')
+  acquired = threading.Event()
+
+  def wait() -> None:
+    with DatasetLocks([key], str(tmp_path), timeout=5):
+      acquired.set()
+
+  with DatasetLocks([key], str(tmp_path)):
+    t = threading.Thread(target=wait)
+    t.start()
+    time.sleep(0.3)
+    assert not acquired.is_set()
+  t.join()
+  assert acquired.is_set()
+
+
+def test_disjoint_locks_do_not_wait(tmp_path):
+  with DatasetLocks([LockKey('localhost', 'tank/a')], str(tmp_path)):
+    with DatasetLocks([LockKey('localhost', 'tank/b')], str(tmp_path), timeout=0):
+      pass
+
+
+def args(**kwargs) -> SimpleNamespace:
+  return SimpleNamespace(**{'dry_run': False, 'replay': None, 'lock_dir': '/nonexistent', 'lock_timeout': None, **kwargs})
+
+
+def test_dry_run_and_replay_neither_lock_nor_list():
+  def keys():
+    raise AssertionError('keys must not be listed')
+  with lock_datasets(args(dry_run=True), keys, dry_run=True):  # type: ignore
+    pass
+  with lock_datasets(args(replay='rec.jsonl'), keys):  # type: ignore
+    pass
+
+
+def test_dry_run_of_subcommands_without_one_locks(tmp_path):
+  key = LockKey('localhost', 'tank')
+  with DatasetLocks([key], str(tmp_path)):
+    with pytest.raises(LockTimeout):
+      with lock_datasets(args(dry_run=True, lock_dir=str(tmp_path), lock_timeout=0), lambda: [key]):  # type: ignore
+        pass
+
+
+def test_explicit_lock_dir_is_used_as_is(tmp_path):
+  assert resolve_lock_dir(str(tmp_path / 'locks')) == str(tmp_path / 'locks')
+
+
+def test_unwritable_default_lock_dir_falls_back(tmp_path, monkeypatch):
+  default = tmp_path / 'root-only'
+  default.mkdir(mode=0o500)
+  monkeypatch.setattr(locking, 'DEFAULT_LOCK_DIR', str(default))
+  monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path / 'run'))
+  monkeypatch.setattr(locking.os, 'access', lambda path, mode: path != str(default))
+  fallback = resolve_lock_dir(str(default))
+  assert fallback.startswith(str(tmp_path / 'run'))
+  with DatasetLocks([LockKey('localhost', 'tank')], fallback):
+    pass
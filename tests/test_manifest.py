@@ -0,0 +1,75 @@
+from __future__ import annotations
+import threading
+import time
+
+from zfsnappr.pull.manifest import PullSource, pull_concurrently
+
+
+def sources(*hosts: str) -> list[PullSource]:
+  return [PullSource(remote=f'root@{h}:tank/data{i}', dataset=f'backup/{h}/{i}') for i, h in enumerate(hosts)]
+
+
+class Recorder:
+  """Records which sources run at the same time"""
+  def __init__(self, seconds: float = 0.05) -> None:
+    self.seconds = seconds
+    self.lock = threading.Lock()
+    self.running: list[PullSource] = []
+    self.max_total = 0
+    self.max_per_host: dict[str, int] = {}
+    self.overlaps: set[frozenset[str]] = set()
+    self.started: dict[str, float] = {}  # first start per host
+    self.start = time.monotonic()
+
+  def __call__(self, source: PullSource) -> None:
+    with self.lock:
+      self.started.setdefault(source.host, time.monotonic() - self.start)
+      self.running.append(source)
+      self.max_total = max(self.max_total, len(self.running))
+      count = sum(1 for s in self.running if s.host == source.host)
+      self.max_per_host[source.host] = max(self.max_per_host.get(source.host, 0), count)
+      self.overlaps.add(frozenset(s.host for s in self.running))
+    time.sleep(self.seconds)
+    with self.lock:
+      self.running.remove(source)
+
+
+def test_saturated_host_does_not_block_other_hosts():
+  # the sources of one host come first, with one slot per host
+  recorder = Recorder()
+  # the pool is smaller than the number of queued sources of host a
+  srcs = sources('a', 'a', 'a', 'a', 'b', 'c')
+  results = pull_concurrently(srcs, recorder, jobs=3, jobs_per_host=1)
+
+  assert recorder.max_per_host == {'a': 1, 'b': 1, 'c': 1}
+  assert frozenset({'a', 'b', 'c'}) in recorder.overlaps
+  # b and c start right away instead of after the queued sources of a
+  assert recorder.started['b'] < recorder.seconds
+  assert recorder.started['c'] < recorder.seconds
+  assert [r.source for r in results] == srcs
+  assert all(r.error is None for r in results)
+
+
+def test_global_cap():
+  recorder = Recorder()
+  pull_concurrently(sources('a', 'b', 'c', 'd', 'e'), recorder, jobs=2, jobs_per_host=4)
+  assert recorder.max_total == 2
+
+
+def test_jobs_per_host():
+  recorder = Recorder()
+  pull_concurrently(sources('a', 'a', 'a', 'a', 'a'), recorder, jobs=8, jobs_per_host=2)
+  assert recorder.max_per_host == {'a': 2}
+
+
+def test_failure_does_not_affect_other_sources():
+  srcs = sources('a', 'b', 'a')
+
+  def pull(source: PullSource) -> None:
+    if source is srcs[1]:
+      raise RuntimeError('unreachable')
+
+  results = pull_concurrently(srcs, pull, jobs=2)
+  assert [r.source for r in results] == srcs
+  assert [r.error is not None for r in results] == [False, True, False]
+  assert str(results[1].error) == 'unreachable'
@@ -0,0 +1,132 @@
+from __future__ import annotations
+from typing import Optional
+
+import pytest
+
+from zfsnappr.zfs import Snapshot, Bookmark
+from zfsnappr.replication_common.plan import plan_replication
+
+
+SRC_TAG = 'zfsnappr-sendbase-1'
+DEST_TAG = 'zfsnappr-recvbase-2'
+
+
+def snap(dataset: str, shortname: str, guid: int, creation: int, createtxg: int) -> Snapshot:
+  return Snapshot({
+    'name': f'{dataset}@{shortname}', 'guid': str(guid), 'creation': str(creation), 'createtxg': str(createtxg),
+    'zfsnappr:tags': '-', 'userrefs': '0'
+  })
+
+def bookmark(dataset: str, of: Snapshot) -> Bookmark:
+  return Bookmark({
+    'name': f'{dataset}#{SRC_TAG}_{of.shortname}', 'guid': str(of.guid),
+    'creation': str(int(of.timestamp.timestamp())), 'createtxg': str(of.createtxg)
+  })
+
+def timeline(dataset: str, *shortnames: str, guids: Optional[list[int]] = None, creation: Optional[list[int]] = None) -> list[Snapshot]:
+  """Snapshots newest first, as plan_replication expects them"""
+  guids = guids or [100 + i for i in range(len(shortnames))]
+  creation = creation or [1000 + i for i in range(len(shortnames))]
+  snaps = [snap(dataset, n, g, c, 10 + i) for i, (n, g, c) in enumerate(zip(shortnames, guids, creation))]
+  return snaps[::-1]
+
+def no_holds(*sides: list[Snapshot]) -> tuple[dict[str, set[str]], dict[str, set[str]]]:
+  src, dest = ({s.longname: set() for s in side} for side in sides)
+  return src, dest
+
+def plan(source: list[Snapshot], dest: list[Snapshot], bookmarks: list[Bookmark] = [], **kwargs):
+  holds = kwargs.pop('holds', None) or no_holds(source, dest)
+  return plan_replication(source, dest, 'backup/data', bookmarks, holds=holds, holdtags=(SRC_TAG, DEST_TAG), **kwargs)
+
+
+def test_transfers_snapshots_newer_than_common_base():
+  source = timeline('tank/data', 'a', 'b', 'c', 'd')
+  dest = timeline('backup/data', 'a', 'b')
+  p = plan(source, dest)
+  assert p.base.shortname == 'b'
+  assert p.rollback is None
+  assert [(t.base.shortname, t.snapshot.shortname) for t in p.transfers] == [('b', 'c'), ('c', 'd')]
+
+
+def test_base_is_matched_by_guid_not_name():
+  source = timeline('tank/data', 'a', 'b', 'c')
+  dest = timeline('backup/data', 'a', 'b', guids=[100, 999])  # dest "b" is a different snapshot
+  p = plan(source, dest)
+  assert p.base.shortname == 'a'
+  assert p.rollback is not None and p.rollback.shortname == 'a'
+  assert [s.shortname for s in p.discard] == ['b']
+  assert [t.snapshot.shortname for t in p.transfers] == ['b', 'c']
+
+
+def test_divergence_releases_own_holds_of_discarded_snapshots():
+  source = timeline('tank/data', 'a', 'b')
+  dest = timeline('backup/data', 'a', 'x', guids=[100, 999])
+  src_holds, dest_holds = no_holds(source, dest)
+  dest_holds['backup/data@x'] = {DEST_TAG}
+  p = plan(source, dest, holds=(src_holds, dest_holds))
+  assert p.rollback is not None
+  assert p.release[1] == ['backup/data@x']
+
+
+def test_divergence_with_foreign_hold_fails():
+  source = timeline('tank/data', 'a', 'b')
+  dest = timeline('backup/data', 'a', 'x', guids=[100, 999])
+  src_holds, dest_holds = no_holds(source, dest)
+  dest_holds['backup/data@x'] = {'keep'}
+  with pytest.raises(RuntimeError, match='held by keep'):
+    plan(source, dest, holds=(src_holds, dest_holds))
+
+
+def test_no_common_snapshot_fails():
+  source = timeline('tank/data', 'a', 'b')
+  dest = timeline('backup/data', 'x', guids=[999])
+  with pytest.raises(RuntimeError, match='any snapshot in common'):
+    plan(source, dest)
+
+
+def test_holds_move_to_newest_commonly_held_snapshot():
+  source = timeline('tank/data', 'a', 'b', 'c')
+  dest = timeline('backup/data', 'a', 'b')
+  src_holds, dest_holds = no_holds(source, dest)
+  for s in source[1:]:
+    src_holds[s.longname] = {SRC_TAG}
+  for s in dest:
+    dest_holds[s.longname] = {DEST_TAG}
+  p = plan(source, dest, holds=(src_holds, dest_holds))
+  assert p.release == (['tank/data@a'], ['backup/data@a'])
+
+
+def test_selected_snapshots_are_chained():
+  source = timeline('tank/data', 'a', 'b', 'c', 'd')
+  dest = timeline('backup/data', 'a')
+  p = plan(source, dest, selected={source[0].guid, source[2].guid})
+  assert [(t.base.shortname, t.snapshot.shortname) for t in p.transfers] == [('a', 'b'), ('b', 'd')]
+
+
+def test_bookmark_base_after_source_snapshot_was_pruned():
+  source = timeline('tank/data', 'a', 'b', 'c')
+  dest = timeline('backup/data', 'a', 'b')
+  b = bookmark('tank/data', source[1])
+  pruned = [s for s in source if s.shortname != 'b']
+  p = plan(pruned, dest, [b], bookmark=True)
+  assert p.base is b
+  assert [t.snapshot.shortname for t in p.transfers] == ['c']
+  assert p.create_bookmarks == []
+
+
+def test_bookmark_base_with_snapshots_of_the_same_second():
+  # create -r or several tags at once: all snapshots have the same creation time
+  source = timeline('tank/data', 'a', 'b', 'c', creation=[1000, 1000, 1000])
+  dest = timeline('backup/data', 'a', creation=[1000])
+  b = bookmark('tank/data', source[2])
+  p = plan(source[:2], dest, [b], bookmark=True)
+  assert p.base is b
+  assert [t.snapshot.shortname for t in p.transfers] == ['b', 'c']
+
+
+def test_bookmarks_of_other_replications_are_ignored():
+  source = timeline('tank/data', 'a', 'b')
+  dest = timeline('backup/data', 'a')
+  other = Bookmark({'name': 'tank/data#zfsnappr-sendbase-7_a', 'guid': '100', 'creation': '1000', 'createtxg': '10'})
+  with pytest.raises(RuntimeError):
+    plan(source[:1], dest, [other], bookmark=True)
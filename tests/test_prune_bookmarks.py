@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from zfsnappr.zfs import Bookmark
+from zfsnappr.prune.prune_bookmarks import prune_bookmarks
+
+
+def bookmark(name: str, createtxg: int, creation: int = 1000) -> Bookmark:
+  return Bookmark({'name': f'tank#{name}', 'guid': str(createtxg), 'creation': str(creation), 'createtxg': str(createtxg)})
+
+
+class DestroyCli:
+  def __init__(self) -> None:
+    self.destroyed: list[str] = []
+
+  def destroy_bookmark(self, name: str) -> None:
+    self.destroyed.append(name)
+
+
+def test_keeps_the_newest_bookmark_within_the_same_second():
+  cli = DestroyCli()
+  bookmarks = [bookmark('zfsnappr-sendbase-1_c', 10), bookmark('zfsnappr-sendbase-1_a', 11), bookmark('zfsnappr-sendbase-1_b', 12)]
+  prune_bookmarks(cli, bookmarks, dry_run=False)  # type: ignore[arg-type]
+  assert sorted(cli.destroyed) == ['tank#zfsnappr-sendbase-1_a', 'tank#zfsnappr-sendbase-1_c']
+
+
+def test_keeps_one_per_destination_and_foreign_bookmarks():
+  cli = DestroyCli()
+  bookmarks = [bookmark('zfsnappr-sendbase-1_a', 10), bookmark('zfsnappr-sendbase-2_a', 10), bookmark('manual', 5)]
+  prune_bookmarks(cli, bookmarks, dry_run=False)  # type: ignore[arg-type]
+  assert cli.destroyed == []
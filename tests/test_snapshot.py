@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import pytest
+
+from zfsnappr.zfs import LocalZfsCli, Snapshot, MissingPropertyError, ZfsProperty
+
+
+KEY = {'name': 'tank@s1', 'creation': '1000', 'guid': '7'}
+
+
+def test_partial_snapshot_raises_on_missing_fields():
+  snap = Snapshot(KEY)
+  assert snap.longname == 'tank@s1' and snap.guid == 7
+  for field in ('tags', 'holds', 'createtxg'):
+    with pytest.raises(MissingPropertyError, match='tank@s1'):
+      getattr(snap, field)
+
+
+def test_fetched_fields():
+  snap = Snapshot({**KEY, 'zfsnappr:tags': ',a,b', 'userrefs': '2', 'createtxg': '40'})
+  assert snap.tags == {'a', 'b'} and snap.holds == 2 and snap.createtxg == 40
+  assert Snapshot({**KEY, 'zfsnappr:tags': '-'}).tags is None
+  # copies keep the fields
+  assert snap.with_shortname('s2').createtxg == 40
+
+
+def test_listing_fetches_only_requested_fields(zfs):
+  zfs.add_datasets('tank')
+  zfs.add_snapshot('tank@s1', tags='a')
+  [snap] = LocalZfsCli().get_all_snapshots('tank', fields=[ZfsProperty.CREATETXG])
+  assert snap.createtxg > 0
+  with pytest.raises(MissingPropertyError):
+    snap.tags
+  assert any(c.endswith('-o name,creation,guid,createtxg tank') for c in zfs.commands())
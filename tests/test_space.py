@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from zfsnappr.zfs import Snapshot, Dataset
+from zfsnappr.prune.space import SpacePlanner, SpaceTarget, snapshots_spec
+
+
+def snap(name: str, i: int, used: int = 1000, holds: int = 0, creation: int | None = None) -> Snapshot:
+  return Snapshot({
+    'name': f'tank@{name}', 'creation': str(1000 + i if creation is None else creation), 'guid': str(i),
+    'userrefs': str(holds), 'used': str(used), 'createtxg': str(10 + i)
+  })
+
+
+SNAPS = [snap(f's{i}', i) for i in range(16)]
+
+
+class SpaceCli:
+  """Destroying snapshots reclaims their used space, and the blocks that only adjacent ones share"""
+  def __init__(self, available: int = 0, shared: int = 0, snaps: list[Snapshot] = SNAPS) -> None:
+    self.available = available
+    self.shared = shared
+    self.snaps = snaps
+    self.estimates: list[str] = []
+
+  def get_dataset(self, name: str, properties: list[str]) -> Dataset:
+    return Dataset({'name': name, 'guid': '1', 'available': str(self.available)})
+
+  def estimate_destroy(self, dataset: str, spec: str) -> int:
+    self.estimates.append(spec)
+    names = [s.shortname for s in self.snaps]
+    selected: list[int] = []
+    for part in spec.split(','):
+      first, _, last = part.partition('%')
+      selected += range(names.index(first), names.index(last or first) + 1)
+    unique = sum(int(self.snaps[i].properties['used']) for i in selected)
+    return unique + self.shared * sum(1 for i in selected if i+1 in selected)
+
+
+def plan(cli: SpaceCli, target: SpaceTarget, destroy: list[Snapshot]) -> list[Snapshot]:
+  planner = SpacePlanner(cli, target, SNAPS)  # type: ignore[arg-type]
+  keep = [s for s in SNAPS if s not in destroy]
+  new_keep, new_destroy = planner.limit('tank', keep, destroy)
+  assert sorted(s.guid for s in new_keep + new_destroy) == [s.guid for s in SNAPS]
+  return new_destroy
+
+
+def test_spec_collapses_adjacent_snapshots():
+  assert snapshots_spec(SNAPS[:6], [SNAPS[0], SNAPS[1], SNAPS[2], SNAPS[4]]) == 's0%s2,s4'
+  assert snapshots_spec(SNAPS[:3], [SNAPS[1]]) == 's1'
+  assert snapshots_spec(SNAPS[:3], []) == ''
+
+
+def test_destroys_the_fewest_oldest_snapshots_that_reach_the_target():
+  # their used space alone needs 6 snapshots, but 4 reclaim 4000 + 3*500 with the shared blocks
+  cli = SpaceCli(available=0, shared=500)
+  destroyed = plan(cli, SpaceTarget(available=5500), SNAPS[:12])
+  assert [s.shortname for s in destroyed] == ['s0', 's1', 's2', 's3']
+  # binary search below the bound given by the used space
+  assert len(cli.estimates) <= 4
+
+
+def test_destroys_all_candidates_if_the_target_cannot_be_met():
+  cli = SpaceCli(available=0)
+  destroyed = plan(cli, SpaceTarget(available=10**9), SNAPS[:5])
+  assert destroyed == SNAPS[:5]
+  assert cli.estimates == ['s0%s4']
+
+
+def test_met_target_and_held_snapshots():
+  cli = SpaceCli(available=10**6)
+  assert plan(cli, SpaceTarget(available=1000), SNAPS[:5]) == []
+  assert cli.estimates == []
+
+  held = snap('held', 99, holds=1)
+  planner = SpacePlanner(SpaceCli(available=0), SpaceTarget(available=10**9), [held])  # type: ignore[arg-type]
+  keep, destroy = planner.limit('tank', [], [held])
+  assert keep == [held] and destroy == []
+
+
+
+def test_snapshots_of_the_same_second_are_ordered_by_createtxg():
+  same = [snap(f't{i}', i, creation=5000) for i in range(4)]
+  cli = SpaceCli(available=0, snaps=same)
+  # listed in another order, as sorting by creation may return them
+  planner = SpacePlanner(cli, SpaceTarget(available=1500), same[::-1])  # type: ignore[arg-type]
+  keep, destroy = planner.limit('tank', [], same[::-1])
+  assert [s.shortname for s in destroy] == ['t1', 't0']
+  assert [s.shortname for s in keep] == ['t2', 't3']
+  assert 't0%t1' in cli.estimates
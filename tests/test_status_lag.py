@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from zfsnappr.zfs import Dataset, Snapshot, Bookmark
+from zfsnappr.status.lag import Side, compare, compare_dataset
+from zfsnappr.replication_common.replicate_snaps import holdtag_src, holdtag_dest
+
+
+SOURCE = Dataset({'name': 'tank/data', 'guid': '1'})
+DEST = Dataset({'name': 'backup/data', 'guid': '2'})
+
+
+def snaps(dataset: str, *specs: tuple[str, int, int]) -> list[Snapshot]:
+  """specs are (shortname, guid, creation), oldest first; createtxg follows the order"""
+  return [
+    Snapshot({'name': f'{dataset}@{n}', 'guid': str(g), 'creation': str(c), 'createtxg': str(10 + i), 'userrefs': '0'})
+    for i, (n, g, c) in enumerate(specs)
+  ]
+
+def own_bookmark(of: Snapshot) -> Bookmark:
+  return Bookmark({
+    'name': f'{of.dataset}#{holdtag_src(DEST)}_{of.shortname}', 'guid': str(of.guid),
+    'creation': str(int(of.timestamp.timestamp())), 'createtxg': str(of.createtxg)
+  })
+
+def status(source_snaps, dest_snaps, source_holds={}, dest_holds={}, bookmarks=[], dest=DEST):
+  return compare_dataset(SOURCE, source_snaps, source_holds, dest, 'backup/data', dest_snaps, dest_holds, bookmarks)
+
+
+def test_current():
+  s = status(snaps('tank/data', ('a', 1, 100), ('b', 2, 200)), snaps('backup/data', ('a', 1, 100), ('b', 2, 200)))
+  assert (s.state, s.behind, s.lag, s.base, s.base_creation) == ('current', 0, 0, 'b', 200)
+  assert s.ok
+
+
+def test_behind():
+  s = status(snaps('tank/data', ('a', 1, 100), ('b', 2, 200), ('c', 3, 350)), snaps('backup/data', ('a', 1, 100)))
+  assert (s.state, s.behind, s.lag, s.base) == ('behind', 2, 250, 'a')
+  assert s.ok
+
+
+def test_diverged():
+  s = status(snaps('tank/data', ('a', 1, 100), ('b', 2, 200)), snaps('backup/data', ('a', 1, 100), ('x', 9, 300)))
+  assert (s.state, s.behind, s.base) == ('diverged', 1, 'a')
+  assert not s.ok
+
+
+def test_no_common_snapshot():
+  s = status(snaps('tank/data', ('a', 1, 100)), snaps('backup/data', ('x', 9, 100)))
+  assert (s.state, s.behind, s.base) == ('no common snapshot', 1, None)
+  assert not s.ok
+
+
+def test_missing_and_no_snapshots():
+  assert status(snaps('tank/data', ('a', 1, 100)), [], dest=None).state == 'missing'
+  assert status([], snaps('backup/data', ('a', 1, 100))).state == 'no snapshots'
+
+
+def test_bookmark_base_after_source_snapshot_was_pruned():
+  source = snaps('tank/data', ('a', 1, 100), ('b', 2, 200), ('c', 3, 300))
+  dest = snaps('backup/data', ('a', 1, 100), ('b', 2, 200))
+  pruned = [source[2]]
+  s = status(pruned, dest, bookmarks=[own_bookmark(source[1])])
+  assert (s.state, s.behind, s.lag, s.base) == ('behind', 1, 100, 'b')
+  # without the bookmark, there would be nothing in common
+  assert status(pruned, dest).state == 'no common snapshot'
+
+
+def test_bookmarks_of_other_replications_are_ignored():
+  source = snaps('tank/data', ('a', 1, 100), ('b', 2, 200))
+  other = Bookmark({'name': 'tank/data#zfsnappr-sendbase-7_a', 'guid': '1', 'creation': '100', 'createtxg': '10'})
+  s = status(source[1:], snaps('backup/data', ('a', 1, 100)), bookmarks=[other])
+  assert s.state == 'no common snapshot'
+
+
+def test_behind_counts_snapshots_of_the_same_second_as_the_base():
+  source = snaps('tank/data', ('a', 1, 100), ('b', 2, 100), ('c', 3, 100))
+  s = status(source, snaps('backup/data', ('a', 1, 100)))
+  assert (s.state, s.behind, s.lag) == ('behind', 2, 0)
+
+
+def test_stale_holds():
+  source = snaps('tank/data', ('a', 1, 100), ('b', 2, 200))
+  dest = snaps('backup/data', ('a', 1, 100), ('b', 2, 200))
+  source_holds = {'tank/data@a': {holdtag_src(DEST)}, 'tank/data@b': {holdtag_src(DEST)}}
+  dest_holds = {'backup/data@b': {holdtag_dest(SOURCE), 'keep'}}
+  s = status(source, dest, source_holds, dest_holds)
+  assert s.stale_holds == [f'tank/data@a:{holdtag_src(DEST)}']
+
+
+def test_compare_maps_child_datasets():
+  child = Dataset({'name': 'tank/data/child', 'guid': '3'})
+  source = Side(exists=True, datasets={'tank/data': SOURCE, 'tank/data/child': child},
+                snaps={'tank/data': snaps('tank/data', ('a', 1, 100)), 'tank/data/child': snaps('tank/data/child', ('a', 4, 100))})
+  dest = Side(exists=True, datasets={'backup/data': DEST}, snaps={'backup/data': snaps('backup/data', ('a', 1, 100))})
+  statuses = compare(source, 'tank/data', dest, 'backup/data')
+  assert [(s.source, s.dest, s.state) for s in statuses] == [
+    ('tank/data', 'backup/data', 'current'),
+    ('tank/data/child', 'backup/data/child', 'missing')
+  ]
@@ -0,0 +1,29 @@
+from zfsnappr.prune import throttle
+from zfsnappr.prune.throttle import DestroyThrottle, ThrottleSettings
+
+
+class FreeingCli:
+  def __init__(self, *freeing: int) -> None:
+    self.freeing = list(freeing)
+    self.polls = 0
+
+  def get_pool_freeing(self, pool: str) -> int:
+    self.polls += 1
+    return self.freeing.pop(0) if len(self.freeing) > 1 else self.freeing[0]
+
+
+def test_destroys_within_the_poll_interval_share_one_poll(monkeypatch):
+  monkeypatch.setattr(throttle.time, 'sleep', lambda s: None)
+  cli = FreeingCli(0)
+  t = DestroyThrottle(cli, ThrottleSettings(max_freeing=100, target_latency=1, poll_interval=60))  # type: ignore[arg-type]
+  for _ in range(20):
+    t.wait('tank')
+    t.observe('tank', 0.01)
+  assert cli.polls == 1
+
+
+def test_waits_and_polls_again_while_backlog_is_high():
+  cli = FreeingCli(500, 500, 0)
+  t = DestroyThrottle(cli, ThrottleSettings(max_freeing=100, target_latency=1, poll_interval=0.01))  # type: ignore[arg-type]
+  t.wait('tank')
+  assert cli.polls == 3
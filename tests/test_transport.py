@@ -0,0 +1,54 @@
+from __future__ import annotations
+import subprocess
+
+import pytest
+
+from zfsnappr.transport import Compression, Transport, parse_compression, pipeline_script
+
+
+def run(*commands: list[str]) -> subprocess.CompletedProcess:
+  return subprocess.run(['sh', '-c', pipeline_script(list(commands))], capture_output=True, text=True)
+
+
+def test_pipes_the_commands():
+  p = run(['printf', 'a\\nb\\n'], ['tr', 'a-z', 'A-Z'], ['cat'])
+  assert (p.returncode, p.stdout) == (0, 'A\nB\n')
+
+
+def test_failing_head_is_reported():
+  assert run(['sh', '-c', 'echo x; exit 4'], ['cat']).returncode == 4
+
+
+def test_failing_middle_is_reported():
+  assert run(['echo', 'x'], ['sh', '-c', 'cat; exit 6'], ['cat']).returncode == 6
+
+
+def test_failing_last_is_reported_instead_of_sigpipe_upstream():
+  # like zfs receive failing while the compressor still writes
+  p = run(['yes'], ['cat'], ['sh', '-c', 'head -c 1 > /dev/null; exit 5'])
+  assert p.returncode == 5
+
+
+def test_first_real_failure_wins():
+  assert run(['sh', '-c', 'exit 3'], ['sh', '-c', 'cat; exit 7']).returncode == 3
+
+
+def test_temporary_directory_is_removed(tmp_path):
+  p = subprocess.run(['sh', '-c', pipeline_script([['echo', 'x'], ['cat']])], env={'TMPDIR': str(tmp_path), 'PATH': '/usr/bin:/bin'})
+  assert p.returncode == 0
+  assert list(tmp_path.iterdir()) == []
+
+
+def test_parse_compression():
+  assert parse_compression('zstd') == Compression('zstd')
+  assert parse_compression('lz4:1') == Compression('lz4', 1)
+  with pytest.raises(ValueError):
+    parse_compression('gzip')
+
+
+def test_tcp_transport_listens_on_the_remote_side():
+  send, receive = Transport(tcp_port=9000).filters(source_host=None, dest_host='backup')
+  assert send == [['socat', '-u', 'STDIN', 'TCP:backup:9000,retry=10,interval=1']]
+  assert receive == [['socat', '-u', 'TCP-LISTEN:9000,reuseaddr', 'STDOUT']]
+  with pytest.raises(ValueError):
+    Transport(tcp_port=9000).filters('a', 'b')